@@ -0,0 +1,166 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimited(Exception):
+    # Raised when a Gemini call is refused; retry_after is in seconds
+    def __init__(self, message, retry_after, scope):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.scope = scope
+
+
+class TokenBucket:
+    # rate tokens per second up to burst. reserve() may take tokens the bucket does not have
+    # yet (the balance goes negative) and returns how long the caller must wait for them.
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, max_wait=0.0):
+        # Seconds to wait before the call may go ahead, or None (nothing taken) if that is longer
+        # than max_wait. Not thread-safe; the limiter holds its lock.
+        self._refill(time.monotonic())
+        wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+        if wait > max_wait:
+            return None
+        self.tokens -= 1
+        return wait
+
+    def retry_after(self):
+        return (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+
+    def refund(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+class GeminiAdmission:
+    # Token buckets in front of Gemini: one per user, so a single user cannot spend everyone's
+    # quota, and one for the whole process. A user over their rate is refused at once; when
+    # only the process is over its rate the call waits up to max_wait seconds for a token
+    # before it is refused. A rate of 0 turns that limit off.
+
+    def __init__(self, user_rate=10, user_burst=5, global_rate=60, global_burst=20, max_wait=5.0,
+                 max_users=10000):
+        self.user_rate = user_rate / 60.0
+        self.user_burst = user_burst
+        self.max_wait = max_wait
+        self.max_users = max_users
+        self.global_bucket = TokenBucket(global_rate / 60.0, global_burst) if global_rate > 0 else None
+        self._users = OrderedDict()  # user key -> TokenBucket, least recently used first
+        self._lock = threading.Lock()
+        self._counters = {'admitted': 0, 'queued': 0, 'rejected_user': 0, 'rejected_global': 0}
+        self._queued_seconds = 0.0
+
+    def _user_bucket(self, key):
+        bucket = self._users.get(key)
+        if bucket is None:
+            bucket = self._users[key] = TokenBucket(self.user_rate, self.user_burst)
+            if len(self._users) > self.max_users:
+                # The least recently seen user has long since refilled to a full burst
+                self._users.popitem(last=False)
+        self._users.move_to_end(key)
+        return bucket
+
+    def admit(self, key):
+        # Takes a token for one Gemini call on behalf of key (a user id or address); sleeps
+        # while queued for the global bucket and raises RateLimited when refused
+        with self._lock:
+            user_bucket = self._user_bucket(key) if self.user_rate > 0 else None
+            if user_bucket is not None and user_bucket.reserve() is None:
+                self._counters['rejected_user'] += 1
+                raise RateLimited('Too many calorie lookups. Please wait a moment and try again.',
+                                  user_bucket.retry_after(), 'user')
+            wait = self.global_bucket.reserve(self.max_wait) if self.global_bucket else 0.0
+            if wait is None:
+                if user_bucket is not None:
+                    user_bucket.refund()
+                self._counters['rejected_global'] += 1
+                raise RateLimited('Calorie lookups are busy right now. Please try again shortly.',
+                                  self.global_bucket.retry_after() - self.max_wait, 'global')
+            self._counters['admitted'] += 1
+            if wait > 0:
+                self._counters['queued'] += 1
+                self._queued_seconds += wait
+        if wait > 0:
+            time.sleep(wait)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['queued_seconds'] = round(self._queued_seconds, 3)
+            stats['tracked_users'] = len(self._users)
+        return stats
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.refused = False
+
+
+class SingleFlight:
+    # Identical calls made while one is already running wait for it and share its result
+    # (or exception) instead of making their own request.
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._counters = {'leaders': 0, 'coalesced': 0}
+
+    def do(self, key, fn, admit=None):
+        # Returns fn()'s result. Only the caller that ends up running fn calls admit() first;
+        # if admit refuses, callers that joined in the meantime try again on their own account.
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                    self._counters['leaders'] += 1
+                else:
+                    self._counters['coalesced'] += 1
+            if leader:
+                return self._lead(key, call, fn, admit)
+            call.done.wait()
+            if call.refused:
+                with self._lock:
+                    self._counters['coalesced'] -= 1
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+    def _lead(self, key, call, fn, admit):
+        try:
+            if admit is not None:
+                try:
+                    admit()
+                except Exception:
+                    call.refused = True
+                    raise
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['in_flight'] = len(self._calls)
+        return stats
@@ -0,0 +1,232 @@
+import argparse
+import time
+import warnings
+from datetime import datetime, timedelta
+
+from sqlalchemy import String, cast, insert, select
+
+from models import db, User, StepRecord, WellnessRecord, WellnessTrend
+
+try:
+    import numpy as np
+    import pandas as pd
+except ImportError:  # only the nightly job needs them; pages read the stored summaries
+    np = pd = None
+
+# Nightly wellness trends for every user and department, computed on users x days matrices
+# so each statistic is a handful of array operations regardless of head count:
+#   python analytics.py --days 90        (e.g. from cron at 02:00)
+# The therapy page renders the stored WellnessTrend summaries.
+
+METRICS = ('steps', 'sleep_hours', 'stress_level', 'mood_score')
+CORRELATIONS = (('sleep_hours', 'stress_level'), ('sleep_hours', 'mood_score'),
+                ('steps', 'mood_score'), ('steps', 'stress_level'))
+AVERAGE_WINDOWS = (7, 30)
+STEP_GOAL = 10000
+MIN_PAIRED_DAYS = 10     # days with both values before a correlation is reported
+MIN_BASELINE_DAYS = 14   # days of history before recent values can be flagged
+RECENT_DAYS = 7
+ANOMALY_Z = 2.5
+
+
+def load_matrices(start, end):
+    # One bulk query per table, scattered into (users x days) float matrices with NaN for no entry
+    days = (end - start).days + 1
+    users = pd.DataFrame(db.session.execute(select(User.id, User.department_id)).all(),
+                         columns=['user_id', 'department_id'])
+    index = pd.Index(users['user_id'])
+    matrices = {metric: np.full((len(users), days), np.nan) for metric in METRICS}
+
+    for columns in ((StepRecord.user_id, StepRecord.date, StepRecord.steps),
+                    (WellnessRecord.user_id, WellnessRecord.date, WellnessRecord.sleep_hours,
+                     WellnessRecord.stress_level, WellnessRecord.mood_score)):
+        # Dates come back as ISO text, which numpy parses far faster than per-row date objects
+        user_id, model_date, *values = columns
+        frame = pd.DataFrame(
+            db.session.execute(select(user_id, cast(model_date, String), *values).where(
+                model_date.between(start, end))).all(),
+            columns=[column.key for column in columns]
+        )
+        if frame.empty:
+            continue
+        rows = index.get_indexer(frame['user_id'])
+        cols = (frame['date'].to_numpy(dtype='datetime64[D]') - np.datetime64(start, 'D')).astype(int)
+        known = rows >= 0
+        for metric in values:
+            matrices[metric.key][rows[known], cols[known]] = frame[metric.key].to_numpy(dtype=float)[known]
+    return users, matrices
+
+
+def department_matrices(users, matrices):
+    # Daily department means of each metric, one row per department
+    assigned = users['department_id'].notna().to_numpy()
+    codes = users['department_id'][assigned].astype(int).to_numpy()
+    departments = np.unique(codes)
+    return departments, {
+        metric: pd.DataFrame(matrix[assigned]).groupby(codes).mean().reindex(departments).to_numpy()
+        for metric, matrix in matrices.items()
+    }
+
+
+def rolling_mean(matrix, window):
+    # Mean of the values present in each trailing window (NaN when there are none)
+    valid = ~np.isnan(matrix)
+    sums = np.pad(np.cumsum(np.where(valid, matrix, 0.0), axis=1), ((0, 0), (1, 0)))
+    counts = np.pad(np.cumsum(valid, axis=1), ((0, 0), (1, 0)))
+    ends = np.arange(1, matrix.shape[1] + 1)
+    starts = np.maximum(ends - window, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums[:, ends] - sums[:, starts]) / (counts[:, ends] - counts[:, starts])
+
+
+def trailing_run(flags):
+    reversed_flags = flags[:, ::-1]
+    return np.where(reversed_flags.all(axis=1), flags.shape[1], np.argmin(reversed_flags, axis=1))
+
+
+def current_streak(flags):
+    # Consecutive flagged days ending today, or yesterday while today is still open
+    return np.where(flags[:, -1], trailing_run(flags), trailing_run(flags[:, :-1]))
+
+
+def longest_streak(flags):
+    positions = np.arange(flags.shape[1])
+    last_break = np.maximum.accumulate(np.where(flags, -1, positions), axis=1)
+    runs = np.where(flags, positions - last_break, 0)
+    return runs.max(axis=1)
+
+
+def paired_correlation(x, y):
+    # Pearson r per row over the days where both values exist
+    both = ~np.isnan(x) & ~np.isnan(y)
+    paired = both.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = np.where(both, x, 0).sum(axis=1) / paired
+        y_mean = np.where(both, y, 0).sum(axis=1) / paired
+        dx = np.where(both, x - x_mean[:, None], 0)
+        dy = np.where(both, y - y_mean[:, None], 0)
+        r = (dx * dy).sum(axis=1) / np.sqrt((dx ** 2).sum(axis=1) * (dy ** 2).sum(axis=1))
+    r[paired < MIN_PAIRED_DAYS] = np.nan
+    return r, paired
+
+
+def anomaly_scores(matrix):
+    # z-scores of the last RECENT_DAYS against each row's earlier baseline
+    baseline, recent = matrix[:, :-RECENT_DAYS], matrix[:, -RECENT_DAYS:]
+    with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+        warnings.simplefilter('ignore', RuntimeWarning)  # rows with no baseline at all
+        mean = np.nanmean(baseline, axis=1)
+        std = np.nanstd(baseline, axis=1)
+        z = (recent - mean[:, None]) / std[:, None]
+    enough = (~np.isnan(baseline)).sum(axis=1) >= MIN_BASELINE_DAYS
+    z[~enough | (std == 0)] = np.nan
+    return z
+
+
+def _json_rows(matrix, digits=1):
+    # Row lists with NaN as None, rounded once for the whole matrix
+    values = np.round(matrix, digits).astype(object)
+    values[np.isnan(matrix)] = None
+    return values.tolist()
+
+
+def compute_summaries(ids, matrices, dates, streaks=True):
+    day_count = len(dates)
+    sample_at = list(range(day_count - 1, -1, -7))[::-1]  # one trend point per week, ending today
+    averages = {metric: {f'{window}d': _json_rows(rolling_mean(matrix, window)[:, -1:])
+                         for window in AVERAGE_WINDOWS + (day_count,)}
+                for metric, matrix in matrices.items()}
+    trends = {metric: _json_rows(rolling_mean(matrix, 7)[:, sample_at]) for metric, matrix in matrices.items()}
+    correlations = {f'{x}~{y}': paired_correlation(matrices[x], matrices[y]) for x, y in CORRELATIONS}
+    correlations = {name: (_json_rows(r[:, None], 2), paired.tolist()) for name, (r, paired) in correlations.items()}
+
+    flagged = []
+    for metric, matrix in matrices.items():
+        z = anomaly_scores(matrix)
+        for row, column in zip(*np.nonzero(np.abs(np.nan_to_num(z)) > ANOMALY_Z)):
+            day = day_count - RECENT_DAYS + column
+            flagged.append((row, {'date': dates[day].isoformat(), 'metric': metric,
+                                  'value': round(float(matrix[row, day]), 1), 'z': round(float(z[row, column]), 1)}))
+    anomalies = {}
+    for row, anomaly in flagged:
+        anomalies.setdefault(row, []).append(anomaly)
+
+    streak_values = {}
+    if streaks:
+        logged = ~np.isnan(matrices['steps'])
+        flags = {'logging': logged, 'step_goal': np.nan_to_num(matrices['steps']) >= STEP_GOAL,
+                 'checkin': ~np.isnan(matrices['mood_score']) | ~np.isnan(matrices['sleep_hours'])}
+        streak_values = {name: (current_streak(value).tolist(), longest_streak(value).tolist())
+                         for name, value in flags.items()}
+
+    trend_dates = [dates[index].isoformat() for index in sample_at]
+    summaries = []
+    for row, subject_id in enumerate(ids):
+        summary = {
+            'averages': {metric: {window: values[row][0] for window, values in windows.items()}
+                         for metric, windows in averages.items()},
+            'trend_dates': trend_dates,
+            'trends': {metric: values[row] for metric, values in trends.items()},
+            'correlations': {name: {'r': r[row][0], 'days': paired[row]} for name, (r, paired) in correlations.items()},
+            'anomalies': anomalies.get(row, []),
+        }
+        if streaks:
+            summary['streaks'] = {name: {'current': current[row], 'longest': longest[row]}
+                                  for name, (current, longest) in streak_values.items()}
+        summaries.append((int(subject_id), summary))
+    return summaries
+
+
+def store(scope, summaries, start, end):
+    # Replaces the scope's summaries in one transaction
+    now = datetime.utcnow()
+    WellnessTrend.query.filter_by(scope=scope).delete(synchronize_session=False)
+    rows = [{'scope': scope, 'subject_id': subject_id, 'window_start': start, 'window_end': end,
+             'summary': summary, 'computed_at': now} for subject_id, summary in summaries]
+    for offset in range(0, len(rows), 2000):
+        db.session.execute(insert(WellnessTrend), rows[offset:offset + 2000])
+    db.session.commit()
+
+
+def run(days=90, end=None):
+    if pd is None:
+        raise RuntimeError('Wellness analytics requires numpy and pandas (pip install numpy pandas)')
+    if days <= RECENT_DAYS:
+        raise ValueError(f'days must be greater than {RECENT_DAYS}')
+    started = time.perf_counter()
+    end = end or datetime.utcnow().date()
+    start = end - timedelta(days=days - 1)
+    dates = [start + timedelta(days=offset) for offset in range(days)]
+
+    users, matrices = load_matrices(start, end)
+    loaded = time.perf_counter()
+    user_summaries = compute_summaries(users['user_id'].to_numpy(), matrices, dates)
+    departments, department_values = department_matrices(users, matrices)
+    department_summaries = compute_summaries(departments, department_values, dates, streaks=False)
+    computed = time.perf_counter()
+
+    store('user', user_summaries, start, end)
+    store('department', department_summaries, start, end)
+    return {
+        'users': len(user_summaries),
+        'departments': len(department_summaries),
+        'load_seconds': round(loaded - started, 2),
+        'compute_seconds': round(computed - loaded, 2),
+        'store_seconds': round(time.perf_counter() - computed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute wellness trends for every user and department.')
+    parser.add_argument('--days', type=int, default=90, help='length of the analysis window')
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        result = run(args.days)
+    print(', '.join(f'{key}: {value}' for key, value in result.items()))
+
+
+if __name__ == '__main__':
+    main()
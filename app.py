@@ -1,15 +1,36 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session, flash
+from flask import Flask, render_template, request, redirect, url_for, jsonify, session, flash, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-import requests
 import os
+import hmac
+import math
+import re
 from dotenv import load_dotenv
 import random
-from google_auth_oauthlib.flow import Flow
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
-from models import db, User, WellnessRecord, StepRecord, NutritionRecord, Department, DepartmentNutrition
-from datetime import datetime
-import json
+from models import db, User, WellnessRecord, StepRecord, NutritionRecord, Department, AnalysisJob, WellnessTrend
+from database import configure_database
+from migrations import upgrade_schema
+from upserts import write_steps, write_wellness
+from rollups import (RollupBatch, PERIODS as ROLLUP_PERIODS, bucket_start, department_ranking,
+                     department_series, ensure_built as ensure_rollups)
+from ingest import StepIngestor
+from archive import monthly_totals
+from export import EXPORTS, FORMATS as EXPORT_FORMATS, export, parquet_available
+from food_cache import FoodLookupCache, normalize_food_query
+from nutrition_index import NutritionIndex
+from image_cache import ImageAnalysisCache, content_hash
+from image_prep import ImagePreprocessor, UploadTooLarge, read_upload
+from jobs import AnalysisJobQueue, QueueFull, RetryLater
+from leaderboard import Leaderboard
+from user_cache import UserCache
+from response_cache import ResponseCache
+from static_assets import StaticAssets
+from live import LiveEvents
+from google_login import GoogleLogin
+from gemini_client import GeminiClient, GeminiError, GeminiResponseError, GeminiUnavailable
+from admission import GeminiAdmission, RateLimited, SingleFlight
+from metrics import Metrics, configure_logging
+import logging
+from datetime import date, datetime, timedelta
 
 # --- EXPLICITLY LOAD .env FILE ---
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
@@ -19,35 +40,153 @@ if os.path.exists(dotenv_path):
 
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
+configure_logging()
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev_key_for_testing')
 
-# Database Configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///altabwell.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Database Configuration (DATABASE_URL, defaults to instance/altabwell.db)
+configure_database(app)
 
 # Initialize extensions
-db.init_app(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# Create any tables and indexes added since the database was first initialized
+with app.app_context():
+    db.create_all()
+    upgrade_schema()
+    ensure_rollups()
+
+# Request latency, SQL counts and component stats, served on /metrics
+# (SLOW_REQUEST_PROFILE_MS turns on cProfile dumps for slow requests)
+metrics = Metrics()
+with app.app_context():
+    metrics.init_app(app, db.engine)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
 # Google OAuth Configuration
 GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
 GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
 GOOGLE_REDIRECT_URI = 'http://localhost:8000/auth/google/callback'
 
+# Built once per process: pooled token exchanges and cached signing certs for ID tokens
+google_login = GoogleLogin(
+    GOOGLE_CLIENT_ID,
+    GOOGLE_CLIENT_SECRET,
+    GOOGLE_REDIRECT_URI,
+    pool_size=int(os.environ.get('GOOGLE_POOL_SIZE', 10)),
+    timeout=float(os.environ.get('GOOGLE_TIMEOUT_SECONDS', 10))
+)
+
+# Shared secret for service-to-service endpoints such as bulk step ingestion
+SERVICE_API_TOKEN = os.environ.get('SERVICE_API_TOKEN')
+
+# Load tests sign in through /test-login/<user_id> instead of Google; never enable in production
+ENABLE_TEST_LOGIN = os.environ.get('ENABLE_TEST_LOGIN') == '1'
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 1000))
+
 # --- NEW: Gemini API Configuration ---
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
+# Point GEMINI_API_BASE at fake_gemini.py to run without the real API
+GEMINI_API_BASE = os.environ.get('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com')
+
+# Shared keep-alive client used by every route and analysis worker
+gemini = GeminiClient(
+    GEMINI_API_KEY,
+    base_url=GEMINI_API_BASE,
+    pool_size=int(os.environ.get('GEMINI_POOL_SIZE', 10)),
+    read_timeout=float(os.environ.get('GEMINI_TIMEOUT_SECONDS', 30)),
+    max_retries=int(os.environ.get('GEMINI_MAX_RETRIES', 3)),
+    breaker_threshold=int(os.environ.get('GEMINI_BREAKER_THRESHOLD', 5)),
+    breaker_reset=float(os.environ.get('GEMINI_BREAKER_RESET_SECONDS', 30))
+)
 # ------------------------------------
 
+# Identical lookups already in flight share one Gemini call, and each user (and the process as a
+# whole) may only start so many per minute; excess calls get a 429 with Retry-After
+gemini_flight = SingleFlight()
+gemini_admission = GeminiAdmission(
+    user_rate=float(os.environ.get('GEMINI_USER_RATE_PER_MINUTE', 10)),
+    user_burst=int(os.environ.get('GEMINI_USER_BURST', 5)),
+    global_rate=float(os.environ.get('GEMINI_GLOBAL_RATE_PER_MINUTE', 60)),
+    global_burst=int(os.environ.get('GEMINI_GLOBAL_BURST', 20)),
+    max_wait=float(os.environ.get('GEMINI_QUEUE_MAX_WAIT_SECONDS', 5))
+)
+
+# Normalized calorie lookups, answered locally before calling Gemini
+food_cache = FoodLookupCache(
+    ttl_seconds=int(os.environ.get('FOOD_CACHE_TTL_SECONDS', 30 * 24 * 3600)),
+    memory_size=int(os.environ.get('FOOD_CACHE_MEMORY_SIZE', 1024)),
+    max_rows=int(os.environ.get('FOOD_CACHE_MAX_ROWS', 50000))
+)
+
+# Offline calories and macros for common foods (data/foods.csv), checked before the cache and Gemini
+nutrition_index = NutritionIndex(
+    os.environ.get('NUTRITION_INDEX_PATH', os.path.join(app.instance_path, 'nutrition_index.db'))
+)
+nutrition_index.ensure_built()
+
+# Rolling 7-day step leaderboard served from memory
+step_leaderboard = Leaderboard(
+    app,
+    top_n=int(os.environ.get('LEADERBOARD_SIZE', 10)),
+    reconcile_interval=int(os.environ.get('LEADERBOARD_RECONCILE_SECONDS', 300))
+)
+
+# Photos are downscaled before they are queued and sent to Gemini
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 16 * 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_BYTES + 64 * 1024  # leave room for the form fields
+image_preprocessor = ImagePreprocessor(
+    max_dimension=int(os.environ.get('UPLOAD_MAX_DIMENSION', 1024)),
+    quality=int(os.environ.get('UPLOAD_JPEG_QUALITY', 80)),
+    image_format=os.environ.get('UPLOAD_IMAGE_FORMAT', 'JPEG')
+)
+
+# Calorie estimates for previously analyzed food photos
+image_cache = ImageAnalysisCache(
+    max_distance=int(os.environ.get('IMAGE_CACHE_MAX_DISTANCE', 4)),
+    max_rows=int(os.environ.get('IMAGE_CACHE_MAX_ROWS', 20000))
+)
+
+# Signed-in users are served from a short-lived snapshot instead of a query per request
+user_cache = UserCache(
+    ttl_seconds=int(os.environ.get('USER_CACHE_TTL_SECONDS', 60)),
+    max_entries=int(os.environ.get('USER_CACHE_SIZE', 10000))
+)
+
+# Rendered index, leaderboard and dashboard pages with ETag/304 support; write routes
+# invalidate the viewer's pages (and the leaderboard when steps or wellness change)
+response_cache = ResponseCache(
+    ttl_seconds=int(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', 30)),
+    max_entries=int(os.environ.get('RESPONSE_CACHE_SIZE', 5000))
+)
+
+# Fingerprinted /static URLs, cached by browsers for STATIC_MAX_AGE_SECONDS
+static_assets = StaticAssets(max_age=int(os.environ.get('STATIC_MAX_AGE_SECONDS', 365 * 24 * 3600)))
+static_assets.init_app(app)
+
+# Leaderboard and dashboard totals pushed to open pages over Server-Sent Events, served on
+# LIVE_EVENTS_HOST:LIVE_EVENTS_PORT by an asyncio loop in this process (0 disables). Behind a
+# proxy, route LIVE_EVENTS_URL (e.g. https://example.com/events) to that port.
+live_events = LiveEvents(
+    host=os.environ.get('LIVE_EVENTS_HOST', '127.0.0.1'),
+    port=int(os.environ.get('LIVE_EVENTS_PORT', 8001)),
+    public_url=os.environ.get('LIVE_EVENTS_URL'),
+    max_clients=int(os.environ.get('LIVE_EVENTS_MAX_CLIENTS', 10000))
+)
+live_events.init_app(app)
+
 # User loader for Flask-Login
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.get(int(user_id))
 
 
 @app.route('/')
+@response_cache.cached()
 def index():
     wellness_quotes = [
         {"text": "Take care of your body. It’s the only place you have to live.", "author": "Jim Rohn"},
@@ -83,54 +222,27 @@ def logout():
     logout_user()
     return redirect(url_for('index'))
 
+if ENABLE_TEST_LOGIN:
+    logger.warning("ENABLE_TEST_LOGIN is set: /test-login lets anyone sign in as any user")
+
+    @app.route('/test-login/<int:user_id>')
+    def test_login(user_id):
+        user = db.session.get(User, user_id)
+        if not user:
+            return jsonify({"success": False, "error": "unknown user"}), 404
+        login_user(user)
+        return jsonify({"success": True, "user_id": user.id})
+
 @app.route('/auth/google')
 def google_auth():
-    flow = Flow.from_client_config(
-        {
-            "web": {
-                "client_id": GOOGLE_CLIENT_ID,
-                "client_secret": GOOGLE_CLIENT_SECRET,
-                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                "token_uri": "https://oauth2.googleapis.com/token",
-                "redirect_uris": [GOOGLE_REDIRECT_URI]
-            }
-        },
-        scopes=['openid', 'https://www.googleapis.com/auth/userinfo.email', 'https://www.googleapis.com/auth/userinfo.profile']
-    )
-    
-    flow.redirect_uri = GOOGLE_REDIRECT_URI
-    authorization_url, state = flow.authorization_url(
-        access_type='offline',
-        include_granted_scopes='true'
-    )
+    authorization_url, state = google_login.authorization_url()
     
     session['state'] = state
     return redirect(authorization_url)
 
 @app.route('/auth/google/callback')
 def google_auth_callback():
-    flow = Flow.from_client_config(
-        {
-            "web": {
-                "client_id": GOOGLE_CLIENT_ID,
-                "client_secret": GOOGLE_CLIENT_SECRET,
-                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                "token_uri": "https://oauth2.googleapis.com/token",
-                "redirect_uris": [GOOGLE_REDIRECT_URI]
-            }
-        },
-        scopes=['openid', 'https://www.googleapis.com/auth/userinfo.email', 'https://www.googleapis.com/auth/userinfo.profile']
-    )
-    
-    flow.redirect_uri = GOOGLE_REDIRECT_URI
-    
-    authorization_response = request.url
-    flow.fetch_token(authorization_response=authorization_response)
-    
-    credentials = flow.credentials
-    id_info = id_token.verify_oauth2_token(
-        credentials.id_token, google_requests.Request(), GOOGLE_CLIENT_ID
-    )
+    id_info = google_login.complete(request.url, session.get('state'))
     
     user = User.query.filter_by(google_id=id_info['sub']).first()
     
@@ -144,12 +256,14 @@ def google_auth_callback():
         )
         db.session.add(user)
         db.session.commit()
+        user_cache.invalidate(user.id)
         login_user(user)
         flash('Welcome to AltTabWell! Please select your department.', 'success')
         return redirect(url_for('select_department'))
     else:
         user.last_login = datetime.utcnow()
         db.session.commit()
+        user_cache.invalidate(user.id)
         flash('Welcome back!', 'success')
         login_user(user)
         return redirect(url_for('dashboard'))
@@ -162,6 +276,9 @@ def select_department():
         if department_id:
             current_user.department_id = department_id
             db.session.commit()
+            user_cache.invalidate(current_user.id)
+            response_cache.invalidate(response_cache.user_tag(current_user.id), 'leaderboard')
+            step_leaderboard.move_user(current_user.id, current_user.department_id)
             flash('Department saved successfully!', 'success')
             return redirect(url_for('dashboard'))
         else:
@@ -170,8 +287,11 @@ def select_department():
     departments = Department.query.all()
     return render_template('select_department.html', departments=departments)
 
+FOOD_LOG_PAGE_SIZE = 20
+
 @app.route('/dashboard')
 @login_required
+@response_cache.cached()
 def dashboard():
     if not current_user.department_id:
         flash('Please select your department to continue.', 'info')
@@ -179,70 +299,201 @@ def dashboard():
 
     nutrition_data = session.get('nutrition_data', None)
     today = datetime.utcnow().date()
-    wellness_record = WellnessRecord.query.filter_by(
-        user_id=current_user.id, 
-        date=today
-    ).first()
-    step_record = StepRecord.query.filter_by(
-        user_id=current_user.id, 
-        date=today
-    ).first()
+    first_day_of_month = today.replace(day=1)
+    page = max(request.args.get('food_page', type=int, default=1), 1)
+    
+    # Today's step and wellness rows in one round trip
+    step_record, wellness_record = db.session.query(StepRecord, WellnessRecord).select_from(User).outerjoin(
+        StepRecord, db.and_(StepRecord.user_id == User.id, StepRecord.date == today)
+    ).outerjoin(
+        WellnessRecord, db.and_(WellnessRecord.user_id == User.id, WellnessRecord.date == today)
+    ).filter(User.id == current_user.id).one()
+    
+    # Daily and monthly calorie totals are summed by the database in a single query
+    total_calories, total_monthly_calories = db.session.query(
+        db.func.coalesce(db.func.sum(db.case((NutritionRecord.date == today, NutritionRecord.calories), else_=0)), 0),
+        db.func.coalesce(db.func.sum(NutritionRecord.calories), 0)
+    ).filter(
+        NutritionRecord.user_id == current_user.id,
+        NutritionRecord.date >= first_day_of_month
+    ).one()
     
-    # Get today's nutrition records for calorie total
+    # Only one page of today's food log is loaded; fetch one extra row to know if there is more
     nutrition_records = NutritionRecord.query.filter_by(
         user_id=current_user.id,
         date=today
+    ).order_by(NutritionRecord.id.desc()).offset((page - 1) * FOOD_LOG_PAGE_SIZE).limit(FOOD_LOG_PAGE_SIZE + 1).all()
+    has_more_records = len(nutrition_records) > FOOD_LOG_PAGE_SIZE
+    nutrition_records = nutrition_records[:FOOD_LOG_PAGE_SIZE]
+    
+    # Food photos still waiting for analysis; main.js polls these
+    pending_jobs = db.session.query(AnalysisJob.id, AnalysisJob.food_name).filter(
+        AnalysisJob.user_id == current_user.id,
+        AnalysisJob.status.in_(['queued', 'running'])
     ).all()
-    
-    total_calories = sum(record.calories or 0 for record in nutrition_records)
-    
-    # Get monthly calorie total
-    first_day_of_month = today.replace(day=1)
-    monthly_nutrition_records = NutritionRecord.query.filter(
-        NutritionRecord.user_id == current_user.id,
-        NutritionRecord.date >= first_day_of_month
-    ).all()
-    total_monthly_calories = sum(record.calories or 0 for record in monthly_nutrition_records)
+    if pending_jobs:
+        # The job may finish in another process (worker.py) or just before this process
+        # invalidates the page, and main.js reloads as soon as it sees it done
+        response_cache.skip()
     
     return render_template('dashboard.html', 
                          nutrition_data=nutrition_data,
                          wellness_record=wellness_record,
                          step_record=step_record,
                          nutrition_records=nutrition_records,
+                         food_page=page,
+                         has_more_records=has_more_records,
                          total_calories=total_calories,
-                         total_monthly_calories=total_monthly_calories)
+                         total_monthly_calories=total_monthly_calories,
+                         pending_jobs=pending_jobs,
+                         live_url=live_events_url())
+
+def live_events_url():
+    if not live_events.running:
+        return None
+    return live_events.url(request, current_user.id if current_user.is_authenticated else None)
+
+def publish_leaderboard():
+    live_events.publish('leaderboard', {
+        "users": step_leaderboard.top_users(),
+        "departments": step_leaderboard.top_departments()
+    })
+
+def publish_totals(user_id):
+    # Today's steps and calories for the user's open dashboards; skipped when none are open
+    if not live_events.listening(user_id):
+        return
+    today = datetime.utcnow().date()
+    steps = db.session.query(StepRecord.steps).filter_by(user_id=user_id, date=today).scalar() or 0
+    calories, monthly_calories = db.session.query(
+        db.func.coalesce(db.func.sum(db.case((NutritionRecord.date == today, NutritionRecord.calories), else_=0)), 0),
+        db.func.coalesce(db.func.sum(NutritionRecord.calories), 0)
+    ).filter(
+        NutritionRecord.user_id == user_id,
+        NutritionRecord.date >= today.replace(day=1)
+    ).one()
+    live_events.publish_to_user(user_id, 'totals', {
+        "steps": steps,
+        "calories": calories,
+        "monthly_calories": monthly_calories
+    })
 
 @app.route('/leaderboard')
+@response_cache.cached('leaderboard')
 def leaderboard():
-    from sqlalchemy import func
-    from datetime import timedelta
-    
-    week_ago = datetime.utcnow().date() - timedelta(days=7)
-    
-    top_users = db.session.query(
-        User.name,
-        func.sum(StepRecord.steps).label('total_steps')
-    ).join(StepRecord).filter(
-        StepRecord.date >= week_ago
-    ).group_by(User.id).order_by(
-        func.sum(StepRecord.steps).desc()
-    ).limit(10).all()
+    month_start = bucket_start('month', datetime.utcnow().date())
+    return render_template('leaderboard.html',
+                         top_users=step_leaderboard.top_users(),
+                         top_departments=step_leaderboard.top_departments(),
+                         department_month=department_ranking('month', month_start),
+                         live_url=live_events_url())
+
+ROLLUP_HISTORY = {'day': 30, 'week': 12, 'month': 12}  # buckets shown by default
+
+def rollup_range(period, end):
+    start = end
+    for _ in range(ROLLUP_HISTORY[period] - 1):
+        start = bucket_start(period, start - timedelta(days=1))
+    return start
+
+@app.route('/department')
+@login_required
+def department_dashboard():
+    if not current_user.department_id:
+        flash('Please select your department to continue.', 'info')
+        return redirect(url_for('select_department'))
     
-    return render_template('leaderboard.html', top_users=top_users)
+    today = datetime.utcnow().date()
+    this_week = bucket_start('week', today)
+    weeks = department_series(current_user.department_id, 'week', rollup_range('week', this_week), this_week)
+    return render_template('department.html',
+                         department=current_user.department,
+                         weeks=weeks,
+                         this_week=weeks[-1] if weeks and weeks[-1]['bucket_start'] == this_week.isoformat() else None,
+                         ranking=department_ranking('week', this_week))
+
+@app.route('/api/departments/<int:department_id>/rollups', methods=['GET'])
+@login_required
+def department_rollups(department_id):
+    period = request.args.get('period', 'week')
+    if period not in ROLLUP_PERIODS:
+        return jsonify({"success": False, "error": "period must be day, week or month"}), 400
+    try:
+        end = date.fromisoformat(request.args['end']) if 'end' in request.args else datetime.utcnow().date()
+        start = date.fromisoformat(request.args['start']) if 'start' in request.args else rollup_range(period, end)
+    except ValueError:
+        return jsonify({"success": False, "error": "start and end must be YYYY-MM-DD"}), 400
+    
+    return jsonify({
+        "success": True,
+        "department_id": department_id,
+        "period": period,
+        "buckets": department_series(department_id, period, bucket_start(period, start), end)
+    })
+
+@app.route('/api/history/monthly', methods=['GET'])
+@login_required
+def monthly_history():
+    # The signed-in user's monthly totals; months older than the archive horizon come from
+    # user_monthly_summary, so any range is cheap
+    try:
+        end = date.fromisoformat(request.args['end']) if 'end' in request.args else datetime.utcnow().date()
+        start = date.fromisoformat(request.args['start']) if 'start' in request.args else end.replace(day=1) - timedelta(days=365)
+    except ValueError:
+        return jsonify({"success": False, "error": "start and end must be YYYY-MM-DD"}), 400
+    
+    return jsonify({
+        "success": True,
+        "months": monthly_totals(current_user.id, start, end)
+    })
+
+TREND_LABELS = {
+    'steps': 'Steps', 'sleep_hours': 'Sleep (hours)', 'stress_level': 'Stress', 'mood_score': 'Mood',
+    'sleep_hours~stress_level': 'Sleep and stress', 'sleep_hours~mood_score': 'Sleep and mood',
+    'steps~mood_score': 'Steps and mood', 'steps~stress_level': 'Steps and stress',
+    'logging': 'Days logging steps', 'step_goal': 'Days reaching 10,000 steps', 'checkin': 'Days with a check-in',
+}
 
 @app.route('/therapy')
 @login_required
 def therapy():
-    from datetime import timedelta
-    
-    week_ago = datetime.utcnow().date() - timedelta(days=7)
-    wellness_records = WellnessRecord.query.filter_by(
-        user_id=current_user.id
-    ).filter(
-        WellnessRecord.date >= week_ago
-    ).order_by(WellnessRecord.date.desc()).all()
-    
-    return render_template('therapy.html', wellness_records=wellness_records)
+    # Trends are precomputed nightly by analytics.py; the page only reads the stored summaries
+    trends = {(trend.scope, trend.subject_id): trend for trend in WellnessTrend.query.filter(db.or_(
+        db.and_(WellnessTrend.scope == 'user', WellnessTrend.subject_id == current_user.id),
+        db.and_(WellnessTrend.scope == 'department', WellnessTrend.subject_id == current_user.department_id)
+    ))}
+    
+    return render_template('therapy.html',
+                         trend=trends.get(('user', current_user.id)),
+                         department_trend=trends.get(('department', current_user.department_id)),
+                         trend_labels=TREND_LABELS)
+
+def gemini_caller():
+    # Admission is per signed-in user, or per address for anonymous searches
+    return f'user:{current_user.id}' if current_user.is_authenticated else f'ip:{request.remote_addr}'
+
+def call_gemini(key, fn):
+    # fn() through the single-flight group; only a call that actually reaches Gemini is admitted
+    caller = gemini_caller()
+    return gemini_flight.do(key, fn, admit=lambda: gemini_admission.admit(caller))
+
+def estimate_calories(food_name):
+    # Only remember answers that actually contained a number. Run by the caller that made the
+    # Gemini call; coalesced callers get its answer without writing the cache again.
+    calories = gemini.calories_for_text(food_name)
+    if calories is not None:
+        food_cache.put(food_name, calories)
+    return calories
+
+def estimate_calories_for_items(foods):
+    estimates = gemini.calories_for_items(foods)
+    for food, calories in zip(foods, estimates):
+        if calories is not None and calories > 0:
+            food_cache.put(food, calories)
+    return estimates
+
+def rate_limited(e):
+    return jsonify({"success": False, "error": str(e)}), 429, {'Retry-After': str(max(1, math.ceil(e.retry_after)))}
 
 # --- NEW: Gemini API route for food search ---
 @app.route('/api/gemini/search', methods=['GET'])
@@ -252,152 +503,353 @@ def gemini_search():
     if not food_name:
         return jsonify({"success": False, "error": "foodName parameter is required"}), 400
     
-    if not GEMINI_API_KEY:
-        return jsonify({"success": False, "error": "Gemini API key not configured. Check .env file."}), 500
-
-    # The prompt is crafted to ask for a concise, single-line response with just the calorie number.
-    prompt = f"Provide ONLY the calorie number (just the number) for {food_name}. Example: For '1 medium apple' just respond with '95'"
-    
-    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key={GEMINI_API_KEY}"
-    
-    payload = {
-        "contents": [{
-            "parts": [{
-                "text": prompt
-            }]
-        }]
-    }
-    
-    headers = {'Content-Type': 'application/json'}
+    match = nutrition_index.lookup(food_name)
+    if match:
+        return jsonify({
+            "success": True,
+            "description": f"{food_name}: {match['calories']} calories",
+            "calories": match['calories'],
+            "food_name": food_name,
+            "nutrients": match['nutrients'],
+            "source": "index"
+        })
     
-    try:
-        response = requests.post(api_url, headers=headers, data=json.dumps(payload))
-        response.raise_for_status()
-        data = response.json()
-        
-        # Extract the text from the Gemini response
-        text_response = data['candidates'][0]['content']['parts'][0]['text']
-        
-        # Try to extract just the number
-        import re
-        calorie_match = re.search(r'\d+', text_response)
-        calories = int(calorie_match.group()) if calorie_match else 0
-        
+    cached_calories = food_cache.get(food_name)
+    if cached_calories is not None:
+        calories = int(cached_calories)
         return jsonify({
-            "success": True, 
+            "success": True,
             "description": f"{food_name}: {calories} calories",
             "calories": calories,
-            "food_name": food_name
+            "food_name": food_name,
+            "cached": True
         })
+    
+    if not gemini.configured:
+        return jsonify({"success": False, "error": "Gemini API key not configured. Check .env file."}), 500
 
-    except requests.exceptions.HTTPError as http_err:
-        print(f"HTTP error occurred: {http_err}")
-        print(f"Response content: {response.text}")
-        return jsonify({"success": False, "error": "API returned an error. Check server logs."}), 502
-    except (KeyError, IndexError) as e:
-        print(f"Error parsing Gemini response: {e}")
+    try:
+        calories = call_gemini(f'text:{normalize_food_query(food_name)}', lambda: estimate_calories(food_name))
+    except RateLimited as e:
+        return rate_limited(e)
+    except GeminiUnavailable:
+        return jsonify({"success": False, "error": "Calorie lookup is temporarily unavailable. Please try again shortly."}), 503
+    except GeminiResponseError as e:
+        logger.warning("Error parsing Gemini response: %s", e)
         return jsonify({"success": False, "error": "Could not parse API response."}), 500
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return jsonify({"success": False, "error": "An internal server error occurred."}), 500
+    except GeminiError as e:
+        logger.error("Gemini error: %s", e)
+        return jsonify({"success": False, "error": "API returned an error. Check server logs."}), 502
+    
+    if calories is None:
+        calories = 0
+    
+    return jsonify({
+        "success": True, 
+        "description": f"{food_name}: {calories} calories",
+        "calories": calories,
+        "food_name": food_name
+    })
+
+@app.route('/api/food/suggest', methods=['GET'])
+def food_suggest():
+    # Type-ahead for the food search box, answered from the offline index
+    query = request.args.get('q', '').strip()[:100]
+    response = jsonify({"success": True, "suggestions": nutrition_index.suggest(query) if query else []})
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response
+
+MAX_BATCH_ITEMS = 20
+
+def split_meal(text):
+    # "2 eggs, toast; coffee with milk" -> ['2 eggs', 'toast', 'coffee with milk']
+    return [item.strip() for item in re.split(r'[,;\n]+', text) if item.strip()]
+
+@app.route('/api/food/batch', methods=['POST'])
+@login_required
+def add_food_batch():
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "error": "Expected a JSON object"}), 400
+    foods = data.get('foods')
+    text = data.get('text')
+    if foods is not None and not (isinstance(foods, list) and all(isinstance(food, str) for food in foods)):
+        return jsonify({"success": False, "error": "foods must be a list of strings"}), 400
+    if text is not None and not isinstance(text, str):
+        return jsonify({"success": False, "error": "text must be a string"}), 400
+    if foods is None:
+        foods = split_meal(text or '')
+    foods = [food.strip()[:200] for food in foods if food.strip()]
+    
+    if not foods:
+        return jsonify({"success": False, "error": "No foods provided"}), 400
+    if len(foods) > MAX_BATCH_ITEMS:
+        return jsonify({"success": False, "error": f"At most {MAX_BATCH_ITEMS} foods can be added at once"}), 400
+    
+    calories_by_food = {}
+    nutrients_by_food = {}
+    for food in foods:
+        match = nutrition_index.lookup(food)
+        if match:
+            calories_by_food[food] = match['calories']
+            nutrients_by_food[food] = match['nutrients']
+            continue
+        cached_calories = food_cache.get(food)
+        if cached_calories is not None:
+            calories_by_food[food] = int(cached_calories)
+    
+    # Everything not indexed or cached goes to Gemini in a single request; without Gemini
+    # the items found offline are still added and the rest reported as unresolved
+    remaining = [food for food in dict.fromkeys(foods) if food not in calories_by_food]
+    if remaining and not gemini.configured and not calories_by_food:
+        return jsonify({"success": False, "error": "Gemini API key not configured. Check .env file."}), 500
+    if remaining and gemini.configured:
+        key = 'items:' + '|'.join(normalize_food_query(food) for food in remaining)
+        try:
+            estimates = call_gemini(key, lambda: estimate_calories_for_items(remaining))
+        except RateLimited as e:
+            return rate_limited(e)
+        except GeminiUnavailable:
+            return jsonify({"success": False, "error": "Calorie lookup is temporarily unavailable. Please try again shortly."}), 503
+        except GeminiResponseError as e:
+            logger.warning("Error parsing Gemini response: %s", e)
+            return jsonify({"success": False, "error": "Could not parse API response."}), 500
+        except GeminiError as e:
+            logger.error("Gemini error: %s", e)
+            return jsonify({"success": False, "error": "API returned an error. Check server logs."}), 502
+        
+        for food, calories in zip(remaining, estimates):
+            if calories is not None and calories > 0:
+                calories_by_food[food] = calories
+    
+    added = [(food, calories_by_food[food], nutrients_by_food.get(food)) for food in foods if food in calories_by_food]
+    unresolved = [food for food in foods if food not in calories_by_food]
+    
+    if added:
+        record_foods(current_user.id, current_user.department_id, added)
+        db.session.commit()
+        response_cache.invalidate_user(current_user.id)
+        publish_totals(current_user.id)
+    
+    today = datetime.utcnow().date()
+    total_calories = db.session.query(
+        db.func.coalesce(db.func.sum(NutritionRecord.calories), 0)
+    ).filter(
+        NutritionRecord.user_id == current_user.id,
+        NutritionRecord.date == today
+    ).scalar()
+    
+    return jsonify({
+        "success": bool(added),
+        "items": [dict(nutrients or {}, food_name=food, calories=calories) for food, calories, nutrients in added],
+        "unresolved": unresolved,
+        "total_calories": total_calories,
+        "error": None if added else "No calorie information found"
+    })
 
 @app.route('/upload-food', methods=['POST'])
 @login_required
 def upload_food():
+    wants_json = request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html
+    
     if 'food_image' not in request.files:
+        if wants_json:
+            return jsonify({"success": False, "error": "No file part"}), 400
         flash('No file part', 'danger')
         return redirect(url_for('dashboard'))
     
     file = request.files['food_image']
     
     if file.filename == '':
+        if wants_json:
+            return jsonify({"success": False, "error": "No selected file"}), 400
         flash('No selected file', 'danger')
         return redirect(url_for('dashboard'))
     
-    if file:
-        image_bytes = file.read()
-        import base64
-        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-        
-        if not GEMINI_API_KEY:
-            flash('Gemini API key not configured.', 'danger')
-            return redirect(url_for('dashboard'))
-        
-        prompt = "Analyze this food image and provide ONLY the estimated calorie count as a number. For example, if it's a burger, just respond with '650'."
-        api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key={GEMINI_API_KEY}"
-        
-        payload = {
-            "contents": [{
-                "parts": [
-                    {"text": prompt},
-                    {
-                        "inline_data": {
-                            "mime_type": file.content_type,
-                            "data": image_base64
-                        }
-                    }
-                ]
-            }]
-        }
-        
-        headers = {'Content-Type': 'application/json'}
-        
-        try:
-            response = requests.post(api_url, headers=headers, data=json.dumps(payload))
-            response.raise_for_status()
-            data = response.json()
-            
-            text_response = data['candidates'][0]['content']['parts'][0]['text']
-            import re
-            calorie_match = re.search(r'\d+', text_response)
-            calories = int(calorie_match.group()) if calorie_match else 0
-            
-            food_name = os.path.splitext(file.filename)[0] or "Food from image"
-            today = datetime.utcnow().date()
-            
-            # Add to user's nutrition record
-            nutrition_record = NutritionRecord(
-                user_id=current_user.id,
-                date=today,
-                food_name=food_name,
-                calories=calories,
-                meal_type='snack'
-            )
-            db.session.add(nutrition_record)
-            
-            # Add to department's nutrition record
-            department_nutrition = DepartmentNutrition.query.filter_by(
-                department_id=current_user.department_id,
-                date=today
-            ).first()
-            
-            if not department_nutrition:
-                department_nutrition = DepartmentNutrition(
-                    department_id=current_user.department_id,
-                    date=today,
-                    total_calories=calories
-                )
-                db.session.add(department_nutrition)
-            else:
-                department_nutrition.total_calories += calories
-            
-            db.session.commit()
-            
-            flash(f'Added {food_name} ({calories} calories) to your daily intake', 'success')
-            
-        except requests.exceptions.HTTPError as http_err:
-            print(f"HTTP error occurred: {http_err}")
-            print(f"Response content: {response.text}")
-            flash('API returned an error. Check server logs.', 'danger')
-        except (KeyError, IndexError) as e:
-            print(f"Error parsing Gemini response: {e}")
-            flash('Could not parse API response.', 'danger')
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            flash('An internal server error occurred.', 'danger')
+    try:
+        image_bytes = read_upload(file, UPLOAD_MAX_BYTES)
+    except UploadTooLarge as e:
+        if wants_json:
+            return jsonify({"success": False, "error": str(e)}), 413
+        flash(str(e), 'danger')
+        return redirect(url_for('dashboard'))
+    food_name = os.path.splitext(file.filename)[0] or "Food from image"
+    
+    # Identical or near-identical photos are answered without calling Gemini
+    digest = content_hash(image_bytes)
+    cached_calories = image_cache.lookup_exact(digest)
+    prepared = None
+    if cached_calories is None:
+        prepared = image_preprocessor.prepare(image_bytes, file.content_type)
+        logger.info("Prepared upload", extra={'digest': digest[:12], 'original_bytes': prepared.original_size,
+                                             'prepared_bytes': len(prepared.data), 'prepare_ms': round(prepared.elapsed * 1000, 1)})
+        cached_calories, phash = image_cache.lookup_similar(prepared.data, current_user.id)
+        if cached_calories is not None:
+            image_cache.store(digest, phash, cached_calories, current_user.id)
+    
+    if cached_calories is not None:
+        calories = int(cached_calories)
+        record_food(current_user.id, current_user.department_id, food_name, calories)
+        db.session.commit()
+        response_cache.invalidate_user(current_user.id)
+        publish_totals(current_user.id)
+        if wants_json:
+            return jsonify({"success": True, "status": "done", "food_name": food_name, "calories": calories})
+        flash(f'Added {food_name} ({calories} calories) to your daily intake', 'success')
+        return redirect(url_for('dashboard'))
     
+    if not gemini.configured:
+        if wants_json:
+            return jsonify({"success": False, "error": "Gemini API key not configured."}), 500
+        flash('Gemini API key not configured.', 'danger')
+        return redirect(url_for('dashboard'))
+    
+    # Novel images are analyzed in the background so this worker is freed immediately. The
+    # job is held until a Gemini token is taken, so a full queue does not use one up.
+    try:
+        job = analysis_queue.submit(
+            current_user.id, current_user.department_id, food_name,
+            prepared.mime_type, prepared.data, digest, phash, hold=True
+        )
+    except QueueFull:
+        message = 'Too many food photos are being analyzed right now. Please try again in a minute.'
+        if wants_json:
+            return jsonify({"success": False, "error": message}), 429, {'Retry-After': '30'}
+        return message, 429, {'Retry-After': '30'}
+    try:
+        gemini_admission.admit(gemini_caller())
+    except RateLimited as e:
+        analysis_queue.cancel(job)
+        if wants_json:
+            return rate_limited(e)
+        return str(e), 429, {'Retry-After': str(max(1, math.ceil(e.retry_after)))}
+    analysis_queue.release(job)
+    response_cache.invalidate_user(current_user.id)  # the dashboard lists pending analyses
+    
+    if wants_json:
+        return jsonify({
+            "success": True,
+            "status": job.status,
+            "job_id": job.id,
+            "poll_url": url_for('analysis_job_status', job_id=job.id)
+        }), 202
+    flash(f'Analyzing {food_name}. It will appear in your food log shortly.', 'info')
     return redirect(url_for('dashboard'))
 
+@app.errorhandler(413)
+def upload_too_large(error):
+    message = f'Image is larger than {UPLOAD_MAX_BYTES // (1024 * 1024)} MB'
+    if request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html:
+        return jsonify({"success": False, "error": message}), 413
+    flash(message, 'danger')
+    return redirect(url_for('dashboard'))
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def analysis_job_status(job_id):
+    job = AnalysisJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if not job:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    
+    return jsonify({
+        "success": job.status != 'failed',
+        "job_id": job.id,
+        "status": job.status,
+        "food_name": job.food_name,
+        "calories": int(job.calories) if job.calories is not None else None,
+        "error": "Could not analyze this image." if job.status == 'failed' else None
+    })
+
+def analyze_food_image(job):
+    import base64
+    image_base64 = base64.b64encode(job.image_data).decode('utf-8')
+    
+    analyze = lambda: gemini.calories_for_image(image_base64, job.mime_type)
+    try:
+        # Copies of the same photo being analyzed by other workers share one call
+        calories = gemini_flight.do(f'image:{job.content_hash}', analyze) if job.content_hash else analyze()
+    except GeminiUnavailable as e:
+        # Gemini is known to be down; wait for it without using up the job's attempts
+        raise RetryLater(str(e))
+    if calories is None:
+        return 0
+    
+    if job.content_hash:
+        image_cache.store(job.content_hash, job.perceptual_hash, calories, job.user_id)
+    
+    return calories
+
+def complete_food_image(job, calories):
+    record_food(job.user_id, job.department_id, job.food_name, calories)
+
+def food_image_finished(job):
+    response_cache.invalidate_user(job.user_id)
+    publish_totals(job.user_id)
+
+def record_food(user_id, department_id, food_name, calories, nutrients=None):
+    record_foods(user_id, department_id, [(food_name, calories, nutrients)])
+
+def record_foods(user_id, department_id, foods):
+    # Adds the rows for (food_name, calories, nutrients) to the session; the caller commits.
+    # nutrients is None or a dict of protein/carbs/fat/fiber grams.
+    today = datetime.utcnow().date()
+    
+    # Add to user's nutrition record
+    for food_name, calories, nutrients in foods:
+        nutrition_record = NutritionRecord(
+            user_id=user_id,
+            date=today,
+            food_name=food_name,
+            calories=calories,
+            meal_type='snack',
+            **(nutrients or {})
+        )
+        db.session.add(nutrition_record)
+    
+    # Add to the department's daily, weekly and monthly rollups
+    rollup = RollupBatch()
+    rollup.food(department_id, today, sum(calories for _, calories, _ in foods), len(foods))
+    rollup.apply()
+
+analysis_queue = AnalysisJobQueue(
+    app,
+    analyze=analyze_food_image,
+    complete=complete_food_image,
+    finished=food_image_finished,
+    workers=int(os.environ.get('ANALYSIS_WORKERS', 4)),
+    max_depth=int(os.environ.get('ANALYSIS_QUEUE_MAX_DEPTH', 100))
+)
+
+@app.before_request
+def start_background_services():
+    analysis_queue.ensure_started()
+    live_events.ensure_started()
+
+metrics.register_stats('gemini', gemini.stats, labels={'statuses': 'status'})
+metrics.register_stats('gemini_flight', gemini_flight.stats)
+metrics.register_stats('gemini_admission', gemini_admission.stats)
+metrics.register_stats('google_login', google_login.stats)
+metrics.register_stats('food_cache', food_cache.stats)
+metrics.register_stats('nutrition_index', nutrition_index.stats)
+metrics.register_stats('user_cache', user_cache.stats)
+metrics.register_stats('response_cache', response_cache.stats)
+metrics.register_stats('live_events', live_events.stats)
+metrics.register_stats('image_cache', image_cache.stats)
+metrics.register_stats('image_prep', image_preprocessor.stats)
+metrics.register_stats('analysis_queue', analysis_queue.stats)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    # Prometheus text format. With METRICS_TOKEN set a bearer token is required; without it
+    # only direct requests from this machine are answered (not ones relayed by a proxy)
+    if METRICS_TOKEN:
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {METRICS_TOKEN}'.encode()):
+            return jsonify({"success": False, "error": "unauthorized"}), 401
+    elif request.remote_addr not in ('127.0.0.1', '::1') or 'X-Forwarded-For' in request.headers:
+        return jsonify({"success": False, "error": "Set METRICS_TOKEN to read metrics remotely"}), 403
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/add-food', methods=['POST'])
 @login_required
 def add_food():
@@ -408,35 +860,10 @@ def add_food():
         flash('Invalid food data provided', 'danger')
         return redirect(url_for('dashboard'))
     
-    today = datetime.utcnow().date()
-    
-    # Add to user's nutrition record
-    nutrition_record = NutritionRecord(
-        user_id=current_user.id,
-        date=today,
-        food_name=food_name,
-        calories=calories,
-        meal_type='snack'
-    )
-    db.session.add(nutrition_record)
-    
-    # Add to department's nutrition record
-    department_nutrition = DepartmentNutrition.query.filter_by(
-        department_id=current_user.department_id,
-        date=today
-    ).first()
-    
-    if not department_nutrition:
-        department_nutrition = DepartmentNutrition(
-            department_id=current_user.department_id,
-            date=today,
-            total_calories=calories
-        )
-        db.session.add(department_nutrition)
-    else:
-        department_nutrition.total_calories += calories
-        
+    record_food(current_user.id, current_user.department_id, food_name, calories)
     db.session.commit()
+    response_cache.invalidate_user(current_user.id)
+    publish_totals(current_user.id)
     
     flash(f'Added {food_name} ({calories} calories) to your daily intake', 'success')
     return redirect(url_for('dashboard'))
@@ -445,51 +872,103 @@ def add_food():
 @login_required
 def add_wellness():
     today = datetime.utcnow().date()
+    fields = {
+        'mood_score': request.form.get('mood_score', type=int),
+        'sleep_hours': request.form.get('sleep_hours', type=float),
+        'water_intake': request.form.get('water_intake', type=float),
+        'stress_level': request.form.get('stress_level', type=int),
+        'notes': request.form.get('notes')
+    }
     
-    wellness_record = WellnessRecord.query.filter_by(
-        user_id=current_user.id, 
-        date=today
-    ).first()
-    
-    if not wellness_record:
-        wellness_record = WellnessRecord(
-            user_id=current_user.id,
-            date=today
-        )
-        db.session.add(wellness_record)
-    
-    wellness_record.mood_score = request.form.get('mood_score', type=int)
-    wellness_record.sleep_hours = request.form.get('sleep_hours', type=float)
-    wellness_record.water_intake = request.form.get('water_intake', type=float)
-    wellness_record.stress_level = request.form.get('stress_level', type=int)
-    wellness_record.notes = request.form.get('notes')
+    previous = write_wellness(current_user.id, today, **fields)
+    rollup = RollupBatch()
+    rollup.wellness(current_user.department_id, today, previous, fields)
+    rollup.apply()
     
     db.session.commit()
+    response_cache.invalidate(response_cache.user_tag(current_user.id), 'leaderboard')
     flash('Wellness data updated successfully!', 'success')
     return redirect(url_for('dashboard'))
 
+def has_service_token():
+    # Device-sync and reporting services authenticate with "Authorization: Bearer <SERVICE_API_TOKEN>"
+    header = request.headers.get('Authorization', '')
+    if not SERVICE_API_TOKEN or not header.startswith('Bearer '):
+        return False
+    return hmac.compare_digest(header[len('Bearer '):].encode(), SERVICE_API_TOKEN.encode())
+
+@app.route('/api/steps/bulk', methods=['POST'])
+def bulk_ingest_steps():
+    if not has_service_token():
+        return jsonify({"success": False, "error": "A valid service token is required"}), 401
+    
+    fmt = request.args.get('format') or ('csv' if 'csv' in (request.content_type or '') else 'jsonl')
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({"success": False, "error": "format must be csv or jsonl"}), 400
+    
+    def update_leaderboard(written):
+        for user, day, steps in written:
+            step_leaderboard.set_steps(user.id, user.department_id, day, steps, user.name)
+        response_cache.invalidate('leaderboard', *{response_cache.user_tag(user.id) for user, _, _ in written})
+        publish_leaderboard()
+        for user_id in {user.id for user, _, _ in written}:
+            publish_totals(user_id)
+    
+    ingestor = StepIngestor(batch_size=INGEST_BATCH_SIZE, on_written=update_leaderboard)
+    result = ingestor.run(request.stream, fmt)
+    logger.info("Bulk step ingest", extra={'accepted': result['accepted'], 'rejected': result['rejected'],
+                                           'rows_per_second': result['rows_per_second']})
+    return jsonify(dict(result, success=True))
+
+@app.route('/export/<kind>.<fmt>', methods=['GET'])
+def export_history(kind, fmt):
+    # Users export their own history; services holding the token can export a department or everyone
+    if kind not in EXPORTS or fmt not in EXPORT_FORMATS:
+        return jsonify({"success": False, "error": "Unknown export"}), 404
+    
+    filters = {}
+    try:
+        filters['start'] = date.fromisoformat(request.args['start']) if request.args.get('start') else None
+        filters['end'] = date.fromisoformat(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        return jsonify({"success": False, "error": "start and end must be YYYY-MM-DD"}), 400
+    
+    if has_service_token():
+        filters['department_id'] = request.args.get('department_id', type=int)
+        filters['user_id'] = request.args.get('user_id', type=int)
+    elif current_user.is_authenticated:
+        filters['user_id'] = current_user.id
+    else:
+        return login_manager.unauthorized()
+    
+    if fmt == 'parquet' and not parquet_available():
+        return jsonify({"success": False, "error": "Parquet export is not available on this server"}), 501
+    
+    filename = f"{kind}-{date.today().isoformat()}.{fmt}"
+    return app.response_class(
+        stream_with_context(export(kind, fmt, **filters)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
 @app.route('/add-steps', methods=['POST'])
 @login_required
 def add_steps():
     today = datetime.utcnow().date()
     steps = request.form.get('steps', type=int, default=0)
     
-    step_record = StepRecord.query.filter_by(
-        user_id=current_user.id, 
-        date=today
-    ).first()
-    
-    if not step_record:
-        step_record = StepRecord(
-            user_id=current_user.id,
-            date=today,
-            steps=steps
-        )
-        db.session.add(step_record)
-    else:
-        step_record.steps = steps
+    previous = write_steps(current_user.id, today, steps)
+    rollup = RollupBatch()
+    rollup.steps(current_user.department_id, today, previous, steps)
+    rollup.apply()
     
     db.session.commit()
+    response_cache.invalidate(response_cache.user_tag(current_user.id), 'leaderboard')
+    step_leaderboard.set_steps(current_user.id, current_user.department_id, today, steps, current_user.name)
+    publish_leaderboard()
+    publish_totals(current_user.id)
+    if request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html:
+        return jsonify({"success": True, "steps": steps})
     flash(f'Steps updated: {steps:,} steps!', 'success')
     return redirect(url_for('dashboard'))
 
@@ -0,0 +1,273 @@
+import argparse
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select, text, tuple_
+
+from models import (db, StepRecord, NutritionRecord, WellnessRecord, UserMonthlySummary, ArchiveRun,
+                    ArchivedStepRecord, ArchivedNutritionRecord, ArchivedWellnessRecord)
+
+logger = logging.getLogger(__name__)
+
+# Hot/cold tiering for the raw record tables. Whole months older than the horizon are moved to
+# the archive database (ARCHIVE_DATABASE_URL) and summarized per user in user_monthly_summary;
+# archived_rows() and monthly_totals() read across both tiers. Run it from cron, e.g. monthly:
+#   python archive.py --horizon-days 400
+
+ARCHIVES = {
+    StepRecord: ArchivedStepRecord,
+    NutritionRecord: ArchivedNutritionRecord,
+    WellnessRecord: ArchivedWellnessRecord,
+}
+ONE_PER_DAY = (StepRecord, WellnessRecord)  # a day backfilled later replaces the archived one
+
+# Per-day totals kept for each archived month, as (summary column, aggregate) for either tier
+SUMMARIES = {
+    StepRecord: lambda m: [('steps', func.sum(m.steps)), ('step_days', func.count(m.id))],
+    NutritionRecord: lambda m: [
+        ('calories', func.sum(m.calories)), ('protein', func.sum(m.protein)), ('carbs', func.sum(m.carbs)),
+        ('fat', func.sum(m.fat)), ('fiber', func.sum(m.fiber)), ('food_entries', func.count(m.id)),
+    ],
+    WellnessRecord: lambda m: [
+        ('mood_total', func.sum(m.mood_score)), ('mood_entries', func.count(m.mood_score)),
+        ('sleep_total', func.sum(m.sleep_hours)), ('sleep_entries', func.count(m.sleep_hours)),
+        ('stress_total', func.sum(m.stress_level)), ('stress_entries', func.count(m.stress_level)),
+        ('water_total', func.sum(m.water_intake)), ('water_entries', func.count(m.water_intake)),
+    ],
+}
+SUMMARY_FIELDS = [name for model, columns in SUMMARIES.items() for name, _ in columns(model)]
+
+DEFAULT_HORIZON_DAYS = 400
+MIN_HORIZON_DAYS = 92  # the analytics window, leaderboard week and dashboard month always stay hot
+BATCH_SIZE = 5000
+USER_CHUNK = 500       # user ids per IN (...) list
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def month_end(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+
+def archive_boundary():
+    # First date still kept in the hot tables; None until something has been archived
+    return db.session.query(func.max(ArchiveRun.cutoff)).filter(ArchiveRun.finished_at.isnot(None)).scalar()
+
+
+def compaction_cutoff(horizon_days, today=None):
+    # Rows dated before this are archived: the start of the month the horizon falls in
+    today = today or datetime.utcnow().date()
+    return month_start(today - timedelta(days=horizon_days))
+
+
+def compact(horizon_days=DEFAULT_HORIZON_DAYS, batch_size=BATCH_SIZE, today=None):
+    if horizon_days < MIN_HORIZON_DAYS:
+        raise ValueError(f'horizon_days must be at least {MIN_HORIZON_DAYS}')
+    cutoff = max(filter(None, [compaction_cutoff(horizon_days, today), archive_boundary()]))
+
+    run = ArchiveRun(cutoff=cutoff)
+    db.session.add(run)
+    db.session.commit()
+
+    touched = set()  # (user_id, month_start) whose summary must be recomputed
+    run.steps_moved = move_rows(StepRecord, cutoff, batch_size, touched)
+    run.nutrition_moved = move_rows(NutritionRecord, cutoff, batch_size, touched)
+    run.wellness_moved = move_rows(WellnessRecord, cutoff, batch_size, touched)
+    refresh_summaries(touched)
+    run.finished_at = datetime.utcnow()
+    db.session.commit()
+    return run
+
+
+def move_rows(model, cutoff, batch_size, touched):
+    # Copies a batch into the archive and commits it there before deleting it from the hot
+    # table; ids are kept, so a batch interrupted in between is copied again harmlessly
+    hot, cold = model.__table__, ARCHIVES[model].__table__
+    columns = [hot.c[column.name] for column in cold.columns]
+    moved = 0
+    while True:
+        rows = [dict(row) for row in db.session.execute(
+            select(*columns).where(hot.c.date < cutoff).order_by(hot.c.id).limit(batch_size)
+        ).mappings()]
+        if not rows:
+            return moved
+        ids = [row['id'] for row in rows]
+        with db.engines['archive'].begin() as connection:
+            connection.execute(delete(cold).where(cold.c.id.in_(ids)))
+            if model in ONE_PER_DAY:
+                connection.execute(delete(cold).where(
+                    tuple_(cold.c.user_id, cold.c.date).in_([(row['user_id'], row['date']) for row in rows])
+                ))
+            connection.execute(insert(cold), rows)
+        db.session.execute(delete(hot).where(hot.c.id.in_(ids)))
+        db.session.commit()
+        touched.update((row['user_id'], month_start(row['date'])) for row in rows)
+        moved += len(rows)
+
+
+def aggregate(models, user_ids, start, end):
+    # {(user_id, month_start): {summary column: total}} for the given tier's models, grouped
+    # by day in the database and added up per month here
+    totals = {}
+    for model, archived in models:
+        named = SUMMARIES[model](archived)
+        for offset in range(0, len(user_ids), USER_CHUNK):
+            rows = db.session.query(archived.user_id, archived.date, *[expr for _, expr in named]).filter(
+                archived.user_id.in_(user_ids[offset:offset + USER_CHUNK]),
+                archived.date.between(start, end)
+            ).group_by(archived.user_id, archived.date)
+            for user_id, day, *values in rows:
+                bucket = totals.setdefault((user_id, month_start(day)), {})
+                for (name, _), value in zip(named, values):
+                    bucket[name] = bucket.get(name, 0) + (value or 0)
+    return totals
+
+
+def refresh_summaries(touched):
+    # Recomputes the touched user-months from the archive, which holds all of their rows
+    by_month = {}
+    for user_id, month in touched:
+        by_month.setdefault(month, []).append(user_id)
+    for month, user_ids in sorted(by_month.items()):
+        totals = aggregate([(model, archived) for model, archived in ARCHIVES.items()],
+                           user_ids, month, month_end(month))
+        for offset in range(0, len(user_ids), USER_CHUNK):
+            UserMonthlySummary.query.filter(
+                UserMonthlySummary.month_start == month,
+                UserMonthlySummary.user_id.in_(user_ids[offset:offset + USER_CHUNK])
+            ).delete(synchronize_session=False)
+        rows = [dict(dict.fromkeys(SUMMARY_FIELDS, 0), **values, user_id=user_id, month_start=month_key)
+                for (user_id, month_key), values in totals.items()]
+        if rows:
+            db.session.execute(insert(UserMonthlySummary.__table__), rows)
+        db.session.commit()
+
+
+def _hot_days(model, start, end, boundary, user_ids=None):
+    # (user_id, date) of one-per-day rows backfilled into already archived months; they win
+    query = db.session.query(model.user_id, model.date).filter(model.date < boundary)
+    if start:
+        query = query.filter(model.date >= start)
+    if end:
+        query = query.filter(model.date <= end)
+    if user_ids is not None:
+        query = query.filter(model.user_id.in_(user_ids))
+    return {tuple(row) for row in query}
+
+
+def archived_rows(model, columns, start=None, end=None, user_ids=None, chunk_size=BATCH_SIZE):
+    # Archived rows of model dated within [start, end], as lists of tuples of the named columns
+    # ordered by date, user and id; nothing when the range lies entirely in the hot tier.
+    # columns must start with 'date', 'user_id'.
+    boundary = archive_boundary()
+    if boundary is None or (start and start >= boundary):
+        return
+    archived = ARCHIVES[model]
+    query = select(*[getattr(archived, column) for column in columns]).where(archived.date < boundary)
+    if start:
+        query = query.where(archived.date >= start)
+    if end:
+        query = query.where(archived.date <= end)
+    if user_ids is not None:
+        query = query.where(archived.user_id.in_(user_ids))
+    replaced = _hot_days(model, start, end, boundary, user_ids) if model in ONE_PER_DAY else set()
+
+    result = db.session.execute(
+        query.order_by(archived.date, archived.user_id, archived.id).execution_options(
+            stream_results=True, yield_per=chunk_size)
+    )
+    try:
+        for partition in result.partitions(chunk_size):
+            if replaced:
+                partition = [row for row in partition if (row[1], row[0]) not in replaced]
+            yield partition
+    finally:
+        result.close()
+
+
+def archived_daily(model, columns, start=None, end=None):
+    # (user_id, date, *aggregates) per archived day for rollups.rebuild; columns(m) gives the
+    # aggregate expressions for a model of either tier
+    boundary = archive_boundary()
+    if boundary is None or (start and start >= boundary):
+        return []
+    archived = ARCHIVES[model]
+    query = db.session.query(archived.user_id, archived.date, *columns(archived)).filter(archived.date < boundary)
+    if start:
+        query = query.filter(archived.date >= start)
+    if end:
+        query = query.filter(archived.date <= end)
+    replaced = _hot_days(model, start, end, boundary) if model in ONE_PER_DAY else set()
+    return [row for row in query.group_by(archived.user_id, archived.date) if (row[0], row[1]) not in replaced]
+
+
+def summarize(month, values, archived):
+    def average(total, entries, digits=1):
+        return round(values.get(total, 0) / values[entries], digits) if values.get(entries) else None
+
+    return {
+        'month': month.strftime('%Y-%m'),
+        'archived': archived,
+        'steps': int(values.get('steps', 0)),
+        'step_days': values.get('step_days', 0),
+        'average_steps': average('steps', 'step_days', None),
+        'calories': round(values.get('calories', 0)),
+        'protein': round(values.get('protein', 0), 1),
+        'carbs': round(values.get('carbs', 0), 1),
+        'fat': round(values.get('fat', 0), 1),
+        'fiber': round(values.get('fiber', 0), 1),
+        'food_entries': values.get('food_entries', 0),
+        'average_mood': average('mood_total', 'mood_entries'),
+        'average_sleep': average('sleep_total', 'sleep_entries'),
+        'average_stress': average('stress_total', 'stress_entries'),
+        'average_water': average('water_total', 'water_entries'),
+    }
+
+
+def monthly_totals(user_id, start, end):
+    # One summary per month from start to end: archived months from user_monthly_summary,
+    # later ones added up from the hot tables
+    start, end = month_start(start), month_end(end)
+    boundary = archive_boundary()
+    months = {}
+    if boundary is not None and start < boundary:
+        for row in UserMonthlySummary.query.filter(
+            UserMonthlySummary.user_id == user_id,
+            UserMonthlySummary.month_start.between(start, min(end, boundary - timedelta(days=1)))
+        ):
+            months[row.month_start] = summarize(row.month_start, {
+                name: getattr(row, name) for name in SUMMARY_FIELDS
+            }, True)
+    hot_start = max(start, boundary) if boundary else start
+    if hot_start <= end:
+        totals = aggregate([(model, model) for model in ARCHIVES], [user_id], hot_start, end)
+        for (_, month), values in totals.items():
+            months[month] = summarize(month, values, False)
+    return [months[month] for month in sorted(months)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move old step, nutrition and wellness rows to the archive.')
+    parser.add_argument('--horizon-days', type=int,
+                        default=int(os.environ.get('ARCHIVE_HORIZON_DAYS', DEFAULT_HORIZON_DAYS)),
+                        help='keep at least this many days in the hot tables')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--vacuum', action='store_true', help='give the freed space back to the OS (SQLite)')
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        run = compact(args.horizon_days, args.batch_size)
+        print(f"Archived rows dated before {run.cutoff}: {run.steps_moved} step, "
+              f"{run.nutrition_moved} nutrition and {run.wellness_moved} wellness")
+        if args.vacuum and db.engine.dialect.name == 'sqlite':
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                connection.execute(text('VACUUM'))
+
+
+if __name__ == '__main__':
+    main()
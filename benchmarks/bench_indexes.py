@@ -0,0 +1,101 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, insert, select, text
+
+from models import db, StepRecord, WellnessRecord, NutritionRecord, DepartmentNutrition
+
+# Times the per-day lookups the dashboard and write routes make, with and without the
+# (user_id|department_id, date) indexes, as the amount of history grows.
+#   python benchmarks/bench_indexes.py --users 200 --days 30 180 365 730
+
+INDEXES = [
+    'uq_step_record_user_date', 'ix_step_record_date', 'uq_wellness_record_user_date',
+    'ix_nutrition_record_user_date', 'uq_department_nutrition_department_date',
+]
+
+
+def seed(engine, users, days, departments=4):
+    today = date.today()
+    steps, wellness, nutrition, department_rows = [], [], [], []
+    for offset in range(days):
+        day = today - timedelta(days=offset)
+        for user_id in range(1, users + 1):
+            steps.append({'user_id': user_id, 'date': day, 'steps': random.randint(2000, 15000), 'goal': 10000})
+            wellness.append({'user_id': user_id, 'date': day, 'mood_score': random.randint(1, 10)})
+            for meal in range(3):
+                nutrition.append({'user_id': user_id, 'date': day, 'food_name': f'meal {meal}', 'calories': random.randint(100, 900)})
+        for department_id in range(1, departments + 1):
+            department_rows.append({'department_id': department_id, 'date': day, 'total_calories': random.randint(10000, 90000)})
+
+    with engine.begin() as connection:
+        connection.execute(insert(StepRecord.__table__), steps)
+        connection.execute(insert(WellnessRecord.__table__), wellness)
+        connection.execute(insert(NutritionRecord.__table__), nutrition)
+        connection.execute(insert(DepartmentNutrition.__table__), department_rows)
+    return len(steps) + len(wellness) + len(nutrition) + len(department_rows)
+
+
+def hot_queries(users):
+    today = date.today()
+    first_of_month = today.replace(day=1)
+    user_id = random.randint(1, users)
+    steps, wellness, nutrition = StepRecord.__table__, WellnessRecord.__table__, NutritionRecord.__table__
+    departments = DepartmentNutrition.__table__
+    return [
+        select(steps).where(steps.c.user_id == user_id, steps.c.date == today),
+        select(wellness).where(wellness.c.user_id == user_id, wellness.c.date == today),
+        select(nutrition).where(nutrition.c.user_id == user_id, nutrition.c.date == today),
+        select(func.sum(nutrition.c.calories)).where(nutrition.c.user_id == user_id, nutrition.c.date >= first_of_month),
+        select(departments).where(departments.c.department_id == 1, departments.c.date == today),
+    ]
+
+
+def time_queries(engine, users, repeats):
+    with engine.connect() as connection:
+        started = time.perf_counter()
+        for _ in range(repeats):
+            for query in hot_queries(users):
+                connection.execute(query).all()
+        return (time.perf_counter() - started) / repeats * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-day record lookups against history size.')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--days', type=int, nargs='+', default=[30, 180, 365])
+    parser.add_argument('--repeats', type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'days':>6} {'rows':>10} {'no index ms':>12} {'indexed ms':>11} {'speedup':>8}")
+    for days in args.days:
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+            db.metadata.create_all(engine)
+            with engine.begin() as connection:
+                for name in INDEXES:
+                    connection.execute(text(f'DROP INDEX IF EXISTS {name}'))
+            rows = seed(engine, args.users, days)
+
+            without = time_queries(engine, args.users, args.repeats)
+            for table in db.metadata.sorted_tables:
+                for index in table.indexes:
+                    if index.name in INDEXES:
+                        index.create(engine)
+            with engine.begin() as connection:
+                connection.execute(text('ANALYZE'))
+            indexed = time_queries(engine, args.users, args.repeats)
+            engine.dispose()
+
+        print(f"{days:>6} {rows:>10,} {without:>12.2f} {indexed:>11.3f} {without / indexed:>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import os
+import resource
+import selectors
+import socket
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from live import LiveEvents
+
+# Holds thousands of idle Server-Sent Events streams open against LiveEvents and measures how
+# long a leaderboard event takes to reach all of them:
+#   python benchmarks/bench_live.py --clients 5000 --events 20
+# The clients are read by a single selector thread, so the numbers reflect the server side.
+
+
+class BenchApp:
+    secret_key = 'bench-secret'
+
+
+class BenchRequest:
+    scheme = 'http'
+    host = '127.0.0.1'
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def connect(port, path, count):
+    clients = []
+    for _ in range(count):
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall(f'GET {path} HTTP/1.1\r\nHost: bench\r\n\r\n'.encode())
+        clients.append(sock)
+    return clients
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fan-out latency of the live events stream.')
+    parser.add_argument('--clients', type=int, default=5000)
+    parser.add_argument('--events', type=int, default=20)
+    parser.add_argument('--port', type=int, default=18001)
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = args.clients * 2 + 100  # both ends of every connection live in this process
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+
+    live = LiveEvents(host='127.0.0.1', port=args.port, max_clients=args.clients + 1)
+    live.init_app(BenchApp())
+    live.ensure_started()
+    path = '/events?' + live.url(BenchRequest()).split('?', 1)[1]
+
+    started = time.perf_counter()
+    clients = connect(args.port, path, args.clients)
+    while live.stats()['clients'] < args.clients:
+        time.sleep(0.05)
+    print(f"{args.clients} streams open in {time.perf_counter() - started:.2f} s, "
+          f"{threading.active_count()} threads in the process")
+
+    selector = selectors.DefaultSelector()
+    for sock in clients:
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ)
+
+    def drain(marker):
+        # Seconds until every client has read a frame containing marker
+        waiting = set(clients)
+        began = time.perf_counter()
+        while waiting:
+            for key, _ in selector.select(timeout=10):
+                data = key.fileobj.recv(65536)
+                if marker in data:
+                    waiting.discard(key.fileobj)
+            if time.perf_counter() - began > 30:
+                raise RuntimeError(f'{len(waiting)} clients did not receive the event')
+        return time.perf_counter() - began
+
+    drain(b'retry')
+    latencies = []
+    for index in range(args.events):
+        marker = f'"round":{index}'.encode()
+        began = time.perf_counter()
+        live.publish('leaderboard', {'round': index, 'users': [{'name': f'User {n}', 'total_steps': 100000 - n}
+                                                              for n in range(10)]})
+        drain(marker)
+        latencies.append(time.perf_counter() - began)
+
+    latencies.sort()
+    print(f"fan-out to {args.clients} clients: p50 {percentile(latencies, 0.5) * 1000:.1f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms")
+    print(live.stats())
+    for sock in clients:
+        sock.close()
+
+
+if __name__ == '__main__':
+    main()
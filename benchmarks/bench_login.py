@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import rsa
+from google.auth import crypt, jwt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from google_login import SCOPES, GoogleLogin
+
+# Logins/sec of the Google callback path (token exchange + ID token verification) against a
+# local stand-in for Google's token and cert endpoints:
+#   python benchmarks/bench_login.py --threads 16 --duration 10 --latency-ms 20
+# "baseline" is the old per-request code: a new Flow and session per login and the signing
+# certs downloaded again for every token. "cached" is GoogleLogin.
+
+os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'  # the stand-in speaks plain http
+
+CLIENT_ID = 'bench-client.apps.googleusercontent.com'
+CLIENT_SECRET = 'bench-secret'
+REDIRECT_URI = 'http://localhost:8000/auth/google/callback'
+KEY_ID = 'bench-key'
+TOKEN_POOL = 64  # pre-signed ID tokens; signing with pure-Python rsa would dominate otherwise
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def signed_tokens(private_key, count):
+    signer = crypt.RSASigner.from_string(private_key.save_pkcs1().decode(), KEY_ID)
+    now = int(time.time())
+    return [jwt.encode(signer, {
+        'iss': 'https://accounts.google.com', 'aud': CLIENT_ID, 'sub': str(100000 + index),
+        'email': f'bench{index}@example.com', 'name': f'Bench User {index}',
+        'iat': now, 'exp': now + 3600,
+    }).decode() for index in range(count)]
+
+
+def start_google(public_key, tokens, latency, cert_max_age):
+    counters = {'token': 0, 'certs': 0}
+    lock = threading.Lock()
+    certs = json.dumps({KEY_ID: public_key.save_pkcs1().decode()}).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True  # no delayed-ACK stalls on kept-alive connections
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, body, headers=()):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            with lock:
+                counters['certs'] += 1
+            self._send(certs, [('Cache-Control', f'public, max-age={cert_max_age}, must-revalidate, no-transform')])
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            with lock:
+                counters['token'] += 1
+                token = tokens[counters['token'] % len(tokens)]
+            self._send(json.dumps({'access_token': 'bench-access', 'token_type': 'Bearer', 'expires_in': 3599,
+                                   'scope': ' '.join(SCOPES), 'id_token': token}).encode())
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, counters
+
+
+def baseline_login(base_url):
+    # The callback before GoogleLogin, pointed at the stand-in
+    from google_auth_oauthlib.flow import Flow
+    from google.oauth2 import id_token
+    from google.auth.transport import requests as google_requests
+
+    def login(authorization_response, state):
+        flow = Flow.from_client_config({'web': {
+            'client_id': CLIENT_ID, 'client_secret': CLIENT_SECRET, 'auth_uri': f'{base_url}/auth',
+            'token_uri': f'{base_url}/token', 'redirect_uris': [REDIRECT_URI]}}, scopes=SCOPES)
+        flow.redirect_uri = REDIRECT_URI
+        flow.fetch_token(authorization_response=authorization_response)
+        return id_token.verify_token(flow.credentials.id_token, google_requests.Request(), CLIENT_ID,
+                                     certs_url=f'{base_url}/certs')
+    return login
+
+
+def cached_login(base_url, pool_size):
+    google_login = GoogleLogin(CLIENT_ID, CLIENT_SECRET, REDIRECT_URI, auth_uri=f'{base_url}/auth',
+                               token_uri=f'{base_url}/token', certs_url=f'{base_url}/certs', pool_size=pool_size)
+    return google_login.complete
+
+
+def run(name, login, threads, duration):
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def user(index):
+        attempt = 0
+        while time.perf_counter() < deadline:
+            attempt += 1
+            state = f's{index}x{attempt}'
+            callback = f'{REDIRECT_URI}?' + urllib.parse.urlencode({'state': state, 'code': f'c{index}x{attempt}'})
+            began = time.perf_counter()
+            try:
+                login(callback, state)
+                elapsed, error = time.perf_counter() - began, None
+            except Exception as e:
+                elapsed, error = time.perf_counter() - began, e
+            with lock:
+                latencies.append(elapsed)
+                if error:
+                    errors.append(error)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=user, args=(index,)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"{name:<10} {len(latencies) / elapsed:8.1f} logins/s   p50 {percentile(latencies, 0.5) * 1000:6.1f} ms"
+          f"   p95 {percentile(latencies, 0.95) * 1000:6.1f} ms   p99 {percentile(latencies, 0.99) * 1000:6.1f} ms"
+          f"   errors {len(errors)}")
+    if errors:
+        print(f"           first error: {errors[0]!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Google sign-in callbacks against a local stand-in.')
+    parser.add_argument('--mode', action='append', choices=['baseline', 'cached'])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per mode')
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='stand-in response time')
+    parser.add_argument('--cert-max-age', type=int, default=21600, help='Cache-Control max-age on the certs')
+    parser.add_argument('--key-bits', type=int, default=2048)
+    args = parser.parse_args()
+
+    public_key, private_key = rsa.newkeys(args.key_bits)
+    tokens = signed_tokens(private_key, TOKEN_POOL)
+    server, counters = start_google(public_key, tokens, args.latency_ms / 1000, args.cert_max_age)
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    for mode in args.mode or ['baseline', 'cached']:
+        before = dict(counters)
+        login = baseline_login(base_url) if mode == 'baseline' else cached_login(base_url, args.threads)
+        run(mode, login, args.threads, args.duration)
+        print(f"           token requests {counters['token'] - before['token']}, "
+              f"cert downloads {counters['certs'] - before['certs']}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Load scenarios against a real HTTP server backed by a seeded database and the fake Gemini
+# server, so hot routes can be measured without Google sign-in or the live API:
+#   python benchmarks/loadtest.py --users 2000 --days 30 --threads 16 --duration 20 \
+#       --gemini-latency-ms 800 --scenario food-logging --scenario leaderboard-storm
+# Without --database-url a temporary SQLite database is created and seeded.
+
+FOODS = ['apple', 'banana', 'oatmeal', 'greek yogurt', 'scrambled eggs', 'toast with butter',
+         'chicken salad', 'turkey sandwich', 'sushi', 'caesar salad', 'black coffee', 'latte',
+         'blueberry muffin', 'granola bar', 'orange juice', 'bagel with cream cheese']
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def request(self, session, method, url, label, **kwargs):
+        began = time.perf_counter()
+        try:
+            response = session.request(method, url, allow_redirects=False, timeout=60, **kwargs)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        elapsed = time.perf_counter() - began
+        with self._lock:
+            self.latencies.setdefault(label, []).append(elapsed)
+            if not ok:
+                self.errors[label] = self.errors.get(label, 0) + 1
+        return response
+
+
+def dashboard_views(recorder, session, base_url, rng):
+    recorder.request(session, 'GET', f'{base_url}/dashboard', 'GET /dashboard')
+    time.sleep(rng.uniform(0, 0.05))
+
+
+def leaderboard_storm(recorder, session, base_url, rng):
+    # No think time: every virtual user refreshes the leaderboard as fast as it can
+    recorder.request(session, 'GET', f'{base_url}/leaderboard', 'GET /leaderboard')
+
+
+def morning_food_logging(recorder, session, base_url, rng):
+    # Look a food up (a mix of popular items and one-offs that miss the cache), then log it
+    food = rng.choice(FOODS) if rng.random() < 0.7 else f'{rng.choice(FOODS)} x{rng.randint(1, 10000)}'
+    response = recorder.request(session, 'GET', f'{base_url}/api/gemini/search', 'GET /api/gemini/search',
+                                params={'foodName': food})
+    calories = 100
+    if response is not None and response.status_code == 200:
+        calories = response.json().get('calories') or calories
+    recorder.request(session, 'POST', f'{base_url}/add-food', 'POST /add-food',
+                     data={'food_name': food, 'calories': str(calories)})
+    if rng.random() < 0.2:
+        recorder.request(session, 'POST', f'{base_url}/api/food/batch', 'POST /api/food/batch',
+                         json={'foods': rng.sample(FOODS, 3)})
+    recorder.request(session, 'GET', f'{base_url}/dashboard', 'GET /dashboard')
+
+
+def lunch_challenge(recorder, session, base_url, rng):
+    # Everyone looks up the same new item at the same moment; the name changes every half
+    # second so each wave misses the cache and identical lookups have to be coalesced
+    wave = int(time.time() * 2)
+    recorder.request(session, 'GET', f'{base_url}/api/gemini/search', 'GET /api/gemini/search',
+                     params={'foodName': f'department lunch challenge special {wave}'})
+    time.sleep(max(0.0, (wave + 1) / 2 - time.time()))
+
+
+SCENARIOS = {
+    'dashboard': dashboard_views,
+    'leaderboard-storm': leaderboard_storm,
+    'food-logging': morning_food_logging,
+    'lunch-challenge': lunch_challenge,
+}
+
+
+def run_scenario(name, base_url, user_ids, threads, duration, seed):
+    recorder = Recorder()
+    start = threading.Barrier(threads)
+    deadline = [0.0]
+
+    def virtual_user(index):
+        rng = random.Random(seed * 1000 + index)
+        session = requests.Session()
+        session.get(f'{base_url}/test-login/{rng.choice(user_ids)}')
+        if start.wait() == 0:
+            deadline[0] = time.perf_counter() + duration
+        while deadline[0] == 0.0:
+            time.sleep(0.001)
+        while time.perf_counter() < deadline[0]:
+            SCENARIOS[name](recorder, session, base_url, rng)
+
+    workers = [threading.Thread(target=virtual_user, args=(index,)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    print(f"\n{name} ({threads} users, {duration:.0f}s)")
+    print(f"{'request':<28} {'count':>7} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for label, latencies in sorted(recorder.latencies.items()):
+        latencies.sort()
+        print(f"{label:<28} {len(latencies):>7} {recorder.errors.get(label, 0):>7} {len(latencies) / duration:>8.1f} "
+              f"{percentile(latencies, 0.50) * 1000:>8.1f} {percentile(latencies, 0.95) * 1000:>8.1f} "
+              f"{percentile(latencies, 0.99) * 1000:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run load scenarios against a seeded app and a fake Gemini.')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS))
+    parser.add_argument('--database-url', help='existing database to use (it is reseeded unless --no-seed)')
+    parser.add_argument('--no-seed', action='store_true', help='reuse the data already in --database-url')
+    parser.add_argument('--users', type=int, default=500, help='synthetic users to seed')
+    parser.add_argument('--days', type=int, default=30, help='days of history per user')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=16, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=15.0, help='seconds per scenario')
+    parser.add_argument('--gemini-latency-ms', type=float, default=500.0)
+    parser.add_argument('--gemini-jitter-ms', type=float, default=200.0)
+    parser.add_argument('--gemini-error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    from fake_gemini import start_fake_gemini
+    fake = start_fake_gemini(latency_ms=args.gemini_latency_ms, jitter_ms=args.gemini_jitter_ms,
+                             error_rate=args.gemini_error_rate)
+
+    directory = tempfile.TemporaryDirectory()
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(directory.name, 'loadtest.db')}"
+    os.environ['ARCHIVE_DATABASE_URL'] = f"sqlite:///{os.path.join(directory.name, 'loadtest_archive.db')}"
+    os.environ['GEMINI_API_BASE'] = fake.base_url
+    os.environ['GEMINI_API_KEY'] = 'fake'
+    os.environ['ENABLE_TEST_LOGIN'] = '1'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    # Virtual users look foods up far faster than people do; keep the per-user limit out of the way
+    os.environ.setdefault('GEMINI_USER_RATE_PER_MINUTE', '0')
+    os.environ.setdefault('GEMINI_GLOBAL_RATE_PER_MINUTE', '0')
+
+    from werkzeug.serving import make_server
+    from app import app, db
+    from models import User
+    import init_db
+
+    if not (args.database_url and args.no_seed):
+        init_db.init_database(args.users, args.days, args.seed)
+    with app.app_context():
+        user_ids = [user_id for (user_id,) in db.session.query(User.id)]
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # no access log line per request
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    for name in args.scenario or list(SCENARIOS):
+        run_scenario(name, base_url, user_ids, args.threads, args.duration, args.seed)
+    print(f"\nFake Gemini requests: {fake.request_count}")
+    from app import gemini_admission, gemini_flight
+    print(f"Coalesced lookups: {gemini_flight.stats()['coalesced']}, "
+          f"rate limited: {gemini_admission.stats()['rejected_user'] + gemini_admission.stats()['rejected_global']}")
+
+    server.shutdown()
+    fake.shutdown()
+    directory.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from models import db, User, Department, StepRecord, WellnessRecord, DepartmentRollup
+from upserts import write_steps, write_wellness
+from rollups import RollupBatch
+
+# Hammers the daily writes and their department rollup deltas from many threads and checks
+# nothing was lost, duplicated or counted from a stale value.
+#   python benchmarks/stress_upserts.py --threads 16 --operations 200
+# --legacy runs the old query-then-insert-or-modify code for comparison.
+
+
+def legacy_write_steps(user_id, day, steps):
+    row = StepRecord.query.filter_by(user_id=user_id, date=day).first()
+    if not row:
+        db.session.add(StepRecord(user_id=user_id, date=day, steps=steps))
+        return None
+    previous, row.steps = row.steps, steps
+    return previous
+
+
+def legacy_write_wellness(user_id, day, **fields):
+    row = WellnessRecord.query.filter_by(user_id=user_id, date=day).first()
+    previous = None
+    if not row:
+        row = WellnessRecord(user_id=user_id, date=day)
+        db.session.add(row)
+    else:
+        previous = {name: getattr(row, name) for name in ('mood_score', 'sleep_hours', 'stress_level')}
+    for name, value in fields.items():
+        setattr(row, name, value)
+    return previous
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrency stress test for the daily upserts.')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--operations', type=int, default=200, help='operations per thread')
+    parser.add_argument('--users', type=int, default=4, help='users sharing the same day (contention)')
+    parser.add_argument('--legacy', action='store_true')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(directory, 'stress.db')}"
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30}}
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all(bind_key=None)
+        db.session.add(Department(id=1, name='Stress'))
+        for user_id in range(1, args.users + 1):
+            db.session.add(User(id=user_id, email=f'user{user_id}@example.com', name=f'User {user_id}', department_id=1))
+        db.session.commit()
+
+    steps_write = legacy_write_steps if args.legacy else write_steps
+    wellness_write = legacy_write_wellness if args.legacy else write_wellness
+
+    today = date.today()
+    errors = []
+    successes = [0]
+    lock = threading.Lock()
+    start = threading.Barrier(args.threads)
+
+    def worker(index):
+        start.wait()
+        with app.app_context():
+            for operation in range(args.operations):
+                user_id = 1 + (index + operation) % args.users
+                try:
+                    rollup = RollupBatch()
+                    rollup.steps(1, today, steps_write(user_id, today, operation), operation)
+                    mood = {'mood_score': operation % 10 + 1}
+                    rollup.wellness(1, today, wellness_write(user_id, today, **mood), mood)
+                    rollup.food(1, today, 1)
+                    rollup.apply()
+                    db.session.commit()
+                    with lock:
+                        successes[0] += 1
+                except (IntegrityError, OperationalError) as e:
+                    db.session.rollback()
+                    with lock:
+                        errors.append(type(e).__name__)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        steps = db.session.query(db.func.count(StepRecord.id), db.func.sum(StepRecord.steps)).filter_by(date=today).one()
+        moods = db.session.query(db.func.count(WellnessRecord.id),
+                                 db.func.sum(WellnessRecord.mood_score)).filter_by(date=today).one()
+        buckets = DepartmentRollup.query.filter_by(period='day', bucket_start=today).all()
+        bucket = buckets[0] if len(buckets) == 1 else None
+
+    committed = successes[0]
+    print(f"{'legacy' if args.legacy else 'upsert'}: {committed} transactions in {elapsed:.2f}s "
+          f"({committed / elapsed:.0f}/s), {len(errors)} failed")
+    print(f"step rows {steps[0]} (expected {args.users}), wellness rows {moods[0]} (expected {args.users}), "
+          f"department day buckets {len(buckets)} (expected 1)")
+    ok = steps[0] == args.users and moods[0] == args.users and bucket is not None
+    if bucket is not None:
+        print(f"rollup steps {bucket.steps} (rows say {steps[1]}), step entries {bucket.step_entries}, "
+              f"mood total {bucket.mood_total} (rows say {moods[1]}), mood entries {bucket.mood_entries}, "
+              f"food entries {bucket.food_entries} (expected {committed})")
+        ok = ok and (bucket.steps, bucket.step_entries, bucket.mood_total, bucket.mood_entries,
+                     bucket.food_entries) == (steps[1], steps[0], moods[1], moods[0], committed)
+    print('OK' if ok else 'FAILED')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from models import db
+from upserts import DIALECT_INSERTS
+
+
+class UnsupportedDatabase(Exception):
+    pass
+
+
+def database_uri():
+    uri = os.environ.get('DATABASE_URL', 'sqlite:///altabwell.db')
+    # Heroku-style URLs use the scheme SQLAlchemy dropped
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def archive_uri():
+    # Raw rows older than the archive horizon (see archive.py) live in their own database
+    uri = os.environ.get('ARCHIVE_DATABASE_URL', 'sqlite:///altabwell_archive.db')
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def engine_options(uri):
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite':
+        # SQLite has no server-side pool; the busy timeout lets writers queue instead of failing
+        return {
+            'connect_args': {
+                'timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)) / 1000,
+                'check_same_thread': False,
+            }
+        }
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True,
+    }
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers continue while a write is in progress; NORMAL sync is safe in WAL mode
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')}")
+    cursor.execute(f"PRAGMA synchronous={os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')}")
+    cursor.execute(f"PRAGMA busy_timeout={int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))}")
+    cursor.close()
+
+
+def configure_database(app):
+    uri = database_uri()
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri)
+    app.config['SQLALCHEMY_BINDS'] = {'archive': dict(engine_options(archive_uri()), url=archive_uri())}
+    db.init_app(app)
+
+    with app.app_context():
+        # Daily totals are written with INSERT ... ON CONFLICT, which only some databases have
+        dialect = db.engine.dialect.name
+        if dialect not in DIALECT_INSERTS:
+            raise UnsupportedDatabase(
+                f"DATABASE_URL uses {dialect}, but only {' and '.join(sorted(DIALECT_INSERTS))} are supported"
+            )
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+                event.listen(engine, 'connect', set_sqlite_pragmas)
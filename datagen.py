@@ -0,0 +1,267 @@
+import argparse
+import math
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import insert, text
+
+from models import db, User, Department
+from rollups import rebuild as rebuild_rollups
+
+# Synthetic users with step, wellness and food history for sizing tests:
+#   python datagen.py --users 20000 --days 365 --seed 7
+#   python datagen.py --users 5000 --days 30 --append   # keep existing data
+# Rows are written with one executemany per batch; on SQLite the driver is called directly
+# with tuples, skipping per-row parameter processing.
+
+DEPARTMENT_NAMES = ['Engineering', 'Sales', 'Operations', 'Customer Support', 'Marketing', 'Finance',
+                    'Human Resources', 'IT', 'Legal', 'Research', 'Facilities', 'Product']
+FIRST_NAMES = ['Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Jamie', 'Avery', 'Quinn',
+               'Maria', 'Wei', 'Aisha', 'Omar', 'Priya', 'Lucas', 'Sofia', 'Kenji', 'Noah', 'Leila']
+LAST_NAMES = ['Smith', 'Garcia', 'Chen', 'Khan', 'Johnson', 'Müller', 'Rossi', 'Kim', 'Silva', 'Nguyen',
+              'Brown', 'Patel', 'Cohen', 'Okafor', 'Larsen', 'Ivanova', 'Tanaka', 'Dubois', 'Haddad', 'Lopez']
+
+# name, calories, protein, carbs, fat, fiber, meal type
+FOODS = [
+    ('Oatmeal with berries', 310, 9, 54, 6, 8, 'breakfast'),
+    ('Scrambled eggs and toast', 380, 20, 30, 19, 2, 'breakfast'),
+    ('Greek yogurt with granola', 290, 17, 38, 8, 3, 'breakfast'),
+    ('Bagel with cream cheese', 450, 13, 62, 16, 2, 'breakfast'),
+    ('Chicken salad', 420, 35, 14, 25, 5, 'lunch'),
+    ('Turkey sandwich', 510, 30, 48, 20, 4, 'lunch'),
+    ('Sushi combo', 480, 22, 70, 10, 3, 'lunch'),
+    ('Lentil soup', 330, 18, 50, 6, 15, 'lunch'),
+    ('Burrito bowl', 690, 34, 80, 24, 13, 'lunch'),
+    ('Salmon with rice', 650, 40, 62, 24, 2, 'dinner'),
+    ('Spaghetti bolognese', 700, 32, 85, 24, 6, 'dinner'),
+    ('Vegetable stir fry with tofu', 480, 24, 48, 20, 8, 'dinner'),
+    ('Cheeseburger and fries', 950, 38, 92, 48, 6, 'dinner'),
+    ('Apple', 95, 0.5, 25, 0.3, 4.4, 'snack'),
+    ('Banana', 105, 1.3, 27, 0.4, 3.1, 'snack'),
+    ('Almonds', 170, 6, 6, 15, 3.5, 'snack'),
+    ('Latte', 190, 10, 18, 7, 0, 'snack'),
+    ('Chocolate bar', 230, 3, 25, 13, 2, 'snack'),
+]
+MEAL_MINUTES = {'breakfast': (420, 570), 'lunch': (705, 810), 'dinner': (1080, 1230), 'snack': (600, 960)}
+
+COLUMNS = {
+    'user': ('id', 'email', 'name', 'department_id', 'created_at', 'last_login'),
+    'step_record': ('user_id', 'date', 'steps', 'goal', 'created_at', 'updated_at'),
+    'wellness_record': ('user_id', 'date', 'mood_score', 'sleep_hours', 'water_intake', 'stress_level', 'created_at'),
+    'nutrition_record': ('user_id', 'date', 'food_name', 'calories', 'protein', 'carbs', 'fat', 'fiber',
+                         'meal_type', 'created_at'),
+}
+
+
+class BulkWriter:
+    # Buffers rows per table and writes each full batch with a single executemany
+
+    def __init__(self, connection, batch_size):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.raw = connection.dialect.name == 'sqlite'
+        self.buffers = {}
+        self.written = {}
+        self._statements = {}
+
+    def add(self, table, row):
+        buffer = self.buffers.setdefault(table, [])
+        buffer.append(row)
+        if len(buffer) >= self.batch_size:
+            self.flush(table)
+
+    def flush(self, table=None):
+        for name in [table] if table else list(self.buffers):
+            rows = self.buffers.get(name)
+            if not rows:
+                continue
+            self.buffers[name] = []
+            if self.raw:
+                self.connection.exec_driver_sql(self._statement(name), rows)
+            else:
+                columns = COLUMNS[name]
+                self.connection.execute(insert(db.metadata.tables[name]), [dict(zip(columns, row)) for row in rows])
+            self.written[name] = self.written.get(name, 0) + len(rows)
+
+    def _statement(self, name):
+        if name not in self._statements:
+            compiled = insert(db.metadata.tables[name]).compile(
+                dialect=self.connection.dialect, column_keys=list(COLUMNS[name])
+            )
+            self._statements[name] = str(compiled)
+        return self._statements[name]
+
+
+class Timestamps:
+    # SQLite gets ISO strings in SQLAlchemy's storage format; other drivers get date objects
+    def __init__(self, days, as_text):
+        self.as_text = as_text
+        self.days = [day.isoformat() for day in days] if as_text else days
+        self.midnights = None if as_text else [datetime.combine(day, datetime.min.time()) for day in days]
+
+    def at(self, index, minutes):
+        if self.as_text:
+            return f'{self.days[index]} {minutes // 60:02d}:{minutes % 60:02d}:00.000000'
+        return self.midnights[index] + timedelta(minutes=minutes)
+
+
+def poisson(rng, mean):
+    # Knuth's method; fine for the small means used here
+    limit, count, product = math.exp(-mean), 0, rng.random()
+    while product > limit:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+def clamp(value, low, high):
+    return max(low, min(high, value))
+
+
+def ensure_departments(count):
+    names = DEPARTMENT_NAMES[:count] + [f'Department {index}' for index in range(len(DEPARTMENT_NAMES) + 1, count + 1)]
+    existing = {department.name: department.id for department in Department.query.filter(Department.name.in_(names))}
+    for name in names:
+        if name not in existing:
+            department = Department(name=name)
+            db.session.add(department)
+            db.session.flush()
+            existing[name] = department.id
+    db.session.commit()
+    return [existing[name] for name in names]
+
+
+def reset_user_sequence(connection):
+    # Users are inserted with explicit ids, so PostgreSQL's serial has to be moved past them
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text(
+            "SELECT setval(pg_get_serial_sequence('\"user\"', 'id'), (SELECT MAX(id) FROM \"user\"))"
+        ))
+
+
+def write_history(writer, users, days, rng, steps_mean=7500, adherence=0.7, wellness_rate=0.5, foods_per_day=2.5):
+    # users: [(user_id, department_id)]; days: consecutive dates, oldest first
+    stamps = Timestamps(days, writer.raw)
+    weekend = [day.weekday() >= 5 for day in days]
+    food_weights = [1.0 if food[6] == 'snack' else 2.0 for food in FOODS]
+    spread = 6.0  # higher means users are more alike in how often they log
+    for user_id, _ in users:
+        baseline = rng.lognormvariate(math.log(steps_mean), 0.35)
+        logs = rng.betavariate(adherence * spread, (1 - adherence) * spread)
+        usual_sleep = rng.gauss(7.0, 0.6)
+        for index in range(len(days)):
+            day = stamps.days[index]
+            steps = 0
+            if rng.random() < logs:
+                steps = int(max(0, rng.gauss(baseline * (0.8 if weekend[index] else 1.0), baseline * 0.25)))
+                logged_at = stamps.at(index, 1260)
+                writer.add('step_record', (user_id, day, steps, 10000, logged_at, logged_at))
+
+            if rng.random() < logs * wellness_rate:
+                sleep = round(clamp(rng.gauss(usual_sleep + (0.6 if weekend[index] else 0), 0.8), 3, 12), 1)
+                stress = int(clamp(round(rng.gauss(5 - (sleep - 7) - (1.5 if weekend[index] else 0), 1.5)), 1, 10))
+                mood = int(clamp(round(rng.gauss(6 + (sleep - 7) * 0.5 + steps / 10000 - (stress - 5) * 0.3, 1.2)), 1, 10))
+                writer.add('wellness_record', (user_id, day, mood, sleep, round(clamp(rng.gauss(2.0, 0.5), 0.3, 5), 1),
+                                               stress, stamps.at(index, 1290)))
+
+            if rng.random() < logs:
+                for food in rng.choices(FOODS, weights=food_weights, k=poisson(rng, foods_per_day)):
+                    name, calories, protein, carbs, fat, fiber, meal_type = food
+                    portion = rng.uniform(0.75, 1.3)
+                    calories = round(calories * portion)
+                    writer.add('nutrition_record', (
+                        user_id, day, name, calories, round(protein * portion, 1), round(carbs * portion, 1),
+                        round(fat * portion, 1), round(fiber * portion, 1), meal_type,
+                        stamps.at(index, rng.randint(*MEAL_MINUTES[meal_type]))
+                    ))
+
+
+def add_history(users, days, seed=None, batch_size=10000, **distribution):
+    # History ending today for users that already exist: [(user_id, department_id)]
+    today = datetime.utcnow().date()
+    dates = [today - timedelta(days=offset) for offset in range(days - 1, -1, -1)]
+    with db.engine.connect() as connection:
+        writer = BulkWriter(connection, batch_size)
+        write_history(writer, users, dates, random.Random(seed), **distribution)
+        writer.flush()
+        connection.commit()
+    rebuild_rollups(dates[0], dates[-1])
+    return writer.written
+
+
+def generate(users, days, departments=12, seed=None, append=False, batch_size=10000, end_date=None,
+             commit_every=2000, **distribution):
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    if not append:
+        db.drop_all(bind_key=None)
+    db.create_all()
+
+    department_ids = ensure_departments(departments)
+    # Department sizes fall off like a Zipf distribution: a few large teams, many small ones
+    weights = [1 / (rank + 1) ** 0.8 for rank in range(len(department_ids))]
+    end_date = end_date or datetime.utcnow().date()
+    dates = [end_date - timedelta(days=offset) for offset in range(days - 1, -1, -1)]
+    first_id = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    db.session.commit()
+
+    with db.engine.connect() as connection:
+        writer = BulkWriter(connection, batch_size)
+        as_text = writer.raw
+        for chunk_start in range(first_id, first_id + users, commit_every):
+            chunk = []
+            for user_id in range(chunk_start, min(chunk_start + commit_every, first_id + users)):
+                first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+                department_id = rng.choices(department_ids, weights=weights)[0]
+                joined = dates[0] - timedelta(days=rng.randint(0, 1000))
+                joined = f'{joined.isoformat()} 09:00:00.000000' if as_text else datetime.combine(joined, datetime.min.time())
+                writer.add('user', (user_id, f'{first}.{last}.{user_id}@example.com'.lower(), f'{first} {last}',
+                                    department_id, joined, joined))
+                chunk.append((user_id, department_id))
+            writer.flush('user')
+            write_history(writer, chunk, dates, rng, **distribution)
+            writer.flush()
+            connection.commit()
+        reset_user_sequence(connection)
+        connection.commit()
+
+    # Department rollups are rebuilt from the new rows rather than maintained row by row
+    rebuild_rollups(dates[0], dates[-1])
+
+    elapsed = time.perf_counter() - started
+    result = dict(writer.written, seconds=round(elapsed, 1))
+    result['rows_per_second'] = round(sum(writer.written.values()) / elapsed) if elapsed else None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic users with step, wellness and food history.')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=90, help='days of history, ending today')
+    parser.add_argument('--end-date', type=date.fromisoformat, help='last day of history, YYYY-MM-DD')
+    parser.add_argument('--departments', type=int, default=12)
+    parser.add_argument('--seed', type=int, help='random seed; the same seed gives the same data')
+    parser.add_argument('--append', action='store_true', help='add users to the existing data instead of recreating the tables')
+    parser.add_argument('--batch-size', type=int, default=10000, help='rows per executemany')
+    parser.add_argument('--steps-mean', type=float, default=7500, help='typical daily steps')
+    parser.add_argument('--adherence', type=float, default=0.7, help='average share of days a user logs anything')
+    parser.add_argument('--wellness-rate', type=float, default=0.5, help='share of logged days with a wellness check-in')
+    parser.add_argument('--foods-per-day', type=float, default=2.5, help='mean food entries on a logged day')
+    args = parser.parse_args()
+    if not 0 < args.adherence < 1:
+        parser.error('--adherence must be between 0 and 1')
+
+    from app import app
+
+    with app.app_context():
+        result = generate(
+            args.users, args.days, departments=args.departments, seed=args.seed, append=args.append,
+            batch_size=args.batch_size, end_date=args.end_date, steps_mean=args.steps_mean,
+            adherence=args.adherence, wellness_rate=args.wellness_rate, foods_per_day=args.foods_per_day
+        )
+    print(', '.join(f'{key}: {value}' for key, value in result.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import csv
+import io
+import json
+from datetime import date
+
+from sqlalchemy import select
+
+from models import db, User, Department, StepRecord, NutritionRecord, WellnessRecord
+from archive import archived_rows
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet export is unavailable without pyarrow
+    pyarrow = None
+
+CHUNK_SIZE = 5000
+
+# Columns exported for each record type, after the shared date/user/department columns
+EXPORTS = {
+    'steps': (StepRecord, ['steps', 'goal']),
+    'nutrition': (NutritionRecord, ['food_name', 'calories', 'protein', 'carbs', 'fat', 'fiber', 'meal_type']),
+    'wellness': (WellnessRecord, ['mood_score', 'sleep_hours', 'water_intake', 'stress_level']),
+}
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def export_columns(kind):
+    return ['date', 'user_id', 'email', 'department'] + EXPORTS[kind][1]
+
+
+def export_query(kind, start=None, end=None, user_id=None, department_id=None):
+    model, fields = EXPORTS[kind]
+    query = select(
+        model.date, model.user_id, User.email, Department.name,
+        *[getattr(model, field) for field in fields]
+    ).join(User, User.id == model.user_id).outerjoin(Department, Department.id == User.department_id)
+
+    if start:
+        query = query.where(model.date >= start)
+    if end:
+        query = query.where(model.date <= end)
+    if user_id is not None:
+        query = query.where(model.user_id == user_id)
+    if department_id is not None:
+        query = query.where(User.department_id == department_id)
+    return query.order_by(model.date, model.user_id, model.id)
+
+
+def archived_chunks(kind, chunk_size=CHUNK_SIZE, start=None, end=None, user_id=None, department_id=None):
+    # Rows older than the archive horizon, from the archive database. It has no user table,
+    # so email and department are filled in from the main database.
+    model, fields = EXPORTS[kind]
+    users = select(User.id, User.email, Department.name).outerjoin(Department, Department.id == User.department_id)
+    if user_id is not None:
+        users = users.where(User.id == user_id)
+    if department_id is not None:
+        users = users.where(User.department_id == department_id)
+    people = {row[0]: row[1:] for row in db.session.execute(users)}
+    if not people:
+        return
+
+    user_ids = [user_id] if user_id is not None else None
+    for partition in archived_rows(model, ['date', 'user_id'] + fields, start, end, user_ids, chunk_size):
+        rows = [(row[0], row[1], *people[row[1]], *row[2:]) for row in partition if row[1] in people]
+        if rows:
+            yield rows
+
+
+def iter_chunks(kind, chunk_size=CHUNK_SIZE, **filters):
+    # Rows come from a streaming cursor (a server-side cursor on PostgreSQL), chunk_size at a time;
+    # archived rows, which are all older, come first
+    yield from archived_chunks(kind, chunk_size, **filters)
+    result = db.session.execute(
+        export_query(kind, **filters).execution_options(stream_results=True, yield_per=chunk_size)
+    )
+    try:
+        for partition in result.partitions(chunk_size):
+            yield partition
+    finally:
+        result.close()
+
+
+def parquet_available():
+    return pyarrow is not None
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, date) else value
+
+
+def write_csv(kind, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(export_columns(kind))
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def write_jsonl(kind, chunks):
+    columns = export_columns(kind)
+    for chunk in chunks:
+        yield ''.join(json.dumps(dict(zip(columns, map(_plain, row)))) + '\n' for row in chunk)
+
+
+class _DrainableSink(io.RawIOBase):
+    # Write-only file that hands back whatever was written since the last drain
+    def __init__(self):
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def parquet_schema(kind):
+    fields = EXPORTS[kind][1]
+    types = {'steps': pyarrow.int64(), 'goal': pyarrow.int64(), 'mood_score': pyarrow.int64(),
+             'stress_level': pyarrow.int64(), 'food_name': pyarrow.string(), 'meal_type': pyarrow.string()}
+    return pyarrow.schema(
+        [('date', pyarrow.date32()), ('user_id', pyarrow.int64()), ('email', pyarrow.string()),
+         ('department', pyarrow.string())] +
+        [(field, types.get(field, pyarrow.float64())) for field in fields]
+    )
+
+
+def write_parquet(kind, chunks):
+    # One row group per chunk, emitted as soon as it is encoded
+    if pyarrow is None:
+        raise RuntimeError('Parquet export requires pyarrow (pip install pyarrow)')
+    schema = parquet_schema(kind)
+    sink = _DrainableSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='snappy')
+    for chunk in chunks:
+        columns = list(zip(*chunk))
+        writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+        ))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl, 'parquet': write_parquet}
+
+
+def export(kind, fmt, chunk_size=CHUNK_SIZE, **filters):
+    # Generator of str (csv, jsonl) or bytes (parquet) pieces
+    return WRITERS[fmt](kind, iter_chunks(kind, chunk_size, **filters))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export step, nutrition or wellness history.')
+    parser.add_argument('kind', choices=sorted(EXPORTS))
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--start', type=date.fromisoformat, help='first date, YYYY-MM-DD')
+    parser.add_argument('--end', type=date.fromisoformat, help='last date, YYYY-MM-DD')
+    parser.add_argument('--department', help='department name')
+    parser.add_argument('--user-email')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('-o', '--output', required=True, help='file to write')
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        filters = {'start': args.start, 'end': args.end}
+        if args.department:
+            department = Department.query.filter_by(name=args.department).first()
+            if not department:
+                parser.error(f'unknown department {args.department!r}')
+            filters['department_id'] = department.id
+        if args.user_email:
+            user = User.query.filter_by(email=args.user_email).first()
+            if not user:
+                parser.error(f'unknown user {args.user_email!r}')
+            filters['user_id'] = user.id
+
+        mode = 'wb' if args.format == 'parquet' else 'w'
+        with open(args.output, mode, newline='' if mode == 'w' else None) as output:
+            for piece in export(args.kind, args.format, args.chunk_size, **filters):
+                output.write(piece)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
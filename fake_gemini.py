@@ -0,0 +1,106 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the Gemini generateContent endpoint, for offline load tests:
+#   python fake_gemini.py --port 8090 --latency-ms 800
+#   GEMINI_API_BASE=http://127.0.0.1:8090 GEMINI_API_KEY=fake python app.py
+
+
+def fake_calories(parts):
+    # Deterministic per prompt/image so repeated requests agree with each other
+    digest = hashlib.sha256()
+    for part in parts:
+        if 'text' in part:
+            digest.update(part['text'].encode('utf-8'))
+        if 'inline_data' in part:
+            digest.update(part['inline_data'].get('data', '').encode('utf-8'))
+    return 50 + int(digest.hexdigest()[:8], 16) % 750
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+
+        delay = server.latency_ms + random.uniform(0, server.jitter_ms)
+        time.sleep(delay / 1000.0)
+
+        with server.lock:
+            server.request_count += 1
+
+        if ':generateContent' not in self.path:
+            return self._send(404, {'error': {'code': 404, 'message': 'Not found'}})
+        if random.random() < server.error_rate:
+            return self._send(503, {'error': {'code': 503, 'message': 'The model is overloaded.'}})
+
+        try:
+            parts = json.loads(body)['contents'][0]['parts']
+        except (ValueError, KeyError, IndexError):
+            return self._send(400, {'error': {'code': 400, 'message': 'Invalid request'}})
+
+        # Batch lookups list their items as JSON and expect an array back
+        items = re.search(r'Items: (\[.*\])', parts[0].get('text', ''), re.S)
+        if items:
+            text = json.dumps([fake_calories([{'text': item}]) for item in json.loads(items.group(1))])
+        else:
+            text = str(fake_calories(parts))
+        self._send(200, {
+            'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}, 'finishReason': 'STOP'}]
+        })
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def start_fake_gemini(host='127.0.0.1', port=0, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, verbose=False):
+    # Starts the server on a background thread; port=0 picks a free port
+    server = ThreadingHTTPServer((host, port), FakeGeminiHandler)
+    server.daemon_threads = True
+    server.latency_ms = latency_ms
+    server.jitter_ms = jitter_ms
+    server.error_rate = error_rate
+    server.verbose = verbose
+    server.request_count = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.base_url = f'http://{host}:{server.server_address[1]}'
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local fake Gemini API server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency-ms', type=float, default=500.0, help='base delay per request')
+    parser.add_argument('--jitter-ms', type=float, default=200.0, help='extra random delay per request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    args = parser.parse_args()
+
+    server = start_fake_gemini(args.host, args.port, args.latency_ms, args.jitter_ms, args.error_rate, verbose=True)
+    print(f"Fake Gemini listening on {server.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam
+
+from models import db, FoodLookupCacheEntry
+from upserts import upsert_food_cache_entry
+
+NUMBER_WORDS = {
+    'a': '1', 'an': '1', 'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5',
+    'six': '6', 'seven': '7', 'eight': '8', 'nine': '9', 'ten': '10', 'dozen': '12',
+    'half': '0.5', 'quarter': '0.25',
+}
+
+UNIT_ALIASES = {
+    'grams': 'g', 'gram': 'g', 'gr': 'g', 'gms': 'g',
+    'kilograms': 'kg', 'kilogram': 'kg', 'kgs': 'kg',
+    'milliliters': 'ml', 'millilitres': 'ml', 'milliliter': 'ml', 'millilitre': 'ml',
+    'liters': 'l', 'litres': 'l', 'liter': 'l', 'litre': 'l',
+    'ounces': 'oz', 'ounce': 'oz', 'pounds': 'lb', 'pound': 'lb', 'lbs': 'lb',
+    'cups': 'cup', 'tablespoons': 'tbsp', 'tablespoon': 'tbsp', 'teaspoons': 'tsp', 'teaspoon': 'tsp',
+    'slices': 'slice', 'pieces': 'piece', 'pcs': 'piece', 'pc': 'piece',
+}
+
+
+def normalize_food_query(food_name):
+    # "1 Banana", "one banana " and "banana" all describe the same lookup
+    text = unicodedata.normalize('NFKC', food_name).lower()
+    text = re.sub(r'(\d+)\s*/\s*(\d+)', lambda m: str(round(int(m.group(1)) / int(m.group(2)), 2)) if int(m.group(2)) else m.group(0), text)
+    text = re.sub(r'(\d)x\b', r'\1', text)
+    text = re.sub(r'(\d)([a-z])', r'\1 \2', text)
+    text = re.sub(r'[^\w\s.]', ' ', text)
+    text = re.sub(r'(?<!\d)\.|\.(?!\d)', ' ', text)
+
+    tokens = []
+    for token in text.split():
+        token = NUMBER_WORDS.get(token, token)
+        token = UNIT_ALIASES.get(token, token)
+        if re.fullmatch(r'\d+\.\d+', token):
+            token = token.rstrip('0').rstrip('.')
+        tokens.append(token)
+
+    if tokens and tokens[0] == 'of':
+        tokens = tokens[1:]
+    if not tokens:
+        return ''
+    if not re.fullmatch(r'\d+(\.\d+)?', tokens[0]):
+        tokens.insert(0, '1')
+    return ' '.join(tokens)[:200]
+
+
+class FoodLookupCache:
+    # In-process LRU in front of the food_lookup_cache_entry table. Memory hits never
+    # touch the database; database hits are promoted into memory. Hit counts and
+    # last_used_at are collected here and written in one batch every so often, and
+    # expired or least recently used rows are pruned every evict_every puts.
+
+    def __init__(self, ttl_seconds=30 * 24 * 3600, memory_size=1024, max_rows=50000, evict_every=100,
+                 hit_flush_size=200, hit_flush_seconds=60):
+        self.ttl_seconds = ttl_seconds
+        self.memory_size = memory_size
+        self.max_rows = max_rows
+        self.evict_every = evict_every
+        self.hit_flush_size = hit_flush_size
+        self.hit_flush_seconds = hit_flush_seconds
+        self._memory = OrderedDict()
+        self._pending_hits = {}  # query_key -> (hits, last used) not yet written
+        self._hits_flushed_at = time.monotonic()
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def get(self, food_name):
+        key = normalize_food_query(food_name)
+        if not key:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    self._counters['memory_hits'] += 1
+                    self._record_hit(key)
+                    return entry[0]
+                del self._memory[key]
+
+        row = db.session.query(FoodLookupCacheEntry.calories, FoodLookupCacheEntry.created_at).filter_by(
+            query_key=key).first()
+        # Expired rows are left for put() to overwrite or _evict_rows() to delete
+        expires_at = row.created_at + timedelta(seconds=self.ttl_seconds) if row else None
+        if row is None or expires_at <= datetime.utcnow():
+            self._count('misses')
+            return None
+
+        calories = row.calories
+        self._remember(key, calories, now + (expires_at - datetime.utcnow()).total_seconds())
+        with self._lock:
+            self._counters['db_hits'] += 1
+            self._record_hit(key)
+            due = (len(self._pending_hits) >= self.hit_flush_size
+                   or time.monotonic() - self._hits_flushed_at >= self.hit_flush_seconds)
+        if due:
+            self._flush_hits()
+            db.session.commit()
+        return calories
+
+    def put(self, food_name, calories):
+        # An upsert, so processes that miss on the same food at once do not collide on query_key
+        key = normalize_food_query(food_name)
+        if not key:
+            return
+
+        upsert_food_cache_entry(key, food_name, calories)
+        with self._lock:
+            self._puts += 1
+            evict = self._puts % self.evict_every == 0
+        if evict:
+            self._flush_hits()
+            self._evict_rows()
+        db.session.commit()
+        self._remember(key, calories, time.time() + self.ttl_seconds)
+
+    def _record_hit(self, key):
+        # Caller holds the lock
+        hits, _ = self._pending_hits.get(key, (0, None))
+        self._pending_hits[key] = (hits + 1, datetime.utcnow())
+
+    def _flush_hits(self):
+        # Adds the collected hits in one executemany; the caller commits
+        with self._lock:
+            pending, self._pending_hits = self._pending_hits, {}
+            self._hits_flushed_at = time.monotonic()
+        if not pending:
+            return
+        table = FoodLookupCacheEntry.__table__
+        db.session.execute(
+            table.update().where(table.c.query_key == bindparam('key')).values(
+                hits=table.c.hits + bindparam('count'), last_used_at=bindparam('used')),
+            [{'key': key, 'count': hits, 'used': used} for key, (hits, used) in pending.items()]
+        )
+
+    def _remember(self, key, calories, expires_at):
+        with self._lock:
+            self._memory[key] = (calories, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _evict_rows(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+        expired = FoodLookupCacheEntry.query.filter(
+            FoodLookupCacheEntry.created_at < cutoff
+        ).delete(synchronize_session=False)
+
+        overflow = FoodLookupCacheEntry.query.count() - self.max_rows
+        if overflow > 0:
+            oldest = db.session.query(FoodLookupCacheEntry.id).order_by(
+                FoodLookupCacheEntry.last_used_at.asc()
+            ).limit(overflow).subquery()
+            FoodLookupCacheEntry.query.filter(
+                FoodLookupCacheEntry.id.in_(db.select(oldest.c.id))
+            ).delete(synchronize_session=False)
+        else:
+            overflow = 0
+
+        if expired or overflow:
+            self._count('evictions', expired + overflow)
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['memory_hits'] + stats['db_hits']) / lookups if lookups else 0.0
+        return stats
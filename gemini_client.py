@@ -0,0 +1,234 @@
+import json
+import random
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import LatencyHistogram
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class GeminiError(Exception):
+    pass
+
+
+class GeminiUnavailable(GeminiError):
+    # Raised without calling the API while the circuit breaker is open
+    pass
+
+
+class GeminiResponseError(GeminiError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            # Half-open: let a single trial request through
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+def extract_calories(text):
+    # Gemini is asked for just a number; take the first one it gives back
+    match = re.search(r'\d+', text)
+    return int(match.group()) if match else None
+
+
+def extract_calorie_list(text, expected):
+    # Batch prompts ask for a JSON array of integers, one per item, in order
+    match = re.search(r'\[[^\[\]]*\]', text)
+    if not match:
+        raise GeminiResponseError('Gemini did not return a calorie list')
+    try:
+        values = json.loads(match.group())
+    except ValueError as e:
+        raise GeminiResponseError(f'Could not parse calorie list: {e}')
+    if len(values) != expected:
+        raise GeminiResponseError(f'Expected {expected} calorie values, got {len(values)}')
+
+    calories = []
+    for value in values:
+        try:
+            calories.append(int(round(float(value))))
+        except (TypeError, ValueError):
+            calories.append(None)
+    return calories
+
+
+class GeminiClient:
+    # One keep-alive connection pool shared by every route and worker thread.
+
+    def __init__(self, api_key, base_url='https://generativelanguage.googleapis.com',
+                 model='gemini-2.5-flash-preview-05-20', pool_size=10, connect_timeout=3.05,
+                 read_timeout=30.0, max_retries=3, backoff_base=0.5, backoff_max=8.0,
+                 breaker_threshold=5, breaker_reset=30.0):
+        self.api_key = api_key
+        self.url = f"{base_url.rstrip('/')}/v1beta/models/{model}:generateContent"
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self.latency = LatencyHistogram()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Content-Type'] = 'application/json'
+
+        self._lock = threading.Lock()
+        self._counters = {'requests': 0, 'retries': 0, 'failures': 0, 'short_circuited': 0}
+        self._statuses = {}
+
+    @property
+    def configured(self):
+        return bool(self.api_key)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _count_status(self, status):
+        with self._lock:
+            self._statuses[status] = self._statuses.get(status, 0) + 1
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        # Full jitter keeps retrying workers from synchronizing
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def generate(self, parts):
+        # Sends one generateContent request and returns the model's text
+        if not self.breaker.allow():
+            self._count('short_circuited')
+            raise GeminiUnavailable('Gemini circuit breaker is open')
+
+        payload = {"contents": [{"parts": parts}]}
+        # Every way out of here reports to the breaker, or a half-open trial would stay in
+        # flight (and the breaker open) for good
+        answered = False
+        try:
+            response = self._post(payload)
+            answered = True
+        finally:
+            if answered:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+                self._count('failures')
+
+        if response.status_code >= 400:
+            # Bad request or key: retrying will not help, and it says nothing about Gemini's health
+            raise GeminiError(f'Gemini returned {response.status_code}: {response.text[:200]}')
+        try:
+            return response.json()['candidates'][0]['content']['parts'][0]['text']
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise GeminiResponseError(f'Could not parse Gemini response: {e}')
+
+    def _post(self, payload):
+        # Returns the first response that is not worth retrying, or raises the last error
+        last_error = None
+        retry_after = None
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._count('retries')
+                time.sleep(self._backoff(attempt - 1, retry_after))
+            retry_after = None
+
+            self._count('requests')
+            started = time.perf_counter()
+            try:
+                response = self.session.post(
+                    self.url, params={'key': self.api_key}, json=payload, timeout=self.timeout
+                )
+            except requests.RequestException as e:
+                # Connection and timeout errors, but also TLS failures and bodies cut off mid-read
+                self.latency.observe(time.perf_counter() - started)
+                self._count_status('error')
+                last_error = GeminiError(f'Could not reach Gemini: {e}')
+                continue
+            self.latency.observe(time.perf_counter() - started)
+            self._count_status(response.status_code)
+
+            if response.status_code in RETRY_STATUSES:
+                retry_after = response.headers.get('Retry-After')
+                last_error = GeminiError(f'Gemini returned {response.status_code}: {response.text[:200]}')
+                continue
+            return response
+
+        raise last_error
+
+    def calories_for_text(self, food_name):
+        prompt = f"Provide ONLY the calorie number (just the number) for {food_name}. Example: For '1 medium apple' just respond with '95'"
+        return extract_calories(self.generate([{"text": prompt}]))
+
+    def calories_for_items(self, food_names):
+        # One request for a whole meal instead of one per item
+        prompt = (
+            "For each food in the JSON list below, estimate its calories. "
+            "Respond with ONLY a JSON array of integers in the same order, for example [95, 150].\n"
+            f"Items: {json.dumps(food_names)}"
+        )
+        return extract_calorie_list(self.generate([{"text": prompt}]), len(food_names))
+
+    def calories_for_image(self, image_base64, mime_type):
+        prompt = "Analyze this food image and provide ONLY the estimated calorie count as a number. For example, if it's a burger, just respond with '650'."
+        return extract_calories(self.generate([
+            {"text": prompt},
+            {"inline_data": {"mime_type": mime_type, "data": image_base64}}
+        ]))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['statuses'] = dict(self._statuses)
+        stats['circuit'] = self.breaker.state
+        stats['latency'] = self.latency.snapshot()
+        return stats
@@ -0,0 +1,121 @@
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from google.auth import exceptions as google_exceptions, jwt
+from google_auth_oauthlib.flow import Flow
+
+SCOPES = ['openid', 'https://www.googleapis.com/auth/userinfo.email', 'https://www.googleapis.com/auth/userinfo.profile']
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+MAX_AGE = re.compile(r'max-age=(\d+)')
+
+
+class GoogleLogin:
+    # Google sign-in with the client config built once, token exchanges over a pooled
+    # keep-alive session and ID tokens verified locally against Google's signing certs.
+    # The certs are fetched again only when their Cache-Control max-age runs out, or when a
+    # token is signed with a key we have not seen (Google rotated its keys).
+
+    def __init__(self, client_id, client_secret, redirect_uri,
+                 auth_uri='https://accounts.google.com/o/oauth2/auth',
+                 token_uri='https://oauth2.googleapis.com/token',
+                 certs_url='https://www.googleapis.com/oauth2/v1/certs',
+                 pool_size=10, timeout=10.0, clock_skew=0, min_refresh_interval=60.0):
+        self.client_id = client_id
+        self.redirect_uri = redirect_uri
+        self.certs_url = certs_url
+        self.timeout = timeout
+        self.clock_skew = clock_skew
+        self.min_refresh_interval = min_refresh_interval
+        self.client_config = {
+            'web': {
+                'client_id': client_id,
+                'client_secret': client_secret,
+                'auth_uri': auth_uri,
+                'token_uri': token_uri,
+                'redirect_uris': [redirect_uri]
+            }
+        }
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
+        self._certs = None
+        self._certs_expire_at = 0.0
+        self._certs_fetched_at = None
+        self._certs_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._counters = {'logins': 0, 'failed': 0, 'cert_fetches': 0, 'cert_cache_hits': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _flow(self, state=None):
+        flow = Flow.from_client_config(self.client_config, scopes=SCOPES, state=state,
+                                       redirect_uri=self.redirect_uri)
+        # Token requests share the keep-alive connections instead of opening new ones
+        flow.oauth2session.mount('http://', self._adapter)
+        flow.oauth2session.mount('https://', self._adapter)
+        return flow
+
+    def authorization_url(self):
+        # (url, state); keep the state in the session for complete()
+        return self._flow().authorization_url(access_type='offline', include_granted_scopes='true')
+
+    def complete(self, authorization_response, state=None):
+        # Exchanges the callback's code for tokens and returns the verified ID token claims
+        try:
+            flow = self._flow(state)
+            flow.fetch_token(authorization_response=authorization_response, timeout=self.timeout)
+            id_info = self.verify(flow.credentials.id_token)
+        except Exception:
+            self._count('failed')
+            raise
+        self._count('logins')
+        return id_info
+
+    def verify(self, token):
+        certs = self.certs()
+        key_id = jwt.decode_header(token).get('kid')
+        if key_id and key_id not in certs:
+            certs = self.certs(refresh=True)
+        id_info = jwt.decode(token, certs=certs, audience=self.client_id, clock_skew_in_seconds=self.clock_skew)
+        if id_info.get('iss') not in GOOGLE_ISSUERS:
+            raise google_exceptions.GoogleAuthError(f"Wrong issuer {id_info.get('iss')!r}")
+        return id_info
+
+    def certs(self, refresh=False):
+        # {key id: PEM certificate}; one thread fetches while the others wait for its result
+        certs = self._certs
+        if certs is not None and not refresh and time.monotonic() < self._certs_expire_at:
+            self._count('cert_cache_hits')
+            return certs
+        with self._certs_lock:
+            if self._certs is not None and time.monotonic() < self._certs_expire_at:
+                if not refresh or self._certs is not certs:
+                    return self._certs
+                # Unknown key ids cannot force a fetch on every request
+                if time.monotonic() - self._certs_fetched_at < self.min_refresh_interval:
+                    return self._certs
+            response = self.session.get(self.certs_url, timeout=self.timeout)
+            if response.status_code != 200:
+                raise google_exceptions.TransportError(
+                    f'Could not fetch certificates at {self.certs_url} ({response.status_code})')
+            fetched = response.json()
+            match = MAX_AGE.search(response.headers.get('Cache-Control', ''))
+            max_age = int(match.group(1)) - int(response.headers.get('Age', 0)) if match else 0
+            now = time.monotonic()
+            self._certs = fetched
+            self._certs_fetched_at = now
+            self._certs_expire_at = now + max(max_age, 0)
+            self._count('cert_fetches')
+        return fetched
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['cert_ttl_seconds'] = max(round(self._certs_expire_at - time.monotonic()), 0) if self._certs else 0
+        return stats
@@ -0,0 +1,196 @@
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import bindparam
+
+from models import db, FoodImageAnalysis
+from upserts import insert_image_analysis
+
+try:
+    from PIL import Image
+except ImportError:  # perceptual matching is skipped without Pillow
+    Image = None
+
+BANDS = 8  # the 64-bit dHash is indexed as 8 bands of 8 bits
+
+
+def content_hash(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def perceptual_hash(image_bytes):
+    # 64-bit difference hash: survives re-encoding, resizing and small crops
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            pixels = list(image.convert('L').resize((9, 8)).getdata())
+    except Exception:
+        return None
+
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (left > right)
+    # Flat or featureless images hash to nearly all-0 or all-1 and would match each other
+    if not 4 <= bits.bit_count() <= 60:
+        return None
+    return f'{bits:016x}'
+
+
+def hash_bands(value):
+    return [(band, (value >> (8 * band)) & 0xff) for band in range(BANDS)]
+
+
+class ImageAnalysisCache:
+    # Calorie estimates keyed by image content. Exact re-uploads match on sha256 for anyone;
+    # near-duplicates match when their dHash is within max_distance bits of one of the same
+    # user's earlier photos, so a similar plate never borrows someone else's meal. Hashes are
+    # indexed by band: two within 7 bits share at least one band exactly, so only those
+    # candidates are compared. The table keeps the max_rows most recently used entries; hits
+    # and last_used_at are collected here and written in batches, as in FoodLookupCache.
+
+    def __init__(self, max_distance=4, max_rows=20000, max_users=1000, evict_every=100,
+                 hit_flush_size=200, hit_flush_seconds=60):
+        self.max_distance = max_distance
+        self.max_rows = max_rows
+        self.max_users = max_users
+        self.evict_every = evict_every
+        self.hit_flush_size = hit_flush_size
+        self.hit_flush_seconds = hit_flush_seconds
+        self._users = OrderedDict()  # user_id -> {(band, value): {(hash, calories)}}, loaded on first use
+        self._pending_hits = {}      # content_hash -> (hits, last used) not yet written
+        self._hits_flushed_at = time.monotonic()
+        self._stores = 0
+        self._lock = threading.Lock()
+        self._counters = {'exact_hits': 0, 'near_hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _load_user(self, user_id):
+        rows = db.session.query(
+            FoodImageAnalysis.perceptual_hash, FoodImageAnalysis.calories
+        ).filter(FoodImageAnalysis.user_id == user_id, FoodImageAnalysis.perceptual_hash.isnot(None))
+        index = {}
+        for phash, calories in rows:
+            self._add(index, int(phash, 16), calories)
+        return index
+
+    @staticmethod
+    def _add(index, value, calories):
+        for band in hash_bands(value):
+            index.setdefault(band, set()).add((value, calories))
+
+    def _user_index(self, user_id):
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None:
+                self._users.move_to_end(user_id)
+                return index
+        index = self._load_user(user_id)
+        with self._lock:
+            index = self._users.setdefault(user_id, index)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return index
+
+    def _nearest(self, user_id, phash):
+        target = int(phash, 16)
+        index = self._user_index(user_id)
+        with self._lock:
+            if self.max_distance < BANDS:
+                candidates = set().union(*(index.get(band, ()) for band in hash_bands(target)))
+            else:
+                candidates = set().union(*index.values())
+        best = None
+        for candidate, calories in candidates:
+            distance = (candidate ^ target).bit_count()
+            if distance <= self.max_distance and (best is None or distance < best[0]):
+                best = (distance, calories)
+        return best[1] if best else None
+
+    def lookup_exact(self, digest):
+        calories = db.session.query(FoodImageAnalysis.calories).filter_by(content_hash=digest).scalar()
+        if calories is None:
+            return None
+        with self._lock:
+            self._counters['exact_hits'] += 1
+            hits, _ = self._pending_hits.get(digest, (0, None))
+            self._pending_hits[digest] = (hits + 1, datetime.utcnow())
+            due = (len(self._pending_hits) >= self.hit_flush_size
+                   or time.monotonic() - self._hits_flushed_at >= self.hit_flush_seconds)
+        if due:
+            self._flush_hits()
+            db.session.commit()
+        return calories
+
+    def _flush_hits(self):
+        # Adds the collected hits in one executemany; the caller commits
+        with self._lock:
+            pending, self._pending_hits = self._pending_hits, {}
+            self._hits_flushed_at = time.monotonic()
+        if not pending:
+            return
+        table = FoodImageAnalysis.__table__
+        db.session.execute(
+            table.update().where(table.c.content_hash == bindparam('digest')).values(
+                hits=table.c.hits + bindparam('count'), last_used_at=bindparam('used')),
+            [{'digest': digest, 'count': hits, 'used': used} for digest, (hits, used) in pending.items()]
+        )
+
+    def lookup_similar(self, image_bytes, user_id):
+        # Returns (calories or None, perceptual hash); counts a miss when nothing matches
+        phash = perceptual_hash(image_bytes)
+        if phash is not None and self.max_distance >= 0 and user_id is not None:
+            calories = self._nearest(user_id, phash)
+            if calories is not None:
+                with self._lock:
+                    self._counters['near_hits'] += 1
+                return calories, phash
+
+        with self._lock:
+            self._counters['misses'] += 1
+        return None, phash
+
+    def store(self, digest, phash, calories, user_id=None):
+        insert_image_analysis(digest, phash, calories, user_id)
+        with self._lock:
+            self._stores += 1
+            evict = self._stores % self.evict_every == 0
+        if evict:
+            self._flush_hits()
+            self._evict_rows()
+        db.session.commit()
+        if phash is not None and user_id is not None:
+            with self._lock:
+                index = self._users.get(user_id)
+                if index is not None:
+                    self._add(index, int(phash, 16), calories)
+
+    def _evict_rows(self):
+        # Least recently used rows beyond max_rows; the caller commits
+        overflow = FoodImageAnalysis.query.count() - self.max_rows
+        if overflow <= 0:
+            return
+        oldest = db.session.query(FoodImageAnalysis.id).order_by(
+            db.func.coalesce(FoodImageAnalysis.last_used_at, FoodImageAnalysis.created_at).asc()
+        ).limit(overflow).subquery()
+        FoodImageAnalysis.query.filter(
+            FoodImageAnalysis.id.in_(db.select(oldest.c.id))
+        ).delete(synchronize_session=False)
+        with self._lock:
+            # Reloaded per user on next use, without the evicted hashes
+            self._users.clear()
+            self._counters['evictions'] += overflow
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['indexed_users'] = len(self._users)
+        lookups = stats['exact_hits'] + stats['near_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['exact_hits'] + stats['near_hits']) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,147 @@
+import csv
+import json
+import time
+from datetime import date, datetime, timedelta
+
+from models import db, User
+from upserts import write_steps_many
+from rollups import RollupBatch
+
+MAX_STEPS_PER_DAY = 200000
+MAX_REPORTED_REJECTS = 1000
+
+
+class RowError(Exception):
+    pass
+
+
+def iter_records(lines, fmt):
+    # Yields (line_number, dict) from a stream of byte lines without buffering the body
+    text_lines = (line.decode('utf-8-sig') if isinstance(line, bytes) else line for line in lines)
+    if fmt == 'csv':
+        reader = csv.DictReader(text_lines)
+        for record in reader:
+            yield reader.line_num, record
+        return
+
+    for number, line in enumerate(text_lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield number, RowError('invalid JSON')
+            continue
+        yield number, record if isinstance(record, dict) else RowError('expected a JSON object')
+
+
+def validate(record, latest_date):
+    if isinstance(record, RowError):
+        raise record
+
+    user_id = record.get('user_id')
+    email = (record.get('email') or '').strip().lower() or None
+    if user_id in (None, '') and not email:
+        raise RowError('user_id or email is required')
+    if user_id not in (None, ''):
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            raise RowError('user_id must be an integer')
+
+    try:
+        day = date.fromisoformat(str(record.get('date', '')).strip())
+    except ValueError:
+        raise RowError('date must be YYYY-MM-DD')
+    if day > latest_date:
+        raise RowError('date is in the future')
+
+    try:
+        steps = int(str(record.get('steps', '')).strip())
+    except ValueError:
+        raise RowError('steps must be an integer')
+    if not 0 <= steps <= MAX_STEPS_PER_DAY:
+        raise RowError(f'steps must be between 0 and {MAX_STEPS_PER_DAY}')
+
+    return user_id if user_id not in (None, '') else None, email, day, steps
+
+
+class StepIngestor:
+    # Validates rows as they stream in and writes them in executemany batches
+
+    def __init__(self, batch_size=1000, on_written=None):
+        self.batch_size = batch_size
+        self.on_written = on_written  # called with [(user, date, steps)] after each commit
+        self.accepted = 0
+        self.rejected = 0
+        self.rejects = []
+        self._batch = []
+
+    def reject(self, line, error):
+        self.rejected += 1
+        if len(self.rejects) < MAX_REPORTED_REJECTS:
+            self.rejects.append({'line': line, 'error': error})
+
+    def run(self, lines, fmt):
+        started = time.perf_counter()
+        # Devices a timezone ahead of UTC may already be on tomorrow
+        latest_date = datetime.utcnow().date() + timedelta(days=1)
+        for line, record in iter_records(lines, fmt):
+            try:
+                self._batch.append((line,) + validate(record, latest_date))
+            except RowError as e:
+                self.reject(line, str(e))
+                continue
+            if len(self._batch) >= self.batch_size:
+                self._flush()
+        self._flush()
+
+        elapsed = time.perf_counter() - started
+        return {
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round((self.accepted + self.rejected) / elapsed, 1) if elapsed else None,
+            'rejects': self.rejects,
+        }
+
+    def _flush(self):
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+
+        # Resolve users for the whole batch with two IN queries
+        ids = {row[1] for row in batch if row[1] is not None}
+        emails = {row[2] for row in batch if row[1] is None}
+        users = {}
+        if ids:
+            users.update({('id', user.id): user for user in db.session.query(
+                User.id, User.email, User.name, User.department_id).filter(User.id.in_(ids))})
+        if emails:
+            users.update({('email', user.email.lower()): user for user in db.session.query(
+                User.id, User.email, User.name, User.department_id).filter(db.func.lower(User.email).in_(emails))})
+
+        # A user-day sent twice in one batch is written once with its last value: PostgreSQL
+        # refuses a multi-row ON CONFLICT DO UPDATE that touches the same row twice
+        latest, written = {}, []
+        for line, user_id, email, day, steps in batch:
+            user = users.get(('id', user_id) if user_id is not None else ('email', email))
+            if user is None:
+                self.reject(line, 'unknown user')
+                continue
+            latest[(user.id, day)] = {'user_id': user.id, 'date': day, 'steps': steps}
+            written.append((user, day, steps))
+        rows = list(latest.values())
+
+        # The replaced values come back from the write itself so the department rollups
+        # receive the right deltas even when another writer touches the same days
+        previous = write_steps_many(rows)
+        rollup = RollupBatch()
+        for user, day, steps in written:
+            rollup.steps(user.department_id, day, previous.get((user.id, day)), steps)
+            previous[(user.id, day)] = steps
+        rollup.apply()
+        db.session.commit()
+        self.accepted += len(written)
+        if self.on_written and written:
+            self.on_written(written)
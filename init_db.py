@@ -1,10 +1,19 @@
+import argparse
+
 from app import app, db
-from models import User, WellnessRecord, StepRecord, NutritionRecord, Department
+from models import User, Department
+from datagen import add_history, generate
 
-def init_database():
+def init_database(users=None, days=7, seed=None):
     with app.app_context():
+        if users is not None:
+            # Synthetic users for load and sizing tests (see datagen.py for more options)
+            result = generate(users, days, seed=seed)
+            print(f"Database recreated with {users} synthetic users x {days} days in {result['seconds']}s")
+            return
+
         # Drop all tables to ensure a clean slate
-        db.drop_all()
+        db.drop_all(bind_key=None)
         print("Existing tables dropped.")
 
         # Create all tables
@@ -56,25 +65,14 @@ def init_database():
             db.session.commit()
             print("Sample users added!")
             
-            # Add sample step records
-            from datetime import datetime, timedelta
-            import random
-            
-            users = User.query.all()
-            for user in users:
-                for i in range(7):  # Last 7 days
-                    date = datetime.utcnow().date() - timedelta(days=i)
-                    steps = random.randint(5000, 15000)
-                    
-                    step_record = StepRecord(
-                        user_id=user.id,
-                        date=date,
-                        steps=steps
-                    )
-                    db.session.add(step_record)
-            
-            db.session.commit()
-            print("Sample step records added!")
+            # Add a week of sample steps, check-ins and meals
+            add_history([(user.id, user.department_id) for user in User.query.all()], days, seed)
+            print("Sample history added!")
 
 if __name__ == '__main__':
-    init_database()
+    parser = argparse.ArgumentParser(description='Recreate the database with sample data.')
+    parser.add_argument('--users', type=int, help='generate this many synthetic users instead of the 3 samples')
+    parser.add_argument('--days', type=int, default=7, help='days of history per user')
+    parser.add_argument('--seed', type=int, help='random seed for reproducible data')
+    args = parser.parse_args()
+    init_database(args.users, args.days, args.seed)
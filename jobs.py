@@ -0,0 +1,229 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, literal, select, text
+
+from models import db, AnalysisJob
+
+logger = logging.getLogger(__name__)
+
+WAITING = ('held', 'queued')  # statuses that count toward max_depth
+SUBMIT_LOCK = 7406231         # PostgreSQL advisory lock serializing the depth check
+
+
+class QueueFull(Exception):
+    pass
+
+
+class RetryLater(Exception):
+    # Raised by analyze() when the job should be requeued without counting an attempt
+    pass
+
+
+class AnalysisJobQueue:
+    # Durable image-analysis queue backed by the analysis_job table. Any number of
+    # worker threads (in this process or in separate `python worker.py` processes)
+    # claim queued rows, call analyze(job) and hand the result to complete(job, calories).
+    # finished(job), if given, runs after a job is committed as done or finally failed.
+    # A job submitted with hold=True is not claimed until release(job), so the caller can
+    # take a rate-limit token for it and cancel(job) if that is refused.
+
+    def __init__(self, app, analyze, complete, finished=None, workers=4, max_depth=100, poll_interval=2.0, max_attempts=3, stale_after=600):
+        self.app = app
+        self.analyze = analyze
+        self.complete = complete
+        self.finished = finished
+        self.workers = workers
+        self.max_depth = max_depth
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.stale_after = stale_after
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._started = False
+        self._lock = threading.Lock()
+        self._counters = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0}
+
+    def submit(self, user_id, department_id, food_name, mime_type, image_bytes, content_hash=None,
+               perceptual_hash=None, hold=False):
+        # The depth check and the insert are one INSERT ... SELECT ... WHERE depth < max_depth,
+        # so concurrent uploads cannot push the queue past its limit
+        table = AnalysisJob.__table__
+        values = {
+            'user_id': user_id,
+            'department_id': department_id,
+            'status': 'held' if hold else 'queued',
+            'food_name': food_name,
+            'mime_type': mime_type,
+            'image_data': image_bytes,
+            'content_hash': content_hash,
+            'perceptual_hash': perceptual_hash,
+            'attempts': 0,
+            'created_at': datetime.utcnow(),
+        }
+        depth = select(func.count()).select_from(table).where(table.c.status.in_(WAITING)).scalar_subquery()
+        statement = insert(table).from_select(
+            list(values),
+            select(*[literal(value, table.c[name].type) for name, value in values.items()]).where(depth < self.max_depth)
+        ).returning(table.c.id)
+        if db.session.get_bind().dialect.name == 'postgresql':
+            # SQLite's write lock already covers the statement; PostgreSQL needs its own
+            db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': SUBMIT_LOCK})
+        job_id = db.session.execute(statement).scalar()
+        db.session.commit()
+        if job_id is None:
+            with self._lock:
+                self._counters['rejected'] += 1
+            raise QueueFull(f'{self.max_depth} analyses already waiting')
+
+        with self._lock:
+            self._counters['submitted'] += 1
+        if not hold:
+            self._wakeup.set()
+        return db.session.get(AnalysisJob, job_id)
+
+    def release(self, job):
+        # Lets the workers claim a held job
+        AnalysisJob.query.filter_by(id=job.id, status='held').update({'status': 'queued'})
+        db.session.commit()
+        self._wakeup.set()
+
+    def cancel(self, job):
+        AnalysisJob.query.filter_by(id=job.id, status='held').delete()
+        db.session.commit()
+        with self._lock:
+            self._counters['submitted'] -= 1
+            self._counters['rejected'] += 1
+
+    def ensure_started(self):
+        if self._started or not self.workers:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.start()
+
+    def start(self):
+        self._started = True
+        with self.app.app_context():
+            # Jobs left running by a crashed worker go back to the queue
+            stale = datetime.utcnow() - timedelta(seconds=self.stale_after)
+            AnalysisJob.query.filter(
+                AnalysisJob.status == 'running',
+                AnalysisJob.started_at < stale
+            ).update({'status': 'queued'}, synchronize_session=False)
+            # Held jobs whose upload request never came back to release or cancel them
+            AnalysisJob.query.filter(
+                AnalysisJob.status == 'held',
+                AnalysisJob.created_at < stale
+            ).delete(synchronize_session=False)
+            db.session.commit()
+
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'analysis-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5.0):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._started = False
+        self._stopping.clear()
+
+    def _claim(self):
+        while True:
+            candidate = db.session.query(AnalysisJob.id).filter_by(
+                status='queued'
+            ).order_by(AnalysisJob.id).first()
+            if candidate is None:
+                return None
+
+            claimed = AnalysisJob.query.filter_by(id=candidate.id, status='queued').update({
+                'status': 'running',
+                'started_at': datetime.utcnow(),
+                'attempts': AnalysisJob.attempts + 1
+            })
+            db.session.commit()
+            if claimed:
+                return db.session.get(AnalysisJob, candidate.id)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            with self.app.app_context():
+                try:
+                    job = self._claim()
+                    if job is not None and self._process(job):
+                        continue
+                except Exception as e:
+                    logger.exception("Analysis worker error")
+                    db.session.rollback()
+
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _process(self, job):
+        # Returns False when the worker should back off before claiming again
+        try:
+            calories = self.analyze(job)
+            self.complete(job, calories)
+        except RetryLater:
+            db.session.rollback()
+            AnalysisJob.query.filter_by(id=job.id).update({
+                'status': 'queued',
+                'attempts': AnalysisJob.attempts - 1
+            })
+            db.session.commit()
+            return False
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(AnalysisJob, job.id)
+            job.error = str(e)[:500]
+            if job.attempts < self.max_attempts:
+                job.status = 'queued'
+            else:
+                job.status = 'failed'
+                job.image_data = None
+                job.finished_at = datetime.utcnow()
+                with self._lock:
+                    self._counters['failed'] += 1
+            db.session.commit()
+            logger.warning("Analysis job %s failed: %s", job.id, e)
+            if job.status == 'failed' and self.finished:
+                self.finished(job)
+            return False
+
+        job.status = 'done'
+        job.calories = calories
+        job.error = None
+        job.image_data = None
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        with self._lock:
+            self._counters['completed'] += 1
+        if self.finished:
+            self.finished(job)
+        return True
+
+    def wait_idle(self, timeout=30.0):
+        # Used by load tests: block until nothing is queued or running
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self.app.app_context():
+                pending = AnalysisJob.query.filter(AnalysisJob.status.in_(['queued', 'running'])).count()
+            if not pending:
+                return True
+            time.sleep(0.1)
+        return False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['workers'] = len(self._threads)
+        return stats
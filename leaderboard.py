@@ -0,0 +1,160 @@
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from models import db, User, Department, StepRecord
+
+logger = logging.getLogger(__name__)
+
+
+class Leaderboard:
+    # Rolling step totals per user and per department, kept in memory and updated by
+    # deltas as steps are recorded. A periodic full reconcile from step_record corrects
+    # drift (e.g. writes made by other processes) and rolls the window at midnight.
+
+    def __init__(self, app, window_days=7, top_n=10, reconcile_interval=300):
+        self.app = app
+        self.window_days = window_days
+        self.top_n = top_n
+        self.reconcile_interval = reconcile_interval
+        self._lock = threading.RLock()
+        self._reconciling = False
+        self._loaded_at = None
+        self._window_start = None
+        self._reset()
+
+    def _reset(self):
+        self._daily = {}          # (user_id, date) -> steps
+        self._user_totals = {}    # user_id -> steps in window
+        self._dept_totals = {}    # department_id -> steps in window
+        self._user_dept = {}      # user_id -> department_id
+        self._user_names = {}
+        self._dept_names = {}
+        self._dept_members = {}   # department_id -> number of users
+        self._top_users = None
+        self._top_departments = None
+
+    def current_window_start(self):
+        # Same range as the original query: today and the seven days before it
+        return datetime.utcnow().date() - timedelta(days=self.window_days)
+
+    def reconcile(self):
+        window_start = self.current_window_start()
+        with self.app.app_context():
+            users = db.session.query(User.id, User.name, User.department_id).all()
+            departments = db.session.query(Department.id, Department.name).all()
+            rows = db.session.query(
+                StepRecord.user_id, StepRecord.date, func.sum(StepRecord.steps)
+            ).filter(
+                StepRecord.date >= window_start
+            ).group_by(StepRecord.user_id, StepRecord.date).all()
+
+        with self._lock:
+            self._reset()
+            self._window_start = window_start
+            for user_id, name, department_id in users:
+                self._user_names[user_id] = name
+                self._user_dept[user_id] = department_id
+                if department_id is not None:
+                    self._dept_members[department_id] = self._dept_members.get(department_id, 0) + 1
+            self._dept_names = dict(departments)
+            for user_id, date, steps in rows:
+                self._apply(user_id, date, int(steps or 0))
+            self._loaded_at = time.monotonic()
+
+    def _apply(self, user_id, date, steps):
+        delta = steps - self._daily.get((user_id, date), 0)
+        self._daily[(user_id, date)] = steps
+        if not delta:
+            return
+        self._user_totals[user_id] = self._user_totals.get(user_id, 0) + delta
+        department_id = self._user_dept.get(user_id)
+        if department_id is not None:
+            self._dept_totals[department_id] = self._dept_totals.get(department_id, 0) + delta
+        self._top_users = None
+        self._top_departments = None
+
+    def set_steps(self, user_id, department_id, date, steps, user_name=None):
+        # Called after a step_record row for (user_id, date) is committed with this value
+        with self._lock:
+            if self._loaded_at is None or self._window_start is None or date < self._window_start:
+                return
+            if user_id not in self._user_dept:
+                self._user_dept[user_id] = department_id
+                self._user_names[user_id] = user_name or ''
+                if department_id is not None:
+                    self._dept_members[department_id] = self._dept_members.get(department_id, 0) + 1
+            self._apply(user_id, date, steps)
+
+    def move_user(self, user_id, department_id):
+        # A user changed department: carry their window total across
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            old_department = self._user_dept.get(user_id)
+            if old_department == department_id:
+                return
+            total = self._user_totals.get(user_id, 0)
+            if old_department is not None:
+                self._dept_totals[old_department] = self._dept_totals.get(old_department, 0) - total
+                self._dept_members[old_department] = self._dept_members.get(old_department, 1) - 1
+            if department_id is not None:
+                self._dept_totals[department_id] = self._dept_totals.get(department_id, 0) + total
+                self._dept_members[department_id] = self._dept_members.get(department_id, 0) + 1
+            self._user_dept[user_id] = department_id
+            self._top_departments = None
+
+    def _ensure_fresh(self):
+        if self._loaded_at is None or self._window_start != self.current_window_start():
+            # Nothing loaded yet or the day rolled over: rebuild before answering
+            self.reconcile()
+        elif time.monotonic() - self._loaded_at > self.reconcile_interval:
+            with self._lock:
+                if self._reconciling:
+                    return
+                self._reconciling = True
+            threading.Thread(target=self._background_reconcile, daemon=True).start()
+
+    def _background_reconcile(self):
+        try:
+            self.reconcile()
+        except Exception as e:
+            logger.exception("Leaderboard reconcile failed")
+        finally:
+            self._reconciling = False
+
+    def top_users(self):
+        self._ensure_fresh()
+        with self._lock:
+            if self._top_users is None:
+                leaders = heapq.nlargest(
+                    self.top_n,
+                    ((steps, user_id) for user_id, steps in self._user_totals.items() if steps > 0)
+                )
+                self._top_users = [{
+                    'user_id': user_id,
+                    'name': self._user_names.get(user_id, ''),
+                    'department': self._dept_names.get(self._user_dept.get(user_id), ''),
+                    'total_steps': steps
+                } for steps, user_id in leaders]
+            return self._top_users
+
+    def top_departments(self):
+        self._ensure_fresh()
+        with self._lock:
+            if self._top_departments is None:
+                leaders = heapq.nlargest(
+                    self.top_n,
+                    ((steps, department_id) for department_id, steps in self._dept_totals.items() if steps > 0)
+                )
+                self._top_departments = [{
+                    'department_id': department_id,
+                    'name': self._dept_names.get(department_id, ''),
+                    'total_steps': steps,
+                    'average_steps': steps // max(1, self._dept_members.get(department_id, 0))
+                } for steps, department_id in leaders]
+            return self._top_departments
@@ -0,0 +1,242 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlsplit
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD = 'leaderboard'
+
+
+def user_topic(user_id):
+    return f'user:{user_id}'
+
+
+class LiveEvents:
+    # Server-Sent Events for open leaderboard and dashboard pages. The stream is served by a
+    # small asyncio server on its own port, in one background thread: an idle browser costs a
+    # socket and a coroutine rather than a WSGI thread. Routes call publish() after their
+    # commit; each event is encoded once and written to every subscriber of its topic. Pages
+    # get a signed token naming the viewer and the host that rendered the page, so a stream
+    # only receives that user's totals and is only shared with that origin.
+    # Events only reach browsers connected to this process; writes made by worker.py or other
+    # processes show up on the next page load.
+
+    def __init__(self, host='127.0.0.1', port=8001, public_url=None, token_max_age=12 * 3600,
+                 heartbeat_interval=20.0, max_buffer=64 * 1024, max_clients=10000, max_snapshots=10000):
+        self.host = host
+        self.port = port
+        self.public_url = public_url
+        self.token_max_age = token_max_age
+        self.heartbeat_interval = heartbeat_interval
+        self.max_buffer = max_buffer
+        self.max_clients = max_clients
+        self.max_snapshots = max_snapshots
+        self._serializer = None
+        self._loop = None
+        self._started = False
+        self._subscribers = {}         # topic -> set of StreamWriters; only touched on the loop
+        self._listeners = {}           # user_id -> open streams; under the lock, read by request threads
+        self._last = OrderedDict()     # topic -> last frame, replayed to new subscribers
+        self._lock = threading.Lock()
+        self._counters = {'connections': 0, 'rejected': 0, 'published': 0, 'unchanged': 0,
+                          'delivered': 0, 'dropped_slow': 0}
+        self._clients = 0
+
+    def init_app(self, app):
+        self._serializer = URLSafeTimedSerializer(app.secret_key, salt='live-events')
+
+    @property
+    def enabled(self):
+        return self.port > 0
+
+    def url(self, request, user_id=None):
+        # Stream URL for a page; the token carries the viewer (None for anonymous visitors)
+        # and the page's host, the only origin the stream answers cross-origin requests from
+        base = self.public_url or f"{request.scheme}://{request.host.rsplit(':', 1)[0]}:{self.port}/events"
+        return f'{base}?token={self._serializer.dumps([user_id, request.host])}'
+
+    def ensure_started(self):
+        if self._started or not self.enabled:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        ready = threading.Event()
+        threading.Thread(target=self._serve, args=(ready,), name='live-events', daemon=True).start()
+        ready.wait(5)
+
+    def _serve(self, ready):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port, backlog=1024))
+        except OSError as e:
+            # Another process already serves the stream on this port
+            logger.warning("Live events disabled: could not listen on port %s: %s", self.port, e)
+            ready.set()
+            return
+        self._loop = loop
+        ready.set()
+        loop.create_task(self._heartbeat())
+        loop.run_forever()
+
+    @property
+    def running(self):
+        return self._loop is not None
+
+    def listening(self, user_id):
+        # Whether any page of this user is connected. When none is, the user's last event is
+        # forgotten too, so a page opened later is not caught up with stale totals.
+        if self._loop is None:
+            return False
+        with self._lock:
+            if self._listeners.get(user_id):
+                return True
+            self._last.pop(user_topic(user_id), None)
+        return False
+
+    def publish(self, event, data, topic=LEADERBOARD):
+        # Thread-safe; an event identical to the last one on its topic is not sent again
+        if self._loop is None:
+            return
+        frame = f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'.encode()
+        with self._lock:
+            if self._last.get(topic) == frame:
+                self._counters['unchanged'] += 1
+                return
+            self._last[topic] = frame
+            self._last.move_to_end(topic)
+            if len(self._last) > self.max_snapshots:
+                self._last.popitem(last=False)
+            self._counters['published'] += 1
+        self._loop.call_soon_threadsafe(self._fanout, topic, frame)
+
+    def publish_to_user(self, user_id, event, data):
+        self.publish(event, data, topic=user_topic(user_id))
+
+    def _fanout(self, topic, frame):
+        delivered = 0
+        for writer in list(self._subscribers.get(topic, ())):
+            if self._write(writer, frame):
+                delivered += 1
+        with self._lock:
+            self._counters['delivered'] += delivered
+
+    def _write(self, writer, frame):
+        # Never waits for a client: one that stops reading is dropped once its buffer fills
+        if writer.is_closing():
+            return False
+        if writer.transport.get_write_buffer_size() > self.max_buffer:
+            with self._lock:
+                self._counters['dropped_slow'] += 1
+            writer.close()
+            return False
+        writer.write(frame)
+        return True
+
+    async def _heartbeat(self):
+        # A comment line every so often keeps proxies from closing idle streams
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            writers = set().union(*self._subscribers.values()) if self._subscribers else ()
+            for writer in writers:
+                self._write(writer, b': ping\n\n')
+
+    async def _handle(self, reader, writer):
+        topics = user_id = None
+        subscribed = False
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 10)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            viewer = self._authorize(request_line.decode('latin-1'), headers.get('origin'))
+            if viewer is None:
+                writer.write(b'HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                return
+            user_id, topics = viewer
+            # Same-origin requests (a proxied LIVE_EVENTS_URL) send no Origin and need no CORS header
+            allow_origin = f"Access-Control-Allow-Origin: {headers['origin']}\r\nVary: Origin\r\n" \
+                if 'origin' in headers else ''
+            writer.write((
+                'HTTP/1.1 200 OK\r\n'
+                'Content-Type: text/event-stream\r\n'
+                'Cache-Control: no-cache\r\n'
+                'X-Accel-Buffering: no\r\n'
+                f'{allow_origin}'
+                'Connection: keep-alive\r\n\r\n'
+                'retry: 5000\n\n'
+            ).encode())
+            # Catch the page up on anything published since it was rendered
+            with self._lock:
+                snapshots = [self._last[topic] for topic in topics if topic in self._last]
+            for frame in snapshots:
+                writer.write(frame)
+            for topic in topics:
+                self._subscribers.setdefault(topic, set()).add(writer)
+            with self._lock:
+                if user_id is not None:
+                    self._listeners[user_id] = self._listeners.get(user_id, 0) + 1
+            self._clients += 1
+            subscribed = True
+            # Browsers never send anything more; this returns when they disconnect
+            while await reader.read(1024):
+                pass
+        except (asyncio.TimeoutError, ConnectionError, UnicodeDecodeError):
+            pass
+        finally:
+            if subscribed:
+                for topic in topics:
+                    subscribers = self._subscribers.get(topic)
+                    if subscribers is not None:
+                        subscribers.discard(writer)
+                        if not subscribers:
+                            del self._subscribers[topic]
+                with self._lock:
+                    if user_id is not None:
+                        self._listeners[user_id] -= 1
+                        if not self._listeners[user_id]:
+                            del self._listeners[user_id]
+                self._clients -= 1
+            writer.close()
+
+    def _authorize(self, request_line, origin):
+        # (user_id, topics) for "GET /events?token=...", or None when the request is refused,
+        # including a browser Origin other than the host the token was issued to
+        parts = request_line.split()
+        if len(parts) != 3 or parts[0] != 'GET' or self._clients >= self.max_clients:
+            return self._reject()
+        url = urlsplit(parts[1])
+        token = parse_qs(url.query).get('token', [''])[0]
+        if url.path != '/events' or not token:
+            return self._reject()
+        try:
+            user_id, host = self._serializer.loads(token, max_age=self.token_max_age)
+        except (BadSignature, TypeError, ValueError):
+            return self._reject()
+        # The scheme is not compared: behind a TLS proxy the app may see http
+        if origin is not None and urlsplit(origin).netloc != host:
+            return self._reject()
+        with self._lock:
+            self._counters['connections'] += 1
+        return user_id, ((LEADERBOARD, user_topic(user_id)) if user_id is not None else (LEADERBOARD,))
+
+    def _reject(self):
+        with self._lock:
+            self._counters['rejected'] += 1
+        return None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['clients'] = self._clients
+        return stats
@@ -0,0 +1,236 @@
+import bisect
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger('altabwell.request')
+
+
+class LatencyHistogram:
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            cumulative = []
+            running = 0
+            for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+                running += count
+                cumulative.append((bound, running))
+            return {'buckets': cumulative, 'sum': self.total, 'count': self.count}
+
+
+class JsonFormatter(logging.Formatter):
+    RESERVED = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in self.RESERVED})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging():
+    # LOG_FORMAT=text keeps plain log lines for local development. Handlers already installed
+    # by gunicorn, pytest or an embedding app are left alone, along with their level.
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    handler = logging.StreamHandler()
+    if os.environ.get('LOG_FORMAT', 'json') == 'json':
+        handler.setFormatter(JsonFormatter())
+    root.addHandler(handler)
+    root.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{str(value)}"' for key, value in labels.items()) + '}'
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def format_histogram(name, snapshot, labels=None):
+    labels = labels or {}
+    lines = []
+    for bound, count in snapshot['buckets']:
+        lines.append(f"{name}_bucket{_labels(dict(labels, le=_format_bound(bound)))} {count}")
+    lines.append(f"{name}_sum{_labels(labels)} {snapshot['sum']}")
+    lines.append(f"{name}_count{_labels(labels)} {snapshot['count']}")
+    return lines
+
+
+class Metrics:
+    # Per-route latency, SQL statements per request, and any component stats() registered
+    # with register_stats, rendered in the Prometheus text format.
+
+    def __init__(self, prefix='altabwell'):
+        self.prefix = prefix
+        self.request_latency = {}   # (endpoint, method) -> LatencyHistogram
+        self.request_counts = {}    # (endpoint, method, status) -> count
+        self.sql_per_request = LatencyHistogram(buckets=(1, 2, 3, 5, 10, 20, 50, 100))
+        self.sql_latency = LatencyHistogram()
+        self.sql_total = 0
+        self.stats_sources = []
+        self.slow_request_ms = None
+        self.profile_dir = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app, engine):
+        slow = os.environ.get('SLOW_REQUEST_PROFILE_MS')
+        self.slow_request_ms = float(slow) if slow else None
+        self.profile_dir = os.environ.get('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def register_stats(self, name, stats, labels=None):
+        # stats() returns a dict; numbers become gauges, nested dicts become labelled gauges
+        # (labels maps the nested key to its label name) and histogram snapshots stay histograms
+        self.stats_sources.append((name, stats, labels or {}))
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.sql_count = 0
+        g.sql_seconds = 0.0
+        g.profiler = None
+        if self.slow_request_ms is not None:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                g.profiler = profiler
+            except ValueError:  # another profiler is already running on this thread
+                pass
+
+    def _after_request(self, response):
+        if 'metrics_started' not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_started
+        endpoint = request.endpoint or 'unmatched'
+
+        with self._lock:
+            histogram = self.request_latency.get((endpoint, request.method))
+            if histogram is None:
+                histogram = self.request_latency[(endpoint, request.method)] = LatencyHistogram()
+            key = (endpoint, request.method, response.status_code)
+            self.request_counts[key] = self.request_counts.get(key, 0) + 1
+        histogram.observe(elapsed)
+        self.sql_per_request.observe(g.sql_count)
+
+        profile_path = None
+        if g.profiler is not None:
+            g.profiler.disable()
+            if elapsed * 1000 >= self.slow_request_ms:
+                profile_path = self._dump_profile(g.profiler, endpoint)
+
+        logger.info('request', extra={
+            'method': request.method,
+            'path': request.path,
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 2),
+            'sql_queries': g.sql_count,
+            'sql_ms': round(g.sql_seconds * 1000, 2),
+            'profile': profile_path,
+        })
+        return response
+
+    def _dump_profile(self, profiler, endpoint):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{endpoint}.prof")
+        profiler.dump_stats(path)
+        return path
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        self.sql_latency.observe(elapsed)
+        with self._lock:
+            self.sql_total += 1
+        if has_request_context() and 'sql_count' in g:
+            g.sql_count += 1
+            g.sql_seconds += elapsed
+
+    def render(self):
+        p = self.prefix
+        lines = [
+            f'# TYPE {p}_http_request_duration_seconds histogram',
+        ]
+        with self._lock:
+            latencies = list(self.request_latency.items())
+            counts = list(self.request_counts.items())
+            sql_total = self.sql_total
+        for (endpoint, method), histogram in sorted(latencies):
+            lines += format_histogram(f'{p}_http_request_duration_seconds', histogram.snapshot(),
+                                      {'endpoint': endpoint, 'method': method})
+        lines.append(f'# TYPE {p}_http_requests_total counter')
+        for (endpoint, method, status), count in sorted(counts):
+            lines.append(f"{p}_http_requests_total{_labels({'endpoint': endpoint, 'method': method, 'status': status})} {count}")
+
+        lines.append(f'# TYPE {p}_sql_queries_per_request histogram')
+        lines += format_histogram(f'{p}_sql_queries_per_request', self.sql_per_request.snapshot())
+        lines.append(f'# TYPE {p}_sql_query_duration_seconds histogram')
+        lines += format_histogram(f'{p}_sql_query_duration_seconds', self.sql_latency.snapshot())
+        lines.append(f'# TYPE {p}_sql_queries_total counter')
+        lines.append(f'{p}_sql_queries_total {sql_total}')
+
+        for name, stats, labels in self.stats_sources:
+            try:
+                values = stats()
+            except Exception:
+                logging.getLogger(__name__).exception('Could not collect %s stats', name)
+                continue
+            lines += self._render_stats(f'{p}_{name}', values, labels)
+        return '\n'.join(lines) + '\n'
+
+    def _render_stats(self, name, values, labels):
+        lines = []
+        for key, value in sorted(values.items()):
+            metric = f'{name}_{key}'
+            if isinstance(value, bool):
+                lines.append(f'{metric} {int(value)}')
+            elif isinstance(value, (int, float)):
+                lines.append(f'{metric} {value}')
+            elif isinstance(value, str):
+                lines.append(f"{metric}{_labels({'state': value})} 1")
+            elif isinstance(value, dict) and 'buckets' in value:
+                lines.append(f'# TYPE {metric} histogram')
+                lines += format_histogram(metric, value)
+            elif isinstance(value, dict):
+                label = labels.get(key, 'key')
+                for inner, count in sorted(value.items(), key=lambda item: str(item[0])):
+                    lines.append(f'{metric}{_labels({label: inner})} {count}')
+        return lines
@@ -0,0 +1,71 @@
+from sqlalchemy import inspect, text
+
+from models import db
+
+# db.create_all() only creates missing tables, so columns and indexes added to existing
+# tables are created here. New columns must be nullable; unique indexes need duplicate rows
+# folded together first.
+DEDUPLICATE = {
+    'uq_step_record_user_date': [
+        # The routes always read and updated the first row for a day, so that one wins
+        "DELETE FROM step_record WHERE id NOT IN "
+        "(SELECT MIN(id) FROM step_record GROUP BY user_id, date)",
+    ],
+    'uq_wellness_record_user_date': [
+        "DELETE FROM wellness_record WHERE id NOT IN "
+        "(SELECT MIN(id) FROM wellness_record GROUP BY user_id, date)",
+    ],
+    'uq_department_nutrition_department_date': [
+        # Running totals that were split across rows are added back together
+        "UPDATE department_nutrition SET total_calories = "
+        "(SELECT SUM(d.total_calories) FROM department_nutrition d "
+        "WHERE d.department_id = department_nutrition.department_id AND d.date = department_nutrition.date) "
+        "WHERE id IN (SELECT MIN(id) FROM department_nutrition GROUP BY department_id, date HAVING COUNT(*) > 1)",
+        "DELETE FROM department_nutrition WHERE id NOT IN "
+        "(SELECT MIN(id) FROM department_nutrition GROUP BY department_id, date)",
+    ],
+}
+
+
+def upgrade_schema(engine=None):
+    # Creates any column or index declared on the models that the database does not have yet
+    engine = engine or db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            with engine.begin() as connection:
+                connection.execute(text(
+                    f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}'
+                ))
+            created.append(f'{table.name}.{column.name}')
+
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            with engine.begin() as connection:
+                for statement in DEDUPLICATE.get(index.name, []):
+                    connection.execute(text(statement))
+                index.create(connection)
+            created.append(index.name)
+
+    return created
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        created = upgrade_schema()
+    if created:
+        print("Created columns and indexes: " + ", ".join(created))
+    else:
+        print("Schema is up to date.")
@@ -25,6 +25,10 @@ class User(UserMixin, db.Model):
     nutrition_records = db.relationship('NutritionRecord', backref='user', lazy=True)
 
 class WellnessRecord(db.Model):
+    __table_args__ = (
+        db.Index('uq_wellness_record_user_date', 'user_id', 'date', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     date = db.Column(db.Date, nullable=False, default=datetime.utcnow().date)
@@ -36,6 +40,11 @@ class WellnessRecord(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class StepRecord(db.Model):
+    __table_args__ = (
+        db.Index('uq_step_record_user_date', 'user_id', 'date', unique=True),
+        db.Index('ix_step_record_date', 'date'),  # leaderboard window scans
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     date = db.Column(db.Date, nullable=False, default=datetime.utcnow().date)
@@ -45,6 +54,10 @@ class StepRecord(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class NutritionRecord(db.Model):
+    __table_args__ = (
+        db.Index('ix_nutrition_record_user_date', 'user_id', 'date'),  # many items per day
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     date = db.Column(db.Date, nullable=False, default=datetime.utcnow().date)
@@ -57,8 +70,179 @@ class NutritionRecord(db.Model):
     meal_type = db.Column(db.String(20), nullable=True)  # breakfast, lunch, dinner, snack
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class UserMonthlySummary(db.Model):
+    # Per-user totals for one calendar month whose raw rows were moved to the archive by archive.py
+    __table_args__ = (
+        db.Index('uq_user_monthly_summary_user_month', 'user_id', 'month_start', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    month_start = db.Column(db.Date, nullable=False)
+    steps = db.Column(db.BigInteger, nullable=False, default=0)
+    step_days = db.Column(db.Integer, nullable=False, default=0)
+    calories = db.Column(db.Float, nullable=False, default=0)
+    protein = db.Column(db.Float, nullable=False, default=0)
+    carbs = db.Column(db.Float, nullable=False, default=0)
+    fat = db.Column(db.Float, nullable=False, default=0)
+    fiber = db.Column(db.Float, nullable=False, default=0)
+    food_entries = db.Column(db.Integer, nullable=False, default=0)
+    mood_total = db.Column(db.Integer, nullable=False, default=0)
+    mood_entries = db.Column(db.Integer, nullable=False, default=0)
+    sleep_total = db.Column(db.Float, nullable=False, default=0)
+    sleep_entries = db.Column(db.Integer, nullable=False, default=0)
+    stress_total = db.Column(db.Integer, nullable=False, default=0)
+    stress_entries = db.Column(db.Integer, nullable=False, default=0)
+    water_total = db.Column(db.Float, nullable=False, default=0)
+    water_entries = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ArchiveRun(db.Model):
+    # One row per compaction; rows dated before the latest cutoff live in the archive database
+    id = db.Column(db.Integer, primary_key=True)
+    cutoff = db.Column(db.Date, nullable=False, index=True)
+    steps_moved = db.Column(db.Integer, nullable=False, default=0)
+    nutrition_moved = db.Column(db.Integer, nullable=False, default=0)
+    wellness_moved = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+# Raw rows older than the archive horizon, in the separate 'archive' database. They keep their
+# original ids, so a compaction interrupted between the two databases can simply be run again.
+
+class ArchivedWellnessRecord(db.Model):
+    __bind_key__ = 'archive'
+    __tablename__ = 'wellness_record'
+    __table_args__ = (
+        db.Index('uq_archived_wellness_record_user_date', 'user_id', 'date', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    mood_score = db.Column(db.Integer, nullable=True)
+    sleep_hours = db.Column(db.Float, nullable=True)
+    water_intake = db.Column(db.Float, nullable=True)
+    stress_level = db.Column(db.Integer, nullable=True)
+    notes = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime)
+
+class ArchivedStepRecord(db.Model):
+    __bind_key__ = 'archive'
+    __tablename__ = 'step_record'
+    __table_args__ = (
+        db.Index('uq_archived_step_record_user_date', 'user_id', 'date', unique=True),
+        db.Index('ix_archived_step_record_date', 'date'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    steps = db.Column(db.Integer, nullable=False, default=0)
+    goal = db.Column(db.Integer, nullable=False, default=10000)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+
+class ArchivedNutritionRecord(db.Model):
+    __bind_key__ = 'archive'
+    __tablename__ = 'nutrition_record'
+    __table_args__ = (
+        db.Index('ix_archived_nutrition_record_user_date', 'user_id', 'date'),
+        db.Index('ix_archived_nutrition_record_date', 'date'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    food_name = db.Column(db.String(200), nullable=False)
+    calories = db.Column(db.Float, nullable=True)
+    protein = db.Column(db.Float, nullable=True)
+    carbs = db.Column(db.Float, nullable=True)
+    fat = db.Column(db.Float, nullable=True)
+    fiber = db.Column(db.Float, nullable=True)
+    meal_type = db.Column(db.String(20), nullable=True)
+    created_at = db.Column(db.DateTime)
+
+class DepartmentRollup(db.Model):
+    # Per-department aggregates for one day, week (starting Monday) or month; maintained by rollups.py
+    __table_args__ = (
+        db.Index('uq_department_rollup_bucket', 'department_id', 'period', 'bucket_start', unique=True),
+        db.Index('ix_department_rollup_period_bucket', 'period', 'bucket_start'),  # cross-department rankings
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=False)
+    period = db.Column(db.String(5), nullable=False)  # day, week, month
+    bucket_start = db.Column(db.Date, nullable=False)
+    steps = db.Column(db.BigInteger, nullable=False, default=0)
+    step_entries = db.Column(db.Integer, nullable=False, default=0)  # user-days with steps recorded
+    calories = db.Column(db.Float, nullable=False, default=0)
+    food_entries = db.Column(db.Integer, nullable=False, default=0)
+    mood_total = db.Column(db.Integer, nullable=False, default=0)
+    mood_entries = db.Column(db.Integer, nullable=False, default=0)
+    sleep_total = db.Column(db.Float, nullable=False, default=0)
+    sleep_entries = db.Column(db.Integer, nullable=False, default=0)
+    stress_total = db.Column(db.Integer, nullable=False, default=0)
+    stress_entries = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class WellnessTrend(db.Model):
+    # Precomputed trend summary for one user or department, written by the nightly analytics job
+    __table_args__ = (
+        db.Index('uq_wellness_trend_scope_subject', 'scope', 'subject_id', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(10), nullable=False)  # user, department
+    subject_id = db.Column(db.Integer, nullable=False)
+    window_start = db.Column(db.Date, nullable=False)
+    window_end = db.Column(db.Date, nullable=False)
+    summary = db.Column(db.JSON, nullable=False)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class DepartmentNutrition(db.Model):
+    # Legacy running calorie counter, superseded by DepartmentRollup and no longer written
+    __table_args__ = (
+        db.Index('uq_department_nutrition_department_date', 'department_id', 'date', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=False)
     date = db.Column(db.Date, nullable=False)
     total_calories = db.Column(db.Integer, default=0)
+
+class FoodLookupCacheEntry(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    query_key = db.Column(db.String(200), unique=True, nullable=False, index=True)  # normalized food query
+    food_name = db.Column(db.String(200), nullable=False)
+    calories = db.Column(db.Float, nullable=False)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class FoodImageAnalysis(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), unique=True, nullable=False, index=True)  # sha256 of the upload
+    perceptual_hash = db.Column(db.String(16), nullable=True, index=True)  # 64-bit dHash, hex
+    calories = db.Column(db.Float, nullable=False)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+    user_id = db.Column(db.Integer, nullable=True, index=True)  # uploader; near-duplicates only match their own photos
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class AnalysisJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # held, queued, running, done, failed
+    food_name = db.Column(db.String(200), nullable=False)
+    mime_type = db.Column(db.String(100), nullable=True)
+    image_data = db.Column(db.LargeBinary, nullable=True)  # cleared once the job finishes
+    content_hash = db.Column(db.String(64), nullable=True)
+    perceptual_hash = db.Column(db.String(16), nullable=True)
+    calories = db.Column(db.Float, nullable=True)
+    error = db.Column(db.String(500), nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
@@ -0,0 +1,273 @@
+import argparse
+import csv
+import difflib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from food_cache import normalize_food_query
+
+# Offline nutrition facts for common foods, consulted before Gemini. data/foods.csv (per 100 g,
+# plus the weight of one serving and of one cup) is compiled into a small read-only SQLite file
+# with FTS5 indexes for prefix (type-ahead) and trigram (typo-tolerant) matching:
+#   python nutrition_index.py --rebuild
+#   python nutrition_index.py "2 slices of pizza"
+
+SOURCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'foods.csv')
+MACROS = ('protein', 'carbs', 'fat', 'fiber')  # grams, matching the NutritionRecord columns
+NUTRIENTS = ('calories',) + MACROS
+
+WEIGHT_UNITS = {'g': 1.0, 'kg': 1000.0, 'oz': 28.35, 'lb': 453.6, 'ml': 1.0, 'l': 1000.0}
+CUP_FRACTIONS = {'cup': 1.0, 'tbsp': 1 / 16, 'tsp': 1 / 48}
+SERVING_UNITS = {'serving', 'servings', 'piece', 'slice', 'bowl', 'bowls', 'plate', 'plates', 'bar', 'bars',
+                 'can', 'cans', 'bottle', 'bottles', 'glass', 'glasses', 'scoop', 'scoops', 'portion',
+                 'portions', 'handful', 'handfuls', 'stick', 'sticks', 'link', 'links', 'patty', 'patties',
+                 'fillet', 'fillets', 'container', 'containers', 'each', 'whole'}
+SIZES = {'small': 0.7, 'medium': 1.0, 'regular': 1.0, 'large': 1.3, 'big': 1.3, 'extra': 1.0}
+DEFAULT_CUP_GRAMS = 240
+FUZZY_THRESHOLD = 0.85  # difflib ratio a misspelled name needs to be accepted
+FUZZY_CANDIDATES = 25
+
+# Queries and the food they must resolve to (None: left to the cache and Gemini), run by --check
+CHECKS = [
+    ('2 large eggs', 'egg'),
+    ('1 chiken breast', 'chicken breast'),
+    ('bananna', 'banana'),
+    ('brocoli', 'broccoli'),
+    ('sweet potatoe', 'sweet potato'),
+    ('sweet potato fries', None),
+    ('chicken salad sandwich', None),
+    ('fried chicken sandwich', None),
+    ('caesar salad wrap', None),
+]
+
+
+def name_key(name):
+    # Names are normalized exactly like queries, minus the leading quantity
+    return ' '.join(normalize_food_query(name).split()[1:])
+
+
+def parse_portion(text):
+    # "2 large eggs" -> (2.0, None, 1.3, 'eggs'); "1.5 cup of rice" -> (1.5, 'cup', 1.0, 'rice')
+    tokens = normalize_food_query(text).split()
+    if not tokens:
+        return 1.0, None, 1.0, ''
+    quantity, tokens = float(tokens[0]), tokens[1:]
+    unit, size = None, 1.0
+    if len(tokens) > 1 and tokens[0] in SIZES:
+        size, tokens = SIZES[tokens[0]], tokens[1:]
+    if len(tokens) > 1 and (tokens[0] in WEIGHT_UNITS or tokens[0] in CUP_FRACTIONS or tokens[0] in SERVING_UNITS):
+        unit, tokens = tokens[0], tokens[1:]
+    if len(tokens) > 1 and tokens[0] == 'of':
+        tokens = tokens[1:]
+    return quantity, unit, size, ' '.join(tokens)
+
+
+def build(source=SOURCE_PATH, path=None):
+    # Writes the index next to its final path and swaps it in, so readers never see a partial file
+    tmp_path = f'{path}.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.executescript("""
+        CREATE TABLE food (id INTEGER PRIMARY KEY, name TEXT NOT NULL, serving TEXT NOT NULL,
+                           serving_g REAL NOT NULL, cup_g REAL, calories REAL NOT NULL, protein REAL,
+                           carbs REAL, fat REAL, fiber REAL);
+        CREATE TABLE food_term (term TEXT PRIMARY KEY, food_id INTEGER NOT NULL) WITHOUT ROWID;
+        CREATE VIRTUAL TABLE food_prefix USING fts5(term, food_id UNINDEXED, prefix='1 2 3');
+        CREATE VIRTUAL TABLE food_trigram USING fts5(term, food_id UNINDEXED, tokenize='trigram');
+    """)
+    terms = {}
+    with open(source, newline='', encoding='utf-8') as f:
+        for food_id, row in enumerate(csv.DictReader(f), start=1):
+            conn.execute('INSERT INTO food VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                food_id, row['name'], row['serving'], float(row['serving_g']),
+                float(row['cup_g']) if row['cup_g'] else None,
+                *(float(row[nutrient]) for nutrient in NUTRIENTS)
+            ))
+            for name in [row['name']] + [alias for alias in row['aliases'].split('|') if alias]:
+                term = name_key(name)
+                if terms.setdefault(term, food_id) != food_id:
+                    raise ValueError(f'{source}: "{name}" is listed for two foods')
+    conn.executemany('INSERT INTO food_term VALUES (?, ?)', terms.items())
+    conn.executemany('INSERT INTO food_prefix VALUES (?, ?)', terms.items())
+    conn.executemany('INSERT INTO food_trigram VALUES (?, ?)', terms.items())
+    conn.execute("INSERT INTO food_prefix(food_prefix) VALUES ('optimize')")
+    conn.execute("INSERT INTO food_trigram(food_trigram) VALUES ('optimize')")
+    conn.commit()
+    conn.execute('VACUUM')
+    conn.close()
+    os.replace(tmp_path, path)
+    return len(terms)
+
+
+class NutritionIndex:
+    # Read-only lookups against the compiled index; one memory-mapped connection per thread
+
+    def __init__(self, path, source=SOURCE_PATH, suggestion_limit=8):
+        self.path = path
+        self.source = source
+        self.suggestion_limit = suggestion_limit
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counters = {'lookups': 0, 'exact_hits': 0, 'fuzzy_hits': 0, 'misses': 0, 'suggestions': 0}
+
+    def ensure_built(self):
+        # Compiles data/foods.csv when the index is missing or older than the source
+        if not os.path.exists(self.path) or os.path.getmtime(self.path) < os.path.getmtime(self.source):
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            build(self.source, self.path)
+            self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f'file:{self.path}?mode=ro&immutable=1', uri=True)
+            conn.execute('PRAGMA mmap_size = 8388608')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _food(self, food_id):
+        return self._conn().execute('SELECT * FROM food WHERE id = ?', (food_id,)).fetchone()
+
+    def find(self, name):
+        # (food row, how it matched) for a normalized food name, or (None, None)
+        conn = self._conn()
+        candidates = [name]
+        if name.endswith('es'):
+            candidates.append(name[:-2])
+        if name.endswith('s'):
+            candidates.append(name[:-1])
+        for candidate in candidates:
+            row = conn.execute('SELECT food_id FROM food_term WHERE term = ?', (candidate,)).fetchone()
+            if row:
+                return self._food(row[0]), 'exact'
+
+        # Misspellings: candidates sharing trigrams with the name, ranked by similarity
+        grams = {name[i:i + 3] for i in range(len(name) - 2)}
+        if not grams:
+            return None, None
+        rows = conn.execute(
+            'SELECT term, food_id FROM food_trigram WHERE food_trigram MATCH ? ORDER BY rank LIMIT ?',
+            (' OR '.join(f'"{gram}"' for gram in grams), FUZZY_CANDIDATES)
+        ).fetchall()
+        # Only same-length names count: "sweet potato fries" is not a misspelled "sweet potatoes",
+        # and a dish with an extra word is left to Gemini
+        words = len(name.split())
+        scored = [(difflib.SequenceMatcher(None, name, term).ratio(), food_id) for term, food_id in rows
+                  if len(term.split()) == words]
+        if scored:
+            score, food_id = max(scored)
+            if score >= FUZZY_THRESHOLD:
+                return self._food(food_id), 'fuzzy'
+        return None, None
+
+    def lookup(self, text):
+        # Calories and macro grams for a logged item such as "2 slices of pizza", or None when unknown
+        self._count('lookups')
+        quantity, unit, size, name = parse_portion(text)
+        food, matched = self.find(name) if name else (None, None)
+        if food is None and unit:
+            # The "unit" may have been part of the name ("glass noodles")
+            food, matched = self.find(f'{unit} {name}')
+            unit = None
+        if food is None:
+            self._count('misses')
+            return None
+        self._count(f'{matched}_hits')
+
+        if unit in WEIGHT_UNITS:
+            grams = quantity * WEIGHT_UNITS[unit]
+        elif unit in CUP_FRACTIONS:
+            grams = quantity * CUP_FRACTIONS[unit] * (food['cup_g'] or DEFAULT_CUP_GRAMS)
+        else:
+            grams = quantity * size * food['serving_g']
+        return {
+            'food_name': food['name'],
+            'grams': round(grams),
+            'matched': matched,
+            'calories': round(food['calories'] * grams / 100),
+            'nutrients': {macro: round(food[macro] * grams / 100, 1) for macro in MACROS},
+        }
+
+    def suggest(self, text, limit=None):
+        # Type-ahead: names starting with the typed text, then names with a word starting with
+        # each typed word, then a close misspelling. Aliases are shown as typed ("chips").
+        self._count('suggestions')
+        limit = limit or self.suggestion_limit
+        _, _, _, name = parse_portion(text)
+        words = re.findall(r'\w+', name)
+        if not words:
+            return []
+        conn = self._conn()
+        rows = conn.execute(
+            'SELECT term, food_id FROM food_term WHERE term >= ? AND term < ? ORDER BY length(term), term LIMIT ?',
+            (name, name + '\uffff', limit)
+        ).fetchall()
+        rows += conn.execute(
+            'SELECT term, food_id FROM food_prefix WHERE food_prefix MATCH ? ORDER BY rank LIMIT ?',
+            (' '.join(f'"{word}"*' for word in words), limit * 4)
+        ).fetchall()
+        if len(name) >= 4:
+            food, _ = self.find(name)
+            if food is not None:
+                rows.append((food['name'], food['id']))
+
+        suggestions = {}
+        for term, food_id in rows:
+            if food_id in suggestions:
+                continue
+            food = self._food(food_id)
+            suggestions[food_id] = {
+                'food_name': term,
+                'serving': f"1 {food['serving']} ({food['serving_g']:g} g)",
+                'calories': round(food['calories'] * food['serving_g'] / 100),
+            }
+            if len(suggestions) == limit:
+                break
+        return list(suggestions.values())
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or query the offline nutrition index.')
+    parser.add_argument('query', nargs='*', help='foods to look up, e.g. "2 slices of pizza"')
+    parser.add_argument('--rebuild', action='store_true', help='recompile data/foods.csv')
+    parser.add_argument('--suggest', action='store_true', help='show type-ahead suggestions instead')
+    parser.add_argument('--check', action='store_true', help='verify the CHECKS matches and exit')
+    parser.add_argument('--index', default=os.environ.get('NUTRITION_INDEX_PATH',
+                                                         os.path.join('instance', 'nutrition_index.db')))
+    args = parser.parse_args()
+
+    if args.rebuild:
+        print(f'Indexed {build(SOURCE_PATH, args.index)} food names into {args.index}')
+    index = NutritionIndex(args.index)
+    index.ensure_built()
+    if args.check:
+        failed = 0
+        for query, expected in CHECKS:
+            result = index.lookup(query)
+            found = result['food_name'] if result else None
+            if found != expected:
+                failed += 1
+                print(f'{query!r}: expected {expected!r}, got {found!r}')
+        print(f'{len(CHECKS) - failed}/{len(CHECKS)} checks passed')
+        raise SystemExit(1 if failed else 0)
+    for query in args.query:
+        started = time.perf_counter()
+        result = index.suggest(query) if args.suggest else index.lookup(query)
+        print(f'{query!r} ({(time.perf_counter() - started) * 1000:.2f} ms): {result}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+from flask_login import current_user
+
+
+class ResponseCache:
+    # Rendered GET pages kept in memory and served with ETag/Last-Modified so browsers
+    # revalidate with a 304 instead of downloading the page again. Every entry is tagged
+    # with its viewer ('user:<id>') plus any page tags (e.g. 'leaderboard'); invalidate(tag)
+    # bumps the tag's generation so older entries are never served again. Call it after the
+    # write commits: entries rendered from the old data were keyed under the old generation.
+
+    def __init__(self, ttl_seconds=30, max_entries=5000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (body, mimetype, etag, last_modified, expires_at)
+        self._generations = {}         # tag -> generation
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'bypassed': 0, 'not_modified': 0, 'invalidations': 0,
+                          'evictions': 0}
+
+    def cached(self, *page_tags):
+        # Decorator for GET views; only 200 responses are stored
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if request.method != 'GET' or '_flashes' in session:
+                    # Pending flash messages are rendered into (and consumed by) this response
+                    self._count('bypassed')
+                    return view(*args, **kwargs)
+
+                tags = page_tags + (self.user_tag(current_user.id),) if current_user.is_authenticated else page_tags
+                key = self._key(tags)
+                entry = self._get(key)
+                if entry is None:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed or g.pop('response_cache_skip', False):
+                        return response
+                    entry = self._put(key, response)
+                return self._respond(entry)
+            return wrapper
+        return decorator
+
+    def skip(self):
+        # Called by a view whose page is about to change without a write in this process
+        # (e.g. a photo analysed by worker.py); the response is sent but not stored
+        g.response_cache_skip = True
+        self._count('bypassed')
+
+    @staticmethod
+    def user_tag(user_id):
+        return f'user:{user_id}'
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+            self._counters['invalidations'] += len(tags)
+
+    def invalidate_user(self, user_id):
+        self.invalidate(self.user_tag(user_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _key(self, tags):
+        # The date is part of the key so "today" pages roll over at midnight
+        with self._lock:
+            generations = tuple((tag, self._generations.get(tag, 0)) for tag in tags)
+        return request.full_path, datetime.utcnow().date(), generations
+
+    def _get(self, key):
+        if self.ttl_seconds <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[4] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._counters['hits'] += 1
+                return entry
+            self._entries.pop(key, None)
+            self._counters['misses'] += 1
+        return None
+
+    def _put(self, key, response):
+        body = response.get_data()
+        entry = (body, response.mimetype, hashlib.sha256(body).hexdigest()[:32],
+                 datetime.now(timezone.utc).replace(microsecond=0), time.monotonic() + self.ttl_seconds)
+        if self.ttl_seconds > 0:
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._counters['evictions'] += 1
+        return entry
+
+    def _respond(self, entry):
+        body, mimetype, etag, last_modified, _ = entry
+        response = current_app.response_class(body, mimetype=mimetype)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        # Pages include the signed-in user's navigation, so only the browser may keep them,
+        # and it must revalidate before reuse
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response = response.make_conditional(request)
+        if response.status_code == 304:
+            self._count('not_modified')
+        return response
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
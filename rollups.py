@@ -0,0 +1,203 @@
+import argparse
+from datetime import date, timedelta
+
+from sqlalchemy import func
+
+from models import db, User, Department, DepartmentRollup, StepRecord, NutritionRecord, WellnessRecord
+from archive import archived_daily
+from upserts import add_rollup_deltas
+
+# Department aggregates in day, week and month buckets. Writes add deltas to all three
+# buckets in the same transaction as the raw rows (one executemany); rebuild() recomputes
+# them from the raw tables. Activity counts toward the user's department at the time it
+# was written; a rebuild reattributes it to their current department.
+
+PERIODS = ('day', 'week', 'month')
+METRICS = ('steps', 'step_entries', 'calories', 'food_entries', 'mood_total', 'mood_entries',
+           'sleep_total', 'sleep_entries', 'stress_total', 'stress_entries')
+WELLNESS_METRICS = {'mood_score': 'mood', 'sleep_hours': 'sleep', 'stress_level': 'stress'}
+
+
+def bucket_start(period, day):
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def bucket_end(period, day):
+    start = bucket_start(period, day)
+    if period == 'week':
+        return start + timedelta(days=6)
+    if period == 'month':
+        return (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return start
+
+
+class RollupBatch:
+    # Collects deltas per (department, day); apply() adds them to the day, week and month
+    # buckets in the caller's transaction and the caller commits
+
+    def __init__(self):
+        self._deltas = {}
+
+    def add(self, department_id, day, **deltas):
+        if department_id is None:
+            return
+        bucket = self._deltas.setdefault((department_id, day), dict.fromkeys(METRICS, 0))
+        for name, value in deltas.items():
+            bucket[name] += value
+
+    def steps(self, department_id, day, old_steps, new_steps):
+        # old_steps is None when the user had no row for the day yet
+        self.add(department_id, day, steps=new_steps - (old_steps or 0), step_entries=int(old_steps is None))
+
+    def food(self, department_id, day, calories, entries=1):
+        self.add(department_id, day, calories=calories or 0, food_entries=entries)
+
+    def wellness(self, department_id, day, old, new):
+        # old/new: {'mood_score', 'sleep_hours', 'stress_level'}; old is None for a new row
+        old = old or {}
+        deltas = {}
+        for field, name in WELLNESS_METRICS.items():
+            before, after = old.get(field), new.get(field)
+            deltas[f'{name}_total'] = (after or 0) - (before or 0)
+            deltas[f'{name}_entries'] = (after is not None) - (before is not None)
+        self.add(department_id, day, **deltas)
+
+    def rows(self, ranges=None):
+        # ranges: optional {period: (first bucket, last bucket)} limiting which buckets are produced
+        buckets = {}
+        for (department_id, day), deltas in self._deltas.items():
+            if not any(deltas.values()):
+                continue
+            for period in PERIODS:
+                start = bucket_start(period, day)
+                if ranges and not ranges[period][0] <= start <= ranges[period][1]:
+                    continue
+                key = (department_id, period, start)
+                row = buckets.get(key)
+                if row is None:
+                    row = buckets[key] = dict(dict.fromkeys(METRICS, 0), department_id=department_id,
+                                              period=period, bucket_start=start)
+                for name, value in deltas.items():
+                    row[name] += value
+        return list(buckets.values())
+
+    def apply(self):
+        add_rollup_deltas(self.rows())
+        self._deltas = {}
+
+
+def daily_aggregates(start=None, end=None):
+    # Raw tables grouped by (department, date) with one query each
+    batch = RollupBatch()
+    queries = [
+        (StepRecord, lambda m: [func.sum(m.steps), func.count(m.id)], ('steps', 'step_entries')),
+        (NutritionRecord, lambda m: [func.sum(m.calories), func.count(m.id)], ('calories', 'food_entries')),
+        (WellnessRecord, lambda m: [func.sum(m.mood_score), func.count(m.mood_score),
+                                    func.sum(m.sleep_hours), func.count(m.sleep_hours),
+                                    func.sum(m.stress_level), func.count(m.stress_level)],
+         ('mood_total', 'mood_entries', 'sleep_total', 'sleep_entries', 'stress_total', 'stress_entries')),
+    ]
+    departments = None
+    for model, columns, names in queries:
+        query = db.session.query(User.department_id, model.date, *columns(model)).join(
+            User, User.id == model.user_id
+        ).filter(User.department_id.isnot(None))
+        if start:
+            query = query.filter(model.date >= start)
+        if end:
+            query = query.filter(model.date <= end)
+        for department_id, day, *values in query.group_by(User.department_id, model.date):
+            batch.add(department_id, day, **{name: value or 0 for name, value in zip(names, values)})
+        
+        # Days moved to the archive database have no user table to join there
+        archived = archived_daily(model, columns, start, end)
+        if archived and departments is None:
+            departments = dict(db.session.query(User.id, User.department_id).filter(User.department_id.isnot(None)))
+        for user_id, day, *values in archived:
+            if user_id in departments:
+                batch.add(departments[user_id], day, **{name: value or 0 for name, value in zip(names, values)})
+    return batch
+
+
+def rebuild(start=None, end=None):
+    # Recomputes every bucket touching [start, end] (all of history when omitted) from the raw rows
+    ranges = None
+    if start or end:
+        ranges = {period: (bucket_start(period, start) if start else date.min,
+                           bucket_start(period, end) if end else date.max) for period in PERIODS}
+        # Raw days needed to fill the first and last week and month completely
+        if start:
+            start = bucket_start('week', bucket_start('month', start))
+        if end:
+            end = max(bucket_end('week', end), bucket_end('month', end))
+
+    delete = DepartmentRollup.query
+    if ranges:
+        delete = delete.filter(db.or_(*[
+            db.and_(DepartmentRollup.period == period, DepartmentRollup.bucket_start.between(*ranges[period]))
+            for period in PERIODS
+        ]))
+    delete.delete(synchronize_session=False)
+
+    rows = daily_aggregates(start, end).rows(ranges)
+    for offset in range(0, len(rows), 5000):
+        add_rollup_deltas(rows[offset:offset + 5000])
+    db.session.commit()
+    return len(rows)
+
+
+def ensure_built():
+    # First start after the rollup table was added: build it from existing history
+    if db.session.query(DepartmentRollup.id).first() is None and db.session.query(StepRecord.id).first() is not None:
+        rebuild()
+
+
+def summarize(row):
+    averages = {
+        'average_steps': round(row.steps / row.step_entries) if row.step_entries else None,
+        'average_mood': round(row.mood_total / row.mood_entries, 1) if row.mood_entries else None,
+        'average_sleep': round(row.sleep_total / row.sleep_entries, 1) if row.sleep_entries else None,
+        'average_stress': round(row.stress_total / row.stress_entries, 1) if row.stress_entries else None,
+    }
+    return dict(averages, bucket_start=row.bucket_start.isoformat(), steps=row.steps,
+                step_entries=row.step_entries, calories=round(row.calories), food_entries=row.food_entries)
+
+
+def department_series(department_id, period, start, end):
+    rows = DepartmentRollup.query.filter(
+        DepartmentRollup.department_id == department_id,
+        DepartmentRollup.period == period,
+        DepartmentRollup.bucket_start.between(start, end)
+    ).order_by(DepartmentRollup.bucket_start).all()
+    return [summarize(row) for row in rows]
+
+
+def department_ranking(period, start):
+    # Every department's bucket for one period, most steps first
+    rows = db.session.query(DepartmentRollup, Department.name).join(
+        Department, Department.id == DepartmentRollup.department_id
+    ).filter(
+        DepartmentRollup.period == period, DepartmentRollup.bucket_start == start
+    ).order_by(DepartmentRollup.steps.desc()).all()
+    return [dict(summarize(row), department_id=row.department_id, name=name) for row, name in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild department rollups from the raw records.')
+    parser.add_argument('--start', type=date.fromisoformat, help='first date, YYYY-MM-DD')
+    parser.add_argument('--end', type=date.fromisoformat, help='last date, YYYY-MM-DD')
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        count = rebuild(args.start, args.end)
+    print(f"Rebuilt {count} department rollup buckets")
+
+
+if __name__ == '__main__':
+    main()
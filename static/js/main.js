@@ -1,11 +1,18 @@
 // Main JavaScript file for Corporate Wellness application
 
+// Photos are shrunk in the browser before upload; the server re-encodes to the same bound
+const MAX_UPLOAD_DIMENSION = 1024;
+const UPLOAD_JPEG_QUALITY = 0.8;
+
 document.addEventListener('DOMContentLoaded', function() {
     // Initialize any components that need JavaScript
     initializeNavbar();
     
     // Add event listeners for any interactive elements
     addEventListeners();
+    
+    // Leaderboard and totals pushed by the server while the page is open
+    initializeLiveUpdates();
 });
 
 function initializeNavbar() {
@@ -44,25 +51,81 @@ function addEventListeners() {
         });
     }
     
-    // Example: Step counter update button
-    const updateStepsBtn = document.querySelector('.btn-outline-primary');
-    if (updateStepsBtn) {
-        updateStepsBtn.addEventListener('click', function() {
-            // This would be replaced with actual API call in production
-            const randomSteps = Math.floor(Math.random() * 10000);
-            const stepsDisplay = document.querySelector('.card-body h5 .text-primary');
-            if (stepsDisplay) {
-                stepsDisplay.textContent = randomSteps.toLocaleString();
+    // Food image upload: queue the analysis and poll for the result
+    const uploadFoodForm = document.getElementById('uploadFoodForm');
+    if (uploadFoodForm && window.fetch) {
+        uploadFoodForm.addEventListener('submit', function(event) {
+            event.preventDefault();
+            const submitBtn = uploadFoodForm.querySelector('button[type="submit"]');
+            const fileInput = document.getElementById('food_image');
+            if (!fileInput || !fileInput.files.length) {
+                showCalorieResult('Please choose an image first', 'warning');
+                return;
             }
             
-            // Update progress bar
-            const progressPercent = Math.min(100, Math.floor(randomSteps / 100));
-            const progressBar = document.querySelector('.progress-bar');
-            if (progressBar) {
-                progressBar.style.width = `${progressPercent}%`;
-                progressBar.setAttribute('aria-valuenow', progressPercent);
-                progressBar.textContent = `${progressPercent}%`;
-            }
+            submitBtn.disabled = true;
+            downscaleImage(fileInput.files[0], MAX_UPLOAD_DIMENSION, UPLOAD_JPEG_QUALITY)
+                .then(image => {
+                    const formData = new FormData(uploadFoodForm);
+                    formData.set('food_image', image, fileInput.files[0].name);
+                    return fetch(uploadFoodForm.action, {
+                        method: 'POST',
+                        body: formData,
+                        headers: { 'Accept': 'application/json' }
+                    });
+                })
+                .then(response => response.json())
+                .then(data => {
+                    if (!data.success) {
+                        showCalorieResult(data.error || 'Could not upload image', 'danger');
+                    } else if (data.status === 'done') {
+                        window.location.reload();
+                    } else {
+                        const foodName = fileInput.files[0].name.replace(/\.[^.]+$/, '');
+                        addPendingAnalysis(foodName, data.poll_url);
+                        showCalorieResult(`Analyzing ${foodName}...`, 'info');
+                        uploadFoodForm.reset();
+                        if (imagePreview) {
+                            imagePreview.classList.add('d-none');
+                        }
+                    }
+                })
+                .catch(error => {
+                    console.error('Error:', error);
+                    showCalorieResult('Failed to upload image. Please try again.', 'danger');
+                })
+                .finally(() => {
+                    submitBtn.disabled = false;
+                });
+        });
+    }
+    
+    document.querySelectorAll('#pendingAnalysesList [data-job-url]').forEach(item => {
+        pollAnalysisJob(item);
+    });
+    
+    // Step counter: save today's steps without leaving the page
+    const updateStepsForm = document.getElementById('updateStepsForm');
+    if (updateStepsForm && window.fetch) {
+        updateStepsForm.addEventListener('submit', function(event) {
+            event.preventDefault();
+            const submitBtn = updateStepsForm.querySelector('button[type="submit"]');
+            submitBtn.disabled = true;
+            fetch(updateStepsForm.action, {
+                method: 'POST',
+                body: new FormData(updateStepsForm),
+                headers: { 'Accept': 'application/json' }
+            })
+                .then(response => response.json())
+                .then(data => {
+                    if (data.success) {
+                        applyTotals({ steps: data.steps });
+                    }
+                })
+                .catch(error => console.error('Error:', error))
+                .finally(() => {
+                    submitBtn.disabled = false;
+                });
         });
     }
     
@@ -70,15 +133,12 @@ function addEventListeners() {
     const lookupCaloriesBtn = document.getElementById('lookupCaloriesBtn');
     const foodNameInput = document.getElementById('foodNameInput');
     const calorieResult = document.getElementById('calorieResult');
-    const addFoodForm = document.getElementById('addFoodForm');
-    const foodNameField = document.getElementById('food_name');
-    const caloriesField = document.getElementById('calories');
     
     if (lookupCaloriesBtn && foodNameInput && calorieResult) {
         lookupCaloriesBtn.addEventListener('click', function() {
-            const foodName = foodNameInput.value.trim();
+            const foodText = foodNameInput.value.trim();
             
-            if (!foodName) {
+            if (!foodText) {
                 showCalorieResult('Please enter a food name', 'warning');
                 return;
             }
@@ -88,20 +148,22 @@ function addEventListeners() {
             lookupCaloriesBtn.textContent = 'Looking up...';
             showCalorieResult('Searching for calorie information...', 'info');
             
-            // Make API call to Gemini
-            fetch(`/api/gemini/search?foodName=${encodeURIComponent(foodName)}`)
+            // One request for the whole meal; the server splits it on commas
+            fetch('/api/food/batch', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json', 'Accept': 'application/json' },
+                body: JSON.stringify({ text: foodText })
+            })
                 .then(response => response.json())
                 .then(data => {
                     if (data.success) {
-                        // Show the calorie result
-                        showCalorieResult(data.description, 'success');
-                        
-                        // Populate the hidden form and submit it
-                        if (addFoodForm && foodNameField && caloriesField) {
-                            foodNameField.value = data.food_name;
-                            caloriesField.value = data.calories;
-                            addFoodForm.submit();
-                        }
+                        const description = data.items
+                            .map(item => `${item.food_name}: ${item.calories} calories`)
+                            .join(', ');
+                        const missing = data.unresolved.length ? ` (not found: ${data.unresolved.join(', ')})` : '';
+                        showCalorieResult(description + missing, data.unresolved.length ? 'warning' : 'success');
+                        addFoodLogItems(data.items, data.total_calories);
+                        foodNameInput.value = '';
                     } else {
                         showCalorieResult(data.error || 'No calorie information found', 'danger');
                     }
@@ -120,9 +182,97 @@ function addEventListeners() {
         // Allow Enter key to trigger lookup
         foodNameInput.addEventListener('keypress', function(event) {
             if (event.key === 'Enter') {
+                hideFoodSuggestions();
                 lookupCaloriesBtn.click();
             }
         });
+        
+        initializeFoodSuggestions(foodNameInput);
+    }
+}
+
+// Type-ahead for the food search box; suggestions come from the server's offline nutrition index
+const SUGGEST_DELAY_MS = 120;
+
+function initializeFoodSuggestions(input) {
+    const list = document.getElementById('foodSuggestions');
+    if (!list || !window.fetch) {
+        return;
+    }
+    
+    let timer = null;
+    let controller = null;
+    
+    input.addEventListener('input', function() {
+        clearTimeout(timer);
+        // Only the item being typed, i.e. the text after the last comma
+        const current = input.value.split(/[,;]/).pop().trim();
+        if (current.length < 2) {
+            hideFoodSuggestions();
+            return;
+        }
+        
+        timer = setTimeout(() => {
+            if (controller) {
+                controller.abort();
+            }
+            controller = new AbortController();
+            fetch(`/api/food/suggest?q=${encodeURIComponent(current)}`, { signal: controller.signal })
+                .then(response => response.json())
+                .then(data => showFoodSuggestions(input, data.suggestions || []))
+                .catch(() => {});
+        }, SUGGEST_DELAY_MS);
+    });
+    
+    input.addEventListener('keydown', function(event) {
+        if (event.key === 'Escape') {
+            hideFoodSuggestions();
+        }
+    });
+    
+    document.addEventListener('click', function(event) {
+        if (!list.contains(event.target) && event.target !== input) {
+            hideFoodSuggestions();
+        }
+    });
+}
+
+function showFoodSuggestions(input, suggestions) {
+    const list = document.getElementById('foodSuggestions');
+    list.replaceChildren();
+    if (!suggestions.length) {
+        hideFoodSuggestions();
+        return;
+    }
+    
+    suggestions.forEach(suggestion => {
+        const item = document.createElement('button');
+        item.type = 'button';
+        item.className = 'list-group-item list-group-item-action d-flex justify-content-between align-items-center';
+        item.textContent = suggestion.food_name;
+        const detail = document.createElement('small');
+        detail.className = 'text-muted';
+        detail.textContent = `${suggestion.serving} · ${suggestion.calories} cal`;
+        item.appendChild(detail);
+        item.addEventListener('click', function() {
+            // Replace the item being typed, keeping any quantity already entered ("2 ban" -> "2 banana")
+            const parts = input.value.split(/([,;])/);
+            const current = parts.pop();
+            const quantity = (current.match(/^\s*(\d+(\.\d+)?|\d+\/\d+)\s+/) || [''])[0];
+            const lead = parts.length ? ' ' : '';
+            input.value = parts.join('') + lead + quantity.trimStart() + suggestion.food_name;
+            hideFoodSuggestions();
+            input.focus();
+        });
+        list.appendChild(item);
+    });
+    list.classList.remove('d-none');
+}
+
+function hideFoodSuggestions() {
+    const list = document.getElementById('foodSuggestions');
+    if (list) {
+        list.classList.add('d-none');
     }
 }
 
@@ -140,4 +290,189 @@ function showCalorieResult(message, type) {
             }, 5000);
         }
     }
-}
\ No newline at end of file
+}
+
+function addPendingAnalysis(foodName, pollUrl) {
+    const container = document.getElementById('pendingAnalyses');
+    const list = document.getElementById('pendingAnalysesList');
+    if (!container || !list) {
+        return;
+    }
+    
+    const item = document.createElement('li');
+    item.className = 'list-group-item d-flex justify-content-between align-items-center';
+    item.dataset.jobUrl = pollUrl;
+    item.textContent = foodName;
+    const spinner = document.createElement('span');
+    spinner.className = 'spinner-border spinner-border-sm text-primary';
+    spinner.setAttribute('role', 'status');
+    item.appendChild(spinner);
+    list.appendChild(item);
+    container.classList.remove('d-none');
+    
+    pollAnalysisJob(item);
+}
+
+function pollAnalysisJob(item, delay = 1000) {
+    setTimeout(() => {
+        fetch(item.dataset.jobUrl, { headers: { 'Accept': 'application/json' } })
+            .then(response => response.json())
+            .then(data => {
+                if (data.status === 'done') {
+                    // Reload so the food log and totals include the new entry
+                    window.location.reload();
+                } else if (data.status === 'failed' || !data.job_id) {
+                    item.remove();
+                    showCalorieResult(data.error || 'Could not analyze this image.', 'danger');
+                } else {
+                    pollAnalysisJob(item, Math.min(delay * 1.5, 5000));
+                }
+            })
+            .catch(() => pollAnalysisJob(item, 5000));
+    }, delay);
+}
+
+function downscaleImage(file, maxDimension, quality) {
+    // Resolves with a smaller JPEG, or the original file if it cannot or need not be shrunk
+    if (!file.type.startsWith('image/') || !window.createImageBitmap) {
+        return Promise.resolve(file);
+    }
+    
+    return createImageBitmap(file, { imageOrientation: 'from-image' })
+        .then(bitmap => {
+            const scale = Math.min(1, maxDimension / Math.max(bitmap.width, bitmap.height));
+            if (scale === 1 && file.type === 'image/jpeg') {
+                return file;
+            }
+            
+            const canvas = document.createElement('canvas');
+            canvas.width = Math.round(bitmap.width * scale);
+            canvas.height = Math.round(bitmap.height * scale);
+            canvas.getContext('2d').drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+            bitmap.close();
+            
+            return new Promise(resolve => {
+                canvas.toBlob(blob => {
+                    resolve(blob && blob.size < file.size ? blob : file);
+                }, 'image/jpeg', quality);
+            });
+        })
+        .catch(() => file);
+}
+
+function addFoodLogItems(items, totalCalories) {
+    const foodLog = document.getElementById('foodLog');
+    const foodLogList = document.getElementById('foodLogList');
+    if (foodLog && foodLogList) {
+        items.forEach(item => {
+            const entry = document.createElement('li');
+            entry.className = 'list-group-item d-flex justify-content-between align-items-center';
+            const name = document.createElement('span');
+            name.textContent = item.food_name;
+            if (item.protein !== undefined) {
+                const macros = document.createElement('small');
+                macros.className = 'd-block text-muted';
+                macros.textContent = `${item.protein} g protein · ${item.carbs} g carbs · ${item.fat} g fat`;
+                name.appendChild(macros);
+            }
+            entry.appendChild(name);
+            const badge = document.createElement('span');
+            badge.className = 'badge bg-primary rounded-pill';
+            badge.textContent = `${item.calories} cal`;
+            entry.appendChild(badge);
+            foodLogList.prepend(entry);
+        });
+        foodLog.classList.remove('d-none');
+    }
+    
+    const todayCalories = document.getElementById('todayCalories');
+    if (todayCalories) {
+        todayCalories.textContent = totalCalories;
+    }
+    const monthCalories = document.getElementById('monthCalories');
+    if (monthCalories) {
+        const added = items.reduce((sum, item) => sum + item.calories, 0);
+        monthCalories.textContent = (parseFloat(monthCalories.textContent) || 0) + added;
+    }
+}
+// Server-Sent Events: the page carries a signed stream URL when live updates are enabled
+function initializeLiveUpdates() {
+    const liveUrl = document.body.dataset.liveUrl;
+    if (!liveUrl || !window.EventSource) {
+        return;
+    }
+    
+    const source = new EventSource(liveUrl);
+    source.addEventListener('leaderboard', event => {
+        const data = JSON.parse(event.data);
+        updateLeaderboardTable('leaderboardUsers', data.users, user => [
+            user.name, user.department, user.total_steps.toLocaleString()
+        ]);
+        updateLeaderboardTable('leaderboardDepartments', data.departments, department => [
+            department.name, department.total_steps.toLocaleString(), department.average_steps.toLocaleString()
+        ]);
+    });
+    source.addEventListener('totals', event => applyTotals(JSON.parse(event.data)));
+}
+
+function updateLeaderboardTable(tbodyId, entries, cells) {
+    // Rewrites only the rows whose contents changed and briefly highlights them
+    const tbody = document.getElementById(tbodyId);
+    if (!tbody || !entries.length) {
+        return;
+    }
+    
+    Array.from(tbody.rows).forEach(row => {
+        if (row.cells.length === 1) {
+            row.remove();  // "No steps recorded" placeholder
+        }
+    });
+    entries.forEach((entry, index) => {
+        const values = [String(index + 1)].concat(cells(entry));
+        let row = tbody.rows[index];
+        if (!row) {
+            row = tbody.insertRow();
+            values.forEach(() => row.insertCell());
+        }
+        let changed = false;
+        values.forEach((value, column) => {
+            if (row.cells[column].textContent !== value) {
+                row.cells[column].textContent = value;
+                changed = true;
+            }
+        });
+        if (changed) {
+            row.classList.add('table-success');
+            setTimeout(() => row.classList.remove('table-success'), 1500);
+        }
+    });
+    while (tbody.rows.length > entries.length) {
+        tbody.deleteRow(-1);
+    }
+}
+
+function applyTotals(totals) {
+    if (totals.steps !== undefined) {
+        const todaySteps = document.getElementById('todaySteps');
+        if (todaySteps) {
+            todaySteps.textContent = totals.steps.toLocaleString();
+        }
+        const progressPercent = Math.min(100, Math.floor(totals.steps / 100));
+        const progressBar = document.getElementById('stepProgress');
+        if (progressBar) {
+            progressBar.style.width = `${progressPercent}%`;
+            progressBar.setAttribute('aria-valuenow', progressPercent);
+            progressBar.textContent = `${progressPercent}%`;
+        }
+    }
+    if (totals.calories !== undefined) {
+        const todayCalories = document.getElementById('todayCalories');
+        if (todayCalories) {
+            todayCalories.textContent = totals.calories;
+        }
+        const monthCalories = document.getElementById('monthCalories');
+        if (monthCalories) {
+            monthCalories.textContent = totals.monthly_calories;
+        }
+    }
+}
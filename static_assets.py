@@ -0,0 +1,54 @@
+import hashlib
+import os
+import threading
+
+from flask import request
+
+
+class StaticAssets:
+    # url_for('static', ...) gets a ?v=<content hash> fingerprint, and requests carrying the
+    # current fingerprint are cached by browsers for max_age without revalidating. Editing a
+    # file changes its URL, so nobody is served a stale copy after a deploy.
+
+    def __init__(self, max_age=365 * 24 * 3600):
+        self.max_age = max_age
+        self._versions = {}  # filename -> (mtime_ns, size, fingerprint)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        app.url_defaults(self._add_version)
+        app.after_request(self._cache_headers)
+
+    def version(self, filename):
+        # Hashes a file again only when its mtime or size changes
+        path = os.path.join(self.static_folder, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        cached = self._versions.get(filename)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        with open(path, 'rb') as f:
+            fingerprint = hashlib.sha256(f.read()).hexdigest()[:12]
+        with self._lock:
+            self._versions[filename] = (stat.st_mtime_ns, stat.st_size, fingerprint)
+        return fingerprint
+
+    def _add_version(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            fingerprint = self.version(values['filename'])
+            if fingerprint:
+                values['v'] = fingerprint
+
+    def _cache_headers(self, response):
+        if request.endpoint != 'static' or response.status_code not in (200, 304):
+            return response
+        filename = (request.view_args or {}).get('filename')
+        if filename and request.args.get('v') == self.version(filename):
+            response.cache_control.public = True
+            response.cache_control.no_cache = None
+            response.cache_control.max_age = self.max_age
+            response.cache_control.immutable = True
+        return response
@@ -0,0 +1,141 @@
+from datetime import datetime
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, StepRecord, WellnessRecord, DepartmentRollup, FoodLookupCacheEntry, FoodImageAnalysis
+
+# Single-statement INSERT ... ON CONFLICT DO UPDATE writes for the one-row-per-day
+# tables. They rely on the unique (user_id|department_id, date) indexes and run in the
+# caller's session transaction; the caller commits. The write_* variants also return the
+# values they replaced, for the department rollup deltas.
+
+# The databases these statements can be written for; database.configure_database refuses
+# any other DATABASE_URL at startup
+DIALECT_INSERTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+
+def _insert(model):
+    return DIALECT_INSERTS[db.session.get_bind().dialect.name](model.__table__)
+
+
+def upsert_steps_statement():
+    statement = _insert(StepRecord)
+    return statement.on_conflict_do_update(
+        index_elements=['user_id', 'date'],
+        set_={'steps': statement.excluded.steps, 'updated_at': statement.excluded.updated_at}
+    )
+
+
+def upsert_steps(user_id, date, steps):
+    now = datetime.utcnow()
+    db.session.execute(upsert_steps_statement().values(
+        user_id=user_id, date=date, steps=steps, created_at=now, updated_at=now
+    ))
+
+
+def upsert_steps_many(rows):
+    # rows: [{'user_id', 'date', 'steps'}], sent as one executemany
+    now = datetime.utcnow()
+    params = [dict(row, goal=row.get('goal', 10000), created_at=now, updated_at=now) for row in rows]
+    if params:
+        db.session.execute(upsert_steps_statement(), params)
+
+
+def _insert_new(model, rows):
+    # Inserts the rows whose (user_id, date) is still free and returns the keys it inserted.
+    # The statement also takes SQLite's write lock, so nothing else changes until commit.
+    table = model.__table__
+    statement = _insert(model).on_conflict_do_nothing(index_elements=['user_id', 'date'])
+    return {tuple(row) for row in db.session.execute(statement.returning(table.c.user_id, table.c.date), rows)}
+
+
+def _lock_existing(model, columns, keys):
+    # {(user_id, date): row} for rows that already existed, locked (FOR UPDATE on PostgreSQL)
+    # in key order so the values read are the ones the following update replaces
+    if not keys:
+        return {}
+    query = select(model.user_id, model.date, *columns).where(
+        tuple_(model.user_id, model.date).in_(sorted(keys))
+    ).order_by(model.user_id, model.date).with_for_update()
+    return {(row.user_id, row.date): row for row in db.session.execute(query)}
+
+
+def write_steps_many(rows):
+    # Like upsert_steps_many, but returns {(user_id, date): old steps} for the rows it
+    # overwrote, read atomically with the write; rows needs one entry per user-day
+    now = datetime.utcnow()
+    params = sorted((dict(row, goal=row.get('goal', 10000), created_at=now, updated_at=now) for row in rows),
+                    key=lambda row: (row['user_id'], row['date']))
+    if not params:
+        return {}
+    inserted = _insert_new(StepRecord, params)
+    existing = [row for row in params if (row['user_id'], row['date']) not in inserted]
+    previous = {key: row.steps for key, row in _lock_existing(
+        StepRecord, [StepRecord.steps], {(row['user_id'], row['date']) for row in existing}).items()}
+    if existing:
+        db.session.execute(upsert_steps_statement(), existing)
+    return previous
+
+
+def write_steps(user_id, date, steps):
+    # Returns the steps this replaced, or None when the day had no row yet
+    return write_steps_many([{'user_id': user_id, 'date': date, 'steps': steps}]).get((user_id, date))
+
+
+def write_wellness(user_id, date, **fields):
+    # Returns the previous mood_score, sleep_hours and stress_level, or None for a new row
+    if _insert_new(WellnessRecord, [dict(fields, user_id=user_id, date=date, created_at=datetime.utcnow())]):
+        return None
+    row = _lock_existing(WellnessRecord, [WellnessRecord.mood_score, WellnessRecord.sleep_hours,
+                                          WellnessRecord.stress_level], {(user_id, date)})[(user_id, date)]
+    upsert_wellness(user_id, date, **fields)
+    return {name: getattr(row, name) for name in ('mood_score', 'sleep_hours', 'stress_level')}
+
+
+def upsert_wellness(user_id, date, **fields):
+    statement = _insert(WellnessRecord).values(
+        user_id=user_id, date=date, created_at=datetime.utcnow(), **fields
+    )
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['user_id', 'date'],
+        set_={name: getattr(statement.excluded, name) for name in fields}
+    ))
+
+
+def add_rollup_deltas(rows):
+    # rows: [{'department_id', 'period', 'bucket_start', <metric>: delta}], added onto the stored buckets
+    if not rows:
+        return
+    statement = _insert(DepartmentRollup)
+    table = DepartmentRollup.__table__
+    metrics = [name for name in rows[0] if name not in ('department_id', 'period', 'bucket_start')]
+    now = datetime.utcnow()
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['department_id', 'period', 'bucket_start'],
+        set_=dict({name: table.c[name] + statement.excluded[name] for name in metrics}, updated_at=now)
+    ), [dict(row, updated_at=now) for row in rows])
+
+
+def upsert_food_cache_entry(query_key, food_name, calories):
+    # Stores a lookup result, replacing (and restarting the TTL of) any entry for the same key
+    now = datetime.utcnow()
+    statement = _insert(FoodLookupCacheEntry).values(
+        query_key=query_key, food_name=food_name, calories=calories, hits=0, created_at=now, last_used_at=now
+    )
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['query_key'],
+        set_={name: getattr(statement.excluded, name) for name in ('food_name', 'calories', 'created_at', 'last_used_at')}
+    ))
+
+
+def insert_image_analysis(content_hash, perceptual_hash, calories, user_id):
+    # First estimate for a photo wins; a copy analyzed at the same time elsewhere is ignored
+    now = datetime.utcnow()
+    db.session.execute(_insert(FoodImageAnalysis).values(
+        content_hash=content_hash, perceptual_hash=perceptual_hash, calories=calories, user_id=user_id,
+        hits=0, created_at=now, last_used_at=now
+    ).on_conflict_do_nothing(index_elements=['content_hash']))
@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy.orm import Session, joinedload
+
+from models import db, User
+
+
+class UserCache:
+    # Detached User snapshots (with their department loaded) kept for ttl_seconds, so an
+    # authenticated request costs no query to load current_user. Each request gets its own
+    # copy through merge(load=False), which attaches it to the session without a SELECT.
+    # Other processes keep their snapshot until it expires, which bounds how stale it can be.
+
+    def __init__(self, ttl_seconds=60, max_entries=10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # user_id -> (snapshot, expires_at)
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+
+    def get(self, user_id):
+        snapshot = self._cached(user_id)
+        if snapshot is None:
+            snapshot = self._load(user_id)
+            if snapshot is None:
+                return None
+            self._store(user_id, snapshot)
+        return db.session.merge(snapshot, load=False)
+
+    def _cached(self, user_id):
+        if self.ttl_seconds <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                self._counters['hits'] += 1
+                return entry[0]
+            self._entries.pop(user_id, None)
+            self._counters['misses'] += 1
+        return None
+
+    def _load(self, user_id):
+        # A private session keeps the snapshot out of the request's identity map
+        with Session(db.engine, expire_on_commit=False) as session:
+            user = session.get(User, user_id, options=[joinedload(User.department)])
+            session.expunge_all()
+            return user
+
+    def _store(self, user_id, snapshot):
+        if self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (snapshot, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def invalidate(self, user_id):
+        # Call after committing a change to the user row (login, department, profile)
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self._counters['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
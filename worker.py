@@ -0,0 +1,29 @@
+import argparse
+import os
+import signal
+import threading
+
+# Keep the imported app from starting its own in-process workers
+os.environ['ANALYSIS_WORKERS'] = '0'
+
+from app import analysis_queue
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run food image analysis workers outside the web process.')
+    parser.add_argument('--threads', type=int, default=4, help='worker threads in this process')
+    args = parser.parse_args()
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    signal.signal(signal.SIGINT, lambda *_: stopped.set())
+
+    analysis_queue.workers = args.threads
+    analysis_queue.start()
+    print(f"Analysis worker running with {args.threads} threads.")
+    stopped.wait()
+    analysis_queue.stop()
+
+
+if __name__ == '__main__':
+    main()